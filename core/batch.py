@@ -0,0 +1,137 @@
+# Python
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import logging
+import os
+import sys
+import time
+
+# Local
+from .cpu.roms import SharedRomImage
+from .snapshot import digest
+from .systems import Intel8080System
+
+logger = logging.getLogger('Batch')
+
+# A manifest is a JSON list of jobs, each an object with
+#   rom           the ROM file, relative to the manifest
+#   cycles        T-states to run it for at most
+#   translate     run translated blocks, default false
+#   load_address  where the ROM is mapped and run from, default 0
+#   name          reported with the result, default the ROM file
+def load_manifest(path):
+    with open(path) as f:
+        jobs = json.load(f)
+
+    base = os.path.dirname(os.path.abspath(path))
+
+    for index, job in enumerate(jobs):
+        for key in ('rom', 'cycles'):
+            if key not in job:
+                raise ValueError('Job {0} has no {1!r}'.format(index, key))
+
+        job['rom'] = os.path.join(base, job['rom'])
+        job.setdefault('name', os.path.basename(job['rom']))
+
+    return jobs
+
+# Per worker process, the shared ROM images attached so far, by name
+_IMAGES = {}
+
+def _image(name, size, filename):
+    image = _IMAGES.get(name)
+    if image is None:
+        image = _IMAGES[name] = SharedRomImage(name, size, filename)
+
+    return image
+
+# Runs one job unthrottled in a worker, with its ROM given as the name,
+# size and file of a SharedRomImage. exit is 'ended' when the PC left the
+# ROM, 'halted' when the limit was reached in HLT, 'limit' when it was
+# reached running and 'error' when the run raised.
+def run_job(job, rom):
+    start = time.perf_counter()
+    result = {'name': job['name'], 'rom': job['rom']}
+
+    try:
+        system = Intel8080System(None, translate=job.get('translate', False))
+        cpu = system._CPU
+        cpu.map_rom(_image(*rom), job.get('load_address', 0))
+        cpu.set_program_counter(job.get('load_address', 0))
+        ran = system.run_for(job['cycles'])
+    except Exception as e:
+        result.update(exit='error', error=repr(e),
+            wall_time=time.perf_counter() - start)
+        return result
+
+    if ran < job['cycles']:
+        state = 'ended'
+    elif cpu.registers.halted:
+        state = 'halted'
+    else:
+        state = 'limit'
+
+    result.update(exit=state, cycles=cpu.cycles, pc=cpu.registers.pc,
+        wall_time=time.perf_counter() - start, hash=digest(system).hex())
+    return result
+
+# Runs every job of the manifest across workers processes, by default one
+# per core, writing each result to output as a JSON line as soon as it is
+# in. Every ROM is loaded once into shared memory for all the workers. The
+# jobs of a ROM that fails to load get an 'error' result without running.
+# Returns the number of jobs that raised.
+def run(manifest, output=sys.stdout, workers=None):
+    jobs = load_manifest(manifest)
+    images = {}
+    failed = {}
+    errors = 0
+
+    def write(result):
+        output.write(json.dumps(result) + '\n')
+        output.flush()
+
+    try:
+        for job in jobs:
+            rom = job['rom']
+            if rom in images or rom in failed:
+                continue
+
+            try:
+                images[rom] = SharedRomImage.load(rom)
+            except Exception as e:
+                logger.error('Cannot load %s: %r', rom, e)
+                failed[rom] = repr(e)
+
+        with ProcessPoolExecutor(workers or os.cpu_count()) as executor:
+            futures = {}
+
+            for index, job in enumerate(jobs):
+                if job['rom'] in failed:
+                    errors += 1
+                    write({'job': index, 'name': job['name'],
+                        'rom': job['rom'], 'exit': 'error',
+                        'error': failed[job['rom']], 'wall_time': 0.0})
+                    continue
+
+                image = images[job['rom']]
+                futures[executor.submit(run_job, job, (image.name,
+                    image.size, image.filename))] = index
+
+            for future in as_completed(futures):
+                result = dict(job=futures[future], **future.result())
+                errors += result['exit'] == 'error'
+                write(result)
+    finally:
+        for image in images.values():
+            image.close()
+
+    logger.info('Ran %d jobs from %s, %d errors', len(jobs), manifest,
+        errors)
+    return errors
+
+def main(manifest, output=None, workers=None):
+    if output is None:
+        return not run(manifest, sys.stdout, workers)
+
+    with open(output, 'w') as f:
+        return not run(manifest, f, workers)
@@ -0,0 +1,166 @@
+# Python
+from datetime import datetime
+import json
+import logging
+import math
+import os
+import platform
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Local
+from core.cpu.cpus import CPU
+from .workloads import WORKLOADS
+
+logger = logging.getLogger('Benchmark')
+
+MODES = {
+    'interpreted': {},
+    'lazy': {'lazy_flags': True},
+    'translated': {'translate': True}
+}
+
+# A run counts as a regression when its mean rate is more than THRESHOLD
+# below the baseline and Welch's t statistic exceeds T_CRITICAL
+THRESHOLD = 0.02
+T_CRITICAL = 3.0
+
+def _instructions(code):
+    cpu = CPU()
+    cpu.load(code)
+    count = 0
+
+    while cpu.step():
+        count += 1
+
+    return count, cpu.cycles
+
+# Times the engine's own run loop to the end of the code, without the
+# budget checks of run_for
+def _sample(code, kwargs):
+    cpu = CPU(**kwargs)
+    cpu.load(code)
+
+    start = time.perf_counter()
+    cpu.run_to_end()
+    return time.perf_counter() - start
+
+# Peak resident set size of this process in KiB, None where unsupported
+def peak_rss():
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux KiB
+    return rss // 1024 if platform.system() == 'Darwin' else rss
+
+def run(repeat=5, workloads=None, modes=None):
+    results = {}
+
+    for name in workloads or sorted(WORKLOADS):
+        code = WORKLOADS[name]()
+        instructions, cycles = _instructions(code)
+
+        for mode in modes or sorted(MODES):
+            seconds = [_sample(code, MODES[mode]) for _ in range(repeat)]
+            rates = [instructions / s for s in seconds]
+            mean, stdev = _mean_stdev(rates)
+
+            results['{0}/{1}'.format(name, mode)] = {
+                'instructions': instructions,
+                'cycles': cycles,
+                'seconds': seconds,
+                'ips': mean,
+                'ips_stdev': stdev,
+                # From the mean rate too, so both describe the same runs
+                'mhz': mean * cycles / instructions / 1e6
+            }
+            logger.info('%s/%s: %.0f instr/s', name, mode, mean)
+
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'peak_rss_kib': peak_rss(),
+        'results': results
+    }
+
+def _mean_stdev(values):
+    mean = sum(values) / len(values)
+
+    if len(values) < 2:
+        return mean, 0.0
+
+    variance = sum((v - mean) ** 2 for v in values) / (len(values) - 1)
+    return mean, math.sqrt(variance)
+
+# Compares every benchmark in current with the same one in baseline and
+# returns (name, relative change in instr/s, t statistic, regressed)
+def compare(baseline, current):
+    rows = []
+
+    for name, result in sorted(current['results'].items()):
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+
+        n1 = len(previous['seconds'])
+        n2 = len(result['seconds'])
+        error = math.sqrt(previous['ips_stdev'] ** 2 / n1
+            + result['ips_stdev'] ** 2 / n2)
+        delta = result['ips'] - previous['ips']
+        if error:
+            t = delta / error
+        else:
+            t = math.copysign(math.inf, delta) if delta else 0.0
+        change = delta / previous['ips']
+        regressed = change < -THRESHOLD and -t > T_CRITICAL
+
+        rows.append((name, change, t, regressed))
+
+    return rows
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+
+    with open(path) as f:
+        return json.load(f)
+
+def save_history(path, history):
+    with open(path, 'w') as f:
+        json.dump(history, f, indent=1)
+
+def report(current, rows):
+    lines = []
+
+    for name, result in sorted(current['results'].items()):
+        lines.append('{0:24} {1:12,.0f} instr/s {2:7.3f} MHz'.format(name,
+            result['ips'], result['mhz']))
+
+    if current['peak_rss_kib'] is not None:
+        lines.append('peak RSS {0:,} KiB'.format(current['peak_rss_kib']))
+
+    for name, change, t, regressed in rows:
+        lines.append('{0:24} {1:+7.1%} t={2:+.1f}{3}'.format(name, change, t,
+            '  REGRESSION' if regressed else ''))
+
+    return '\n'.join(lines)
+
+# Runs the suite, compares it against the last run in the history file and
+# appends it there. Returns True when nothing regressed.
+def main(path, repeat=5):
+    history = load_history(path)
+    current = run(repeat)
+    rows = compare(history[-1], current) if history else []
+
+    print(report(current, rows))
+
+    history.append(current)
+    save_history(path, history)
+
+    return not any(regressed for _, _, _, regressed in rows)
@@ -0,0 +1,125 @@
+# Synthetic 8080 programs for the benchmark. Each one ends by jumping to the
+# first address past its code, which stops CPU.run.
+
+# Assembles a list of opcode bytes, 'label:' definitions and 'label'
+# references, which emit the label's address little-endian
+def _assemble(*parts):
+    labels = {}
+    address = 0
+
+    for part in parts:
+        if isinstance(part, str):
+            if part.endswith(':'):
+                labels[part[:-1]] = address
+            else:
+                address += 2
+        else:
+            address += 1
+
+    labels['end'] = address
+    code = bytearray()
+
+    for part in parts:
+        if isinstance(part, str):
+            if not part.endswith(':'):
+                code += labels[part].to_bytes(2, byteorder='little')
+        else:
+            code.append(part)
+
+    return code
+
+def _count(count):
+    return count & 0xff, count >> 8
+
+# Register and immediate ALU operations, count times
+def alu_loop(count=0x4000):
+    return _assemble(
+        0x11, *_count(count),       # LXI D, count
+        'loop:',
+        0x80,                       # ADD B
+        0x91,                       # SUB C
+        0xa4,                       # ANA H
+        0xad,                       # XRA L
+        0xb0,                       # ORA B
+        0xc6, 0x11,                 # ADI 0x11
+        0xb9,                       # CMP C
+        0x04,                       # INR B
+        0x0d,                       # DCR C
+        0x1b,                       # DCX D
+        0x7a,                       # MOV A, D
+        0xb3,                       # ORA E
+        0xc2, 'loop',               # JNZ loop
+        0xc3, 'end')                # JMP end
+
+# Copies 256 bytes from $4000 to $8000, passes times
+def memcpy_loop(passes=0x40):
+    return _assemble(
+        0x06, passes & 0xff,        # MVI B, passes
+        'outer:',
+        0x21, 0x00, 0x40,           # LXI H, $4000
+        0x11, 0x00, 0x80,           # LXI D, $8000
+        0x0e, 0x00,                 # MVI C, 0
+        'copy:',
+        0x7e,                       # MOV A, M
+        0x12,                       # STAX D
+        0x23,                       # INX H
+        0x13,                       # INX D
+        0x0d,                       # DCR C
+        0xc2, 'copy',               # JNZ copy
+        0x05,                       # DCR B
+        0xc2, 'outer',              # JNZ outer
+        0xc3, 'end')                # JMP end
+
+# Recurses depth levels deep, count times
+def call_recursion(count=0x0800, depth=16):
+    return _assemble(
+        0x31, 0x00, 0xf0,           # LXI SP, $f000
+        0x11, *_count(count),       # LXI D, count
+        'outer:',
+        0x3e, depth & 0xff,         # MVI A, depth
+        0xcd, 'recurse',            # CALL recurse
+        0x1b,                       # DCX D
+        0x7a,                       # MOV A, D
+        0xb3,                       # ORA E
+        0xc2, 'outer',              # JNZ outer
+        0xc3, 'end',                # JMP end
+        'recurse:',
+        0x3d,                       # DCR A
+        0xc8,                       # RZ
+        0xcd, 'recurse',            # CALL recurse
+        0xc9)                       # RET
+
+# Conditional jumps on a rotating bit pattern, count times
+def branch_mix(count=0x2000):
+    return _assemble(
+        0x11, *_count(count),       # LXI D, count
+        0x3e, 0x5a,                 # MVI A, 0x5a
+        'loop:',
+        0x07,                       # RLC
+        0xda, 'carry',              # JC carry
+        0x04,                       # INR B
+        'carry:',
+        0xb7,                       # ORA A
+        0xfa, 'minus',              # JM minus
+        0x0c,                       # INR C
+        'minus:',
+        0xea, 'even',               # JPE even
+        0x05,                       # DCR B
+        'even:',
+        0xca, 'zero',               # JZ zero
+        0x0d,                       # DCR C
+        'zero:',
+        0x67,                       # MOV H, A
+        0x1b,                       # DCX D
+        0x7a,                       # MOV A, D
+        0xb3,                       # ORA E
+        0x7c,                       # MOV A, H
+        0xc2, 'loop',               # JNZ loop
+        0xc3, 'end')                # JMP end
+
+WORKLOADS = {
+    'alu': alu_loop,
+    'memcpy': memcpy_loop,
+    'calls': call_recursion,
+    'branches': branch_mix
+}
@@ -0,0 +1,269 @@
+# Python
+from functools import lru_cache
+import logging
+import re
+
+# Local
+from .instructions import (ADDRESS, CYCLES, IMMEDIATE, TAKEN_CYCLES,
+    build_function, source)
+
+MAX_BLOCK_LENGTH = 32
+
+# Upper bound on the T-states of one block, taken branches included
+MAX_BLOCK_CYCLES = MAX_BLOCK_LENGTH * max(CYCLES) + TAKEN_CYCLES
+
+# IN/OUT talk to devices and EI/DI/HLT change interrupt state, so they are
+# always left to the interpreter and end the block in front of them
+_BARRIERS = ('HLT', 'EI', 'DI', 'IN', 'OUT')
+
+# (size, ends block, translatable) for every opcode
+_SHAPES = []
+for _opcode in range(256):
+    _family, _, _size, _jumps = source(_opcode)
+    _SHAPES.append((_size, _jumps, _family not in _BARRIERS))
+
+# Instructions that may write memory, and so may patch the running block
+_STORES = ('write_byte', '_push(')
+
+_REGISTER = re.compile(r'\br\.([abcdehlf])\b')
+_LOCAL = re.compile(r'\b(r[abcdehlf])\b')
+_PC_OFFSET = re.compile(r'\br\.pc \+ (\d+)')
+_TARGETS = re.compile(r'\s*([\w, ]+?) [|^&]?= ')
+_FLAGS_WRITE = 'rf = '
+
+_MATERIALIZE = """
+if r.lazy_aux is not None:
+    r.materialize_flags()
+"""
+
+# The instruction's template body with its operands and its own address
+# baked in, and registers moved into the locals ra, rb, ... rf
+def _instruction(code, offset, address):
+    _, body, size, jumps = source(code[offset])
+
+    if size == 3:
+        body = body.replace(ADDRESS,
+            '0x{0:04x}'.format(code[offset + 1] | code[offset + 2] << 8))
+    elif size == 2:
+        body = body.replace(IMMEDIATE, '0x{0:02x}'.format(code[offset + 1]))
+
+    body = _PC_OFFSET.sub(lambda match: '0x{0:04x}'.format(
+        (address + int(match.group(1))) & 0xffff), body)
+
+    return _REGISTER.sub(r'r\1', body).strip().splitlines(), size, jumps
+
+# Drops every full flag write that a later instruction in the block
+# overwrites before anything reads it. The flags are live after every
+# instruction in exits, where the block may be left early.
+def _eliminate_dead_flags(bodies, exits):
+    live = True
+
+    for index, lines in reversed(list(enumerate(bodies))):
+        if index in exits:
+            live = True
+
+        reads = False
+        writes = False
+
+        for number, line in enumerate(lines):
+            if (line.startswith(_FLAGS_WRITE)
+                    and 'rf' not in _LOCAL.findall(line[len(_FLAGS_WRITE):])):
+                writes = True
+                if not live:
+                    lines[number] = ''
+            elif 'rf' in _LOCAL.findall(line):
+                reads = True
+
+        if reads:
+            live = True
+        elif writes:
+            live = False
+
+def _registers(lines):
+    used = set()
+    written = set()
+
+    for line in lines:
+        used.update(_LOCAL.findall(line))
+        match = _TARGETS.match(line)
+        if match:
+            written.update(name.strip() for name in match.group(1).split(','))
+
+    return sorted(used), sorted(written & used)
+
+# Shared by every CPU, so instances running the same code compile it once.
+# After every store but the last the block checks whether it evicted
+# itself, i.e. patched its own code, and if so returns early with the
+# registers and PC of the next instruction, the T-states it did not run
+# given back and the number of instructions it did.
+@lru_cache(maxsize=4096)
+def _translate(address, code):
+    bodies = []
+    # (instruction count, next address, T-states left) after every store
+    exits = {}
+    offset = 0
+
+    while offset < len(code):
+        lines, size, jumps = _instruction(code, offset, address + offset)
+        if any(store in line for line in lines for store in _STORES):
+            exits[len(bodies)] = (len(bodies) + 1, address + offset + size,
+                sum(CYCLES[code[later]] for later in _starts(code,
+                    offset + size)))
+        bodies.append(lines)
+        offset += size
+
+    exits.pop(len(bodies) - 1, None)
+    _eliminate_dead_flags(bodies, exits)
+    used, written = _registers([line for body in bodies for line in body])
+    commit = ['r.{0} = {1}'.format(name[1], name) for name in written]
+
+    lines = []
+    for index, body in enumerate(bodies):
+        lines.extend(line for line in body if line)
+
+        if index in exits:
+            count, next_address, left = exits[index]
+            lines.append('if cpu._blocks.evicted:')
+            lines.extend('    ' + line for line in commit + [
+                'r.pc = 0x{0:04x}'.format(next_address & 0xffff),
+                'cpu.cycles -= {0}'.format(left),
+                'return {0}'.format(count)])
+
+    prologue = ['r = cpu.registers']
+    if 'rf' in used:
+        prologue.extend(_MATERIALIZE.strip().splitlines())
+    prologue.extend('{0} = r.{1}'.format(name, name[1]) for name in used)
+
+    epilogue = list(commit)
+    if not jumps:
+        epilogue.append('r.pc = 0x{0:04x}'.format((address + offset) & 0xffff))
+
+    return build_function('block_{0:04x}'.format(address),
+        '\n'.join(prologue + lines + epilogue),
+        '<block 0x{0:04x}>'.format(address))
+
+# Offsets of the instructions in code from offset on
+def _starts(code, offset):
+    while offset < len(code):
+        yield offset
+        offset += source(code[offset])[2]
+
+class BlockCache(object):
+    logger = logging.getLogger('BlockCache')
+
+    def __init__(self, cpu):
+        self._cpu = cpu
+        self._blocks = {}
+
+        # The start of the block running, and whether a write evicted it
+        self._running = None
+        self.evicted = False
+
+        # page -> {start: end} of every cached block overlapping it
+        self._pages = {}
+        cpu.ram.subscribe(self.invalidate)
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def clear(self):
+        for page in self._pages:
+            self._cpu.ram.unwatch(page)
+
+        self._blocks.clear()
+        self._pages.clear()
+
+    def _add(self, start, end, block):
+        self._blocks[start] = block
+
+        for page in range(start >> 8, ((end - 1) >> 8) + 1):
+            blocks = self._pages.get(page)
+            if blocks is None:
+                blocks = self._pages[page] = {}
+                self._cpu.ram.watch(page)
+            blocks[start] = end
+
+    def _evict(self, start, end):
+        del self._blocks[start]
+
+        for page in range(start >> 8, ((end - 1) >> 8) + 1):
+            blocks = self._pages[page]
+            del blocks[start]
+            if not blocks:
+                del self._pages[page]
+                self._cpu.ram.unwatch(page)
+
+    # Memory subscriber, evicts the blocks overlapping the written range.
+    # A block that writes into its own code leaves after that store.
+    def invalidate(self, start, end):
+        for page in range(start >> 8, ((end - 1) >> 8) + 1):
+            blocks = self._pages.get(page)
+            if not blocks:
+                continue
+
+            for address, block_end in list(blocks.items()):
+                if address < end and start < block_end:
+                    if address == self._running:
+                        self.evicted = True
+
+                    BlockCache.logger.debug('Evicted $%04x-$%04x', address,
+                        block_end)
+                    self._evict(address, block_end)
+
+    # Decodes the straight-line run starting at address. A run ends after the
+    # first instruction that sets the PC, in front of a barrier, at the end
+    # of the code or after MAX_BLOCK_LENGTH instructions.
+    def _decode(self, address):
+        read_byte = self._cpu.ram.read_byte
+        limit = self._cpu.end
+        end = address
+        count = 0
+        cycles = 0
+
+        while count < MAX_BLOCK_LENGTH and end < limit:
+            opcode = read_byte(end)
+            size, jumps, translatable = _SHAPES[opcode]
+            if not translatable or end + size > limit:
+                break
+
+            cycles += CYCLES[opcode]
+            end += size
+            count += 1
+            if jumps:
+                break
+
+        return end, count, cycles
+
+    def lookup(self, address):
+        block = self._blocks.get(address)
+
+        if block is None:
+            end, count, cycles = self._decode(address)
+
+            if count:
+                handler = _translate(address,
+                    self._cpu.ram.read_bytes(address, end - address))
+                BlockCache.logger.debug('Translated $%04x-$%04x, %d '
+                    'instructions', address, end, count)
+            else:
+                opcode = self._cpu.ram.read_byte(address)
+                handler = self._cpu._instructions[opcode]
+                count = 1
+                cycles = CYCLES[opcode]
+                end = address + 1
+
+            block = (handler, count, cycles)
+            self._add(address, end, block)
+
+        return block
+
+    # Runs the block at the PC and returns how many instructions it executed
+    def execute(self):
+        cpu = self._cpu
+        pc = cpu.registers.pc
+        handler, count, cycles = self._blocks.get(pc) or self.lookup(pc)
+        self._running = pc
+        self.evicted = False
+        cpu.cycles += cycles
+
+        return handler(cpu) or count
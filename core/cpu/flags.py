@@ -1,23 +1,43 @@
-def get_bit(value, index):
-    return value & (1 << index)
+# Bit positions of the flags in the PSW byte
+S = 0x80
+Z = 0x40
+AC = 0x10
+P = 0x04
+CY = 0x01
 
-def zero_bit(value):
-    return not bool(value)
+def parity_bit(value):
+    return (bin(value).count('1') % 2) == 0
 
-def sign_bit(value):
-    return (0 != get_bit(value, 7))
+# Sign, zero and parity bits of every byte value, with the always-set bit 1
+# of the PSW folded in, so a flag update is one table lookup
+SZP = tuple(
+    (value & S) | (0 if value else Z) | (P if parity_bit(value) else 0) | 0x02
+    for value in range(0x100)
+)
 
-def carry_bit(value):
-    return value < 0x00 or value > 0xff
+def _flag(mask):
+    def get(self):
+        self._registers.materialize_flags()
+        return bool(self._registers.f & mask)
 
-def parity_bit(value):
-    return (bin(value).count('1') % 2) == 0
+    def set(self, value):
+        self._registers.materialize_flags()
+
+        if value:
+            self._registers.f |= mask
+        else:
+            self._registers.f &= ~mask
+
+    return property(get, set)
 
 class ConditionFlags(object):
-    def __init__(self):
-        self.s = False
-        self.z = False
-        self.p = False
-        self.cy = False
-        self.ac = False
-        self.pad = False
+    # A view of the flag bits held in Registers.f. Reading it brings
+    # deferred lazy flags up to date.
+    def __init__(self, registers):
+        self._registers = registers
+
+    s = _flag(S)
+    z = _flag(Z)
+    ac = _flag(AC)
+    p = _flag(P)
+    cy = _flag(CY)
@@ -1,1038 +1,578 @@
 # Python
 import logging
 
-# External
-from numpy import int16, uint16
-
 # Local
-from .registers import RegID, DRegID
-from .registers import flags as fl
+from core.opcodes import Opcode
+from .flags import S, Z, AC, P, CY, SZP
 
 class UnhandledInstructionError(Exception):
     pass
 
-class Instruction(object):
-    logger = logging.getLogger('Instruction')
-
-    def __init__(self, cpu):
-        self._cpu = cpu
-        self._size = 1
-
-    def __call__(self):
-        Instruction.logger.info(self)
-        self._cpu.increment_program_counter(self._size)
-
-    def __str__(self):
-        return 'Instruction'
-
-class ACIInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(ACIInstruction, self).__init__(*args, **kwargs)
-        self._size = 2
-            
-    def __call__(self, *args, **kwargs):
-        immediate = self._cpu.get_next_byte()
-
-        flags = self._cpu.registers.increment(
-            RegID.A, 
-            (immediate + self._cpu.condition_flags.cy)
-        )
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = flags['cy']
-        self._cpu.condition_flags.p = flags['p']
-       
-        super(ACIInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'ACI'
-
-class ADDInstruction(Instruction):
-    def __init__(self, cpu, register):
-        super(ADDInstruction, self).__init__(cpu)
-        self._register = register
-    
-    def __call__(self, *args, **kwargs):
-        if self._register != DRegID.M:
-            addend = self._cpu.registers.get(self._register)
-        else:
-            address = self._cpu.registers.get_pair(DRegID.HL)
-            addend = self._cpu.ram.read_double_byte(address)
-
-        flags = self._cpu.registers.increment(
-            RegID.A, 
-            addend
-        )
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = flags['cy']
-        self._cpu.condition_flags.p = flags['p']
-
-        super(ADDInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'ADD'
-
-class ADCInstruction(Instruction):
-    def __init__(self, cpu, register):
-        super(ADCInstruction, self).__init__(cpu)
-        self._register = register
-
-    def __call__(self, *args, **kwargs):
-        if register != 'm':
-            addend = self._cpu.registers.get(register)
-        else:
-            address = self._cpu.registers.get_pair(DRegID.HL)
-            addend = self._cpu.ram.read_double_byte(address)
-
-        flags = self._cpu.registers.increment(
-            RegID.A, 
-            (addend + self._cpu.condition_flags.cy)
-        )
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = flags['cy']
-        self._cpu.condition_flags.p = flags['p']
-
-        super(ADCInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'ADC'
-
-class ADIInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(ADIInstruction, self).__init__(*args, **kwargs)
-        self._size = 2
-            
-    def __call__(self, *args, **kwargs):
-        immediate = self._cpu.get_next_byte()
-
-        flags = self._cpu.registers.increment(
-            RegID.A, 
-            immediate
-        )
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = flags['cy']
-        self._cpu.condition_flags.p = flags['p']
-       
-        super(ADIInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'ADI'
-
-class ANAInstruction(Instruction):
-    def __init__(self, cpu, register):
-        super(ANAInstruction, self).__init__(cpu)
-        self._register = register
-
-    def __call__(self, *args, **kwargs):
-        if self._register != DRegID.M:
-            operand = self._cpu.registers.get(self._register)
-        else:
-            address = self._cpu.registers.get_pair(DRegID.HL)
-            operand = self._cpu.ram.read_double_byte(address)
-
-        flags = self._cpu.registers.and_(RegID.A, operand)
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = False
-        self._cpu.condition_flags.p = flags['p']
-
-        super(ANAInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'ANA'
-
-class ANIInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(ANIInstruction, self).__init__(*args, **kwargs)
-        self._size = 2
-
-    def __call__(self, *args, **kwargs):
-        immediate = self._cpu.get_next_byte()
-        flags = self._cpu.registers.and_(RegID.A, immediate)
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = False
-        self._cpu.condition_flags.p = flags['p']
-
-        super(ANIInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'ANI'
-
-class CALLInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(CALLInstruction, self).__init__(*args, **kwargs)
-        self._size = 3
-
-    def __call__(self, *args, **kwargs):
-        Instruction.logger.info(self)
-        # Return address is after current instruction
-        ret = self._cpu.get_program_counter() + self._size
-        self._cpu.ram.write_double_byte(self._cpu.get_stack_pointer(), ret)
-        self._cpu.decrement_stack_pointer(2)
-
-        address = self._cpu.get_next_double_byte()
-        self._cpu.set_program_counter(address)
-
-    def __str__(self):
-        return 'CALL'
-
-class CCInstruction(CALLInstruction):
-    def __call__(self, *args, **kwargs):
-        if self._cpu.condition_flags.cy:
-            super(CCInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(CALLInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'CC'
-
-class CMInstruction(CALLInstruction):
-    def __call__(self, *args, **kwargs):
-        if self._cpu.condition_flags.s:
-            super(CMInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(CALLInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'CM'
-
-class CMAInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        self._cpu.registers.not_(RegID.A)
-
-        super(CMAInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'CMA'
-
-class CMCInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(CMCInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'CMC'
-
-class CMPInstruction(Instruction):
-    def __init__(self, cpu, register):
-        super(CMPInstruction, self).__init__(cpu)
-        self._register = register
-
-    def __call__(self, *args, **kwargs):
-        if self._register != DRegID.M:
-            subtrahend = self._cpu.registers.get(self._register)
-        else:
-            address = self._cpu.registers.get_pair(DRegID.HL)
-            subtrahend = self._cpu.ram.read_double_byte(address)
-
-        answer = self._cpu.registers.get(RegID.A) - subtrahend
-        flags = fl(answer)
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = flags['cy']
-        self._cpu.condition_flags.p = flags['p']
-
-        super(CMPInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'CMP'
-
-class CNCInstruction(CALLInstruction):
-    def __call__(self, *args, **kwargs):
-        if not self._cpu.condition_flags.cy:
-            super(CNCInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(CALLInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'CNC'
-
-class CNZInstruction(CALLInstruction):
-    def __call__(self, *args, **kwargs):
-        if not self._cpu.condition_flags.z:
-            super(CNZInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(CALLInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'CNZ'
-
-class CPInstruction(CALLInstruction):
-    def __call__(self, *args, **kwargs):
-        if not self._cpu.condition_flags.s:
-            super(CPInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(CALLInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'CP'
-
-class CPEInstruction(CALLInstruction):
-    def __call__(self, *args, **kwargs):
-        if self._cpu.condition_flags.p:
-            super(CPEInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(CALLInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'CPE'
-
-class CPIInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(CPIInstruction, self).__init__(*args, **kwargs)
-        self._size = 2
- 
-    def __call__(self, *args, **kwargs):
-        immediate = self._cpu.get_next_byte()
-        answer = self._cpu.registers.get(RegID.A) - immediate
-        flags = fl(answer)
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = flags['cy']
-        self._cpu.condition_flags.p = flags['p']
-
-        super(CPIInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'CPI'
-
-class CPOInstruction(CALLInstruction):
-    def __call__(self, *args, **kwargs):
-        if not self._cpu.condition_flags.p:
-            super(CPOInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(CALLInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'CPO'
-
-class CZInstruction(CALLInstruction):
-    def __call__(self, *args, **kwargs):
-        if self._cpu.condition_flags.z:
-            super(CZInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(CALLInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'CZ'
-
-class DAAInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(DAAInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'DAA'
-
-class DADInstruction(Instruction):
-    def __init__(self, cpu, register_pair):
-        super(DADInstruction, self).__init__(cpu)
-        self._register_pair = register_pair
-
-    def __call__(self, *args, **kwargs):
-        if self._register_pair == DRegID.SP:
-            flags = self._cpu.registers.increment_pair(
-                DRegID.HL, 
-                self._cpu.get_stack_pointer()
-            )
-        else:
-            flags = self._cpu.registers.increment_pair(
-                DRegID.HL, 
-                self._cpu.registers.get_pair(self._register_pair)
-            )
-
-        self._cpu.condition_flags.cy = flags['cy']
-
-        super(DADInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'DAD'
-
-class DCRInstruction(Instruction):
-    def __init__(self, cpu, register):
-        super(DCRInstruction, self).__init__(cpu)
-        self._register = register
-
-    def __call__(self, *args, **kwargs):
-        if self._register != DRegID.M:
-            flags = self._cpu.registers.decrement(self._register, 1)
-        else:
-            flags = self._cpu.registers.decrement_pair(DRegID.HL, 1)
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.p = flags['p']
-
-        super(DCRInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'DCR'
-
-class DCXInstruction(Instruction):
-    def __init__(self, cpu, register_pair):
-        super(DCXInstruction, self).__init__(cpu)
-        self._register_pair = register_pair
-
-    def __call__(self, *args, **kwargs):
-        if self._register_pair == DRegID.SP:
-            self._cpu.decrement_stack_pointer(1)
-        else:
-            self._cpu.registers.decrement_pair(self._register_pair, 1)
-
-        super(DCXInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'DCX'
-
-class DIInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(DIInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'DI'
-
-class EIInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(EIInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'EI'
-
-class HLTInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(HLTInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'HLT'
-
-class INInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(INInstruction, self).__init__(*args, **kwargs)
-        self._size = 2
-    
-    def __call__(self, *args, **kwargs):
-        super(INInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'IN'
-
-class INRInstruction(Instruction):
-    def __init__(self, cpu, register):
-        super(INRInstruction, self).__init__(cpu)
-        self._register = register
-
-    def __call__(self, *args, **kwargs):
-        if self._register != DRegID.M:
-            flags = self._cpu.registers.increment(self._register, 1)
-        else:
-            flags = self._cpu.registers.increment_pair(DRegID.HL, 1)
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.p = flags['p']
-
-        super(INRInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'INR'
-
-class INXInstruction(Instruction):
-    def __init__(self, cpu, register_pair):
-        super(INXInstruction, self).__init__(cpu)
-        self._register_pair = register_pair
-
-    def __call__(self, *args, **kwargs):
-        if self._register_pair == DRegID.SP:
-            self._cpu.increment_stack_pointer(1)
-        else:
-            self._cpu.registers.increment_pair(self._register_pair, 1)
-
-        super(INXInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'INX'
-
-class JMPInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(JMPInstruction, self).__init__(*args, **kwargs)
-        self._size = 3
-    
-    def __call__(self, *args, **kwargs):
-        Instruction.logger.info(self)
-        address = self._cpu.get_next_double_byte()
-        self._cpu.set_program_counter(address)
-
-    def __str__(self):
-        return 'JMP'
-
-class JCInstruction(JMPInstruction):
-    def __call__(self, *args, **kwargs):
-        if self._cpu.condition_flags.cy:
-            super(JCInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(JMPInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'JC'
-
-class JMInstruction(JMPInstruction):
-    def __call__(self, *args, **kwargs):
-        if self._cpu.condition_flags.s:
-            super(JMInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(JMPInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'JM'
-
-class JNCInstruction(JMPInstruction):
-    def __call__(self, *args, **kwargs):
-        if not self._cpu.condition_flags.cy:
-            super(JNCInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(JMPInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'JNC'
-
-class JNZInstruction(JMPInstruction):
-    def __call__(self, *args, **kwargs):
-        if not self._cpu.condition_flags.z:
-            super(JNZInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(JMPInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'JNZ'
-
-class JPInstruction(JMPInstruction):
-    def __call__(self, *args, **kwargs):
-        if not self._cpu.condition_flags.s:
-            super(JPInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(JMPInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'JP'
-
-class JPEInstruction(JMPInstruction):
-    def __call__(self, *args, **kwargs):
-        if self._cpu.condition_flags.p:
-            super(JPEInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(JMPInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'JPE'
-
-class JPOInstruction(JMPInstruction):
-    def __call__(self, *args, **kwargs):
-        if not self._cpu.condition_flags.p:
-            super(JPOInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(JMPInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'JPO'
-
-class JZInstruction(JMPInstruction):
-    def __call__(self, *args, **kwargs):
-        if self._cpu.condition_flags.z:
-            super(JZInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(JMPInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'JZ'
-
-class LDAInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(LDAInstruction, self).__init__(*args, **kwargs)
-        self._size = 3
- 
-    def __call__(self, *args, **kwargs):
-        super(LDAInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'LDA'
-
-class LDAXInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(LDAXInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'LDAX'
-
-class LHLDInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(LHLDInstruction, self).__init__(*args, **kwargs)
-        self._size = 3
- 
-    def __call__(self, *args, **kwargs):
-        super(LHLDInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'LHLD'
-
-class LXIInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(LXIInstruction, self).__init__(*args, **kwargs)
-        self._size = 3
-    
-    def __call__(self, *args, **kwargs):
-        super(LXIInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'LXI'
-
-class MOVInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(MOVInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'MOV'
-
-class MVIInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(MVIInstruction, self).__init__(*args, **kwargs)
-        self._size = 2
-
-    def __call__(self, *args, **kwargs):
-        super(MVIInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'MVI'
-
-class NOPInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(NOPInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'NOP'
-
-class ORAInstruction(Instruction):
-    def __init__(self, cpu, register):
-        super(ORAInstruction, self).__init__(cpu)
-        self._register = register
-
-    def __call__(self, *args, **kwargs):
-        if self._register != DRegID.M:
-            operand = self._cpu.registers.get(self._register)
-        else:
-            address = self._cpu.registers.get_pair(DRegID.HL)
-            operand = self._cpu.ram.read_double_byte(address)
-
-        flags = self._cpu.registers.xor_(RegID.A, operand)
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = False
-        self._cpu.condition_flags.p = flags['p']
-
-        super(ORAInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'ORA'
-
-class ORIInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(ORIInstruction, self).__init__(*args, **kwargs)
-        self._size = 2
-
-    def __call__(self, *args, **kwargs):
-        immediate = self._cpu.get_next_byte()
-        flags = self._cpu.registers.or_(RegID.A, immediate)
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = False
-        self._cpu.condition_flags.p = flags['p']
-
-        super(ORIInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'ORI'
-
-class OUTInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(OUTInstruction, self).__init__(*args, **kwargs)
-        self._size = 2
-   
-    def __call__(self, *args, **kwargs):
-        super(OUTInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'OUT'
-
-class PCHLInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        Instruction.logger.info(self)
-        address = self._cpu.get_pair(DRegID.HL)
-        self._cpu.set_program_counter(address)
-
-    def __str__(self):
-        return 'PCHL'
-
-class POPInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(POPInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'POP'
-
-class PUSHInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(PUSHInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'PUSH'
-
-class RALInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        flags = self._cpu.registers.shift_left_carry_(RegID.A)
-        self._cpu.registers.condition_flags.cy = flags['cy']
-        super(RALInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'RAL'
-
-class RARInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(RARInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'RAR'
-
-class RETInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        address = self._cpu.ram.read_double_byte(
-            self._cpu.get_stack_pointer()
-        ) 
-        self._cpu.set_program_counter(address)
-        self._cpu.increment_stack_pointer(2)
-
-    def __str__(self):
-        return 'RET'
-
-class RCInstruction(RETInstruction):
-    def __call__(self, *args, **kwargs):
-        if self._cpu.condition_flags.cy:
-            super(RCInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(RETInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'RC'
-
-class RLCInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        flags = self._cpu.registers.shift_left_(RegID)
-        self._cpu.condition_flags.cy = flags['cy']
-        super(RLCInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'RLC'
-
-class RMInstruction(RETInstruction):
-    def __call__(self, *args, **kwargs):
-        if self._cpu.condition_flags.s:
-            super(RMInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(RETInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'RM'
-
-class RNCInstruction(RETInstruction):
-    def __call__(self, *args, **kwargs):
-        if not self._cpu.condition_flags.cy:
-            super(RNCInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(RETInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'RNC'
-
-class RNZInstruction(RETInstruction):
-    def __call__(self, *args, **kwargs):
-        if not self._cpu.condition_flags.z:
-            super(RNZInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(RETInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'RNZ'
-
-class RPInstruction(RETInstruction):
-    def __call__(self, *args, **kwargs):
-        if not self._cpu.condition_flags.s:
-            super(RPInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(RETInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'RP'
-
-class RPEInstruction(RETInstruction):
-    def __call__(self, *args, **kwargs):
-        if self._cpu.condition_flags.p:
-            super(RPEInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(RETInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'RPE'
-
-class RPOInstruction(RETInstruction):
-    def __call__(self, *args, **kwargs):
-        if not self._cpu.condition_flags.p:
-            super(RPOInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(RETInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'RPO'
-
-class RRCInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        flags = self._cpu.registers.shift_right_(RegID)
-        self._cpu.condition_flags.cy = flags['cy']
-        super(RRCInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'RRC'
-
-class RSTInstruction(CALLInstruction):
-    def __init__(self, cpu, id):
-        super(CALLInstruction, self).__init__(cpu)
-        self._id = id
-
-    def __call__(self, *args, **kwargs):
-        super(RSTInstruction, self).__call__(*args, **kwargs)
-        # Overwrite program counter
-        address = self._id * 0x8
-        self._cpu.set_program_counter(address)
-
-    def __str__(self):
-        return 'RST'
-
-class RZInstruction(RETInstruction):
-    def __call__(self, *args, **kwargs):
-        if self._cpu.condition_flags.z:
-            super(RZInstruction, self).__call__(*args, **kwargs)
-        else:
-            super(RETInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'RZ'
-
-class SBBInstruction(Instruction):
-    def __init__(self, cpu, register):
-        super(SBBInstruction, self).__init__(cpu)
-        self._register = register
-
-    def __call__(self, *args, **kwargs):
-        if self._register != DRegID.M:
-            subtrahend = self._cpu.registers.get(self._register)
-        else:
-            address = self._cpu.registers.get_pair(DRegID.HL)
-            subtrahend = self._cpu.ram.read_double_byte(address)
- 
-        flags = self._cpu.registers.decrement(
-            RegID.A, 
-            (subtrahend + self._cpu.condition_flags.cy)
-        )
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = flags['cy']
-        self._cpu.condition_flags.p = flags['p']
- 
-        super(SBBInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'SBB'
-
-class SBIInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(SBIInstruction, self).__init__(*args, **kwargs)
-        self._size = 2
-    
-    def __call__(self, *args, **kwargs):
-        immediate = self._cpu.get_next_byte()
-
-        flags = self._cpu.registers.decrement(
-            RegID.A, 
-            (immediate + self._cpu.condition_flags.cy)
-        )
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = flags['cy']
-        self._cpu.condition_flags.p = flags['p']
-
-        super(SBIInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'SBI'
-
-class SHLDInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(SHLDInstruction, self).__init__(*args, **kwargs)
-        self._size = 3
-    
-    def __call__(self, *args, **kwargs):
-        super(SHLDInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'SHLD'
-
-class SPHLInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(SPHLInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'SPHL'
-
-class STAInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(STAInstruction, self).__init__(*args, **kwargs)
-        self._size = 3
-
-    def __call__(self, *args, **kwargs):
-        super(STAInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'STA'
-
-class STAXInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(STAXInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'STAX'
-
-class STCInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(STCInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'STC'
-
-class SUBInstruction(Instruction):
-    def __init__(self, cpu, register):
-        super(SUBInstruction, self).__init__(cpu)
-        self._register = register
-
-    def __call__(self, *args, **kwargs):
-        if self._register != DRegID.M:
-            subtrahend = self._cpu.registers.get(self._register)
-        else:
-            address = self._cpu.registers.get_pair(DRegID.HL)
-            subtrahend = self._cpu.ram.read_double_byte(address)
- 
-        flags = self._cpu.registers.decrement(
-            RegID.A, 
-            subtrahend
-        )
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = flags['cy']
-        self._cpu.condition_flags.p = flags['p']
-
-        super(SUBInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'SUB'
-
-class SUIInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(SUIInstruction, self).__init__(*args, **kwargs)
-        self._size = 2
-            
-    def __call__(self, *args, **kwargs):
-        immediate = self._cpu.get_next_byte()
-
-        flags = self._cpu.registers.decrement(
-            RegID.A, 
-            immediate
-        )
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = flags['cy']
-        self._cpu.condition_flags.p = flags['p']
-
-        super(SUIInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'SUI'
-
-class XCHGInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(XCHGInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'XCHG'
-
-class XRAInstruction(Instruction):
-    def __init__(self, cpu, register):
-        super(XRAInstruction, self).__init__(cpu)
-        self._register = register
-
-    def __call__(self, *args, **kwargs):
-        if self._register != DRegID.M:
-            operand = self._cpu.registers.get(self._register)
-        else:
-            address = self._cpu.registers.get_pair(DRegID.HL)
-            operand = self._cpu.ram.read_double_byte(address)
-
-        flags = self._cpu.registers.xor_(RegID.A, operand)
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = False
-        self._cpu.condition_flags.p = flags['p']
-
-        super(XRAInstruction, self).__call__(*args, **kwargs)
-
-
-    def __str__(self):
-        return 'XRA'
-
-class XRIInstruction(Instruction):
-    def __init__(self, *args, **kwargs):
-        super(XRIInstruction, self).__init__(*args, **kwargs)
-        self._size = 2
-
-    def __call__(self, *args, **kwargs):
-        immediate = self._cpu.get_next_byte()
-        flags = self._cpu.registers.xor_(RegID.A, immediate)
-
-        self._cpu.condition_flags.s = flags['s']
-        self._cpu.condition_flags.z = flags['z']
-        self._cpu.condition_flags.cy = False
-        self._cpu.condition_flags.p = flags['p']
-
-        super(XRIInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'XRI'
-
-class XTHLInstruction(Instruction):
-    def __call__(self, *args, **kwargs):
-        super(XTHLInstruction, self).__call__(*args, **kwargs)
-
-    def __str__(self):
-        return 'XTHL'
+logger = logging.getLogger('Instruction')
+
+# Every opcode is compiled once per process from the templates below into a
+# plain function taking the CPU. Operands are baked into the generated source,
+# so a handler does no enum lookups, no super() chain and no argument
+# unpacking at call time. The 256-entry table is shared by all CPUs.
+#
+# Handlers bind r = cpu.registers and work on its plain int fields with
+# masked arithmetic.
+
+_GET = {name: 'r.' + name.lower() for name in 'ABCDEHL'}
+_GET['M'] = 'cpu.ram.read_byte(r.h << 8 | r.l)'
+
+_SET = {name: 'r.' + name.lower() + ' = {0}' for name in 'ABCDEHL'}
+_SET['M'] = 'cpu.ram.write_byte(r.h << 8 | r.l, {0})'
+
+_GET_PAIR = {
+    'B': '(r.b << 8 | r.c)',
+    'D': '(r.d << 8 | r.e)',
+    'H': '(r.h << 8 | r.l)',
+    'SP': 'r.sp'
+}
+
+_SET_PAIR = {
+    'B': 'pair = {0}\nr.b = pair >> 8\nr.c = pair & 0xff',
+    'D': 'pair = {0}\nr.d = pair >> 8\nr.e = pair & 0xff',
+    'H': 'pair = {0}\nr.h = pair >> 8\nr.l = pair & 0xff',
+    'SP': 'r.sp = {0}'
+}
+
+_CONDITIONS = {
+    'NZ': 'not r.f & Z',
+    'Z': 'r.f & Z',
+    'NC': 'not r.f & CY',
+    'C': 'r.f & CY',
+    'PO': 'not r.f & P',
+    'PE': 'r.f & P',
+    'P': 'not r.f & S',
+    'M': 'r.f & S'
+}
+
+# In lazy-flags mode the ALU handlers only record their result and the bits
+# needed for aux-carry in Registers.lazy_result/lazy_aux. Conditions read
+# the bit they need straight from those, and any other flag access
+# materializes Registers.f first. lazy_aux is None once f is up to date.
+_LAZY_CONDITIONS = {
+    'NZ': '(r.lazy_result & 0xff if r.lazy_aux is not None else '
+        'not r.f & Z)',
+    'Z': '(not r.lazy_result & 0xff if r.lazy_aux is not None else r.f & Z)',
+    'NC': '(not r.lazy_result & 0x100 if r.lazy_aux is not None else '
+        'not r.f & CY)',
+    'C': '(r.lazy_result & 0x100 if r.lazy_aux is not None else r.f & CY)',
+    'PO': '(not SZP[r.lazy_result & 0xff] & P if r.lazy_aux is not None else '
+        'not r.f & P)',
+    'PE': '(SZP[r.lazy_result & 0xff] & P if r.lazy_aux is not None else '
+        'r.f & P)',
+    'P': '(not r.lazy_result & 0x80 if r.lazy_aux is not None else '
+        'not r.f & S)',
+    'M': '(r.lazy_result & 0x80 if r.lazy_aux is not None else r.f & S)'
+}
+
+_LAZY_CARRY = ('(r.lazy_result >> 8 & CY if r.lazy_aux is not None else '
+    'r.f & CY)')
+
+_MATERIALIZE = """
+if r.lazy_aux is not None:
+    r.materialize_flags()
+"""
+
+# Operands are fetched through the read page table bound to pages. Every
+# body reads its operands with exactly these expressions, so the block
+# translator can replace IMMEDIATE and ADDRESS with the bytes they read.
+_OPERAND = 'pages[(r.pc + {0}) >> 8 & 0xff][(r.pc + {0}) & 0xff]'
+IMMEDIATE = _OPERAND.format(1)
+ADDRESS = '({0} | {1} << 8)'.format(_OPERAND.format(1), _OPERAND.format(2))
+
+def _push(cpu, value):
+    r = cpu.registers
+    sp = r.sp
+    cpu.ram.write_byte((sp - 1) & 0xffff, value >> 8)
+    cpu.ram.write_byte((sp - 2) & 0xffff, value & 0xff)
+    r.sp = (sp - 2) & 0xffff
+
+def _pop(cpu):
+    r = cpu.registers
+    sp = r.sp
+    value = cpu.ram.read_byte(sp) | cpu.ram.read_byte((sp + 1) & 0xffff) << 8
+    r.sp = (sp + 2) & 0xffff
+    return value
+
+_ADD = """
+a = r.a
+v = {0}
+res = a + v{1}
+r.a = res & 0xff
+r.f = SZP[res & 0xff] | ((a ^ v ^ res) & AC) | (res >> 8)
+"""
+
+_SUB = """
+a = r.a
+v = {0}
+res = a - v{1}
+r.f = SZP[res & 0xff] | (~(a ^ v ^ res) & AC) | ((res >> 8) & CY)
+"""
+
+_LOGIC = """
+a = r.a
+v = {0}
+res = a {1} v
+r.a = res
+r.f = SZP[res]{2}
+"""
+
+_LAZY_ADD = """
+a = r.a
+v = {0}
+res = a + v{1}
+r.a = res & 0xff
+r.lazy_result = res
+r.lazy_aux = a ^ v
+"""
+
+_LAZY_SUB = """
+a = r.a
+v = {0}
+res = a - v{1}
+r.lazy_result = res
+r.lazy_aux = ~(a ^ v)
+"""
+
+_LAZY_LOGIC = """
+a = r.a
+v = {0}
+res = a {1} v
+r.a = res
+r.lazy_result = res
+r.lazy_aux = {2}
+"""
+
+_INR = """
+res = ({0} + 1) & 0xff
+r.f = (r.f & CY) | SZP[res] | (0 if res & 0x0f else AC)
+{1}
+"""
+
+_DCR = """
+res = ({0} - 1) & 0xff
+r.f = (r.f & CY) | SZP[res] | (0 if (res & 0x0f) == 0x0f else AC)
+{1}
+"""
+
+_LAZY_INR = """
+v = {0}
+res = (v + 1) & 0xff
+r.lazy_result = res | ((r.lazy_result & 0x100) if r.lazy_aux is not None
+    else (r.f & CY) << 8)
+r.lazy_aux = v ^ 1
+{1}
+"""
+
+_LAZY_DCR = """
+v = {0}
+res = (v - 1) & 0xff
+r.lazy_result = res | ((r.lazy_result & 0x100) if r.lazy_aux is not None
+    else (r.f & CY) << 8)
+r.lazy_aux = ~(v ^ 1)
+{1}
+"""
+
+_DAD = """
+res = {0} + {1}
+r.f = (r.f & ~CY) | (res >> 16)
+{2}
+"""
+
+_DAA = """
+a = r.a
+cy = r.f & CY
+correction = 0
+if r.f & AC or (a & 0x0f) > 9:
+    correction = 0x06
+if cy or a > 0x99:
+    correction |= 0x60
+    cy = CY
+res = a + correction
+r.a = res & 0xff
+r.f = SZP[res & 0xff] | ((a ^ correction ^ res) & AC) | cy
+"""
+
+_RLC = """
+a = r.a
+r.a = ((a << 1) | (a >> 7)) & 0xff
+r.f = (r.f & ~CY) | (a >> 7)
+"""
+
+_RRC = """
+a = r.a
+r.a = (a >> 1) | ((a & 0x01) << 7)
+r.f = (r.f & ~CY) | (a & 0x01)
+"""
+
+_RAL = """
+a = r.a
+r.a = ((a << 1) | (r.f & CY)) & 0xff
+r.f = (r.f & ~CY) | (a >> 7)
+"""
+
+_RAR = """
+a = r.a
+r.a = (a >> 1) | ((r.f & CY) << 7)
+r.f = (r.f & ~CY) | (a & 0x01)
+"""
+
+_JUMP = """
+if {0}:
+    r.pc = {1}
+else:
+    r.pc = (r.pc + 3) & 0xffff
+"""
+
+_CALL = """
+if {0}:
+    address = {1}{2}
+    _push(cpu, (r.pc + 3) & 0xffff)
+    r.pc = address
+else:
+    r.pc = (r.pc + 3) & 0xffff
+"""
+
+_RETURN = """
+if {0}:
+    r.pc = _pop(cpu){1}
+else:
+    r.pc = (r.pc + 1) & 0xffff
+"""
+
+_RST = """
+_push(cpu, (r.pc + 1) & 0xffff)
+r.pc = {0}
+"""
+
+_XTHL = """
+sp = r.sp
+value = cpu.ram.read_byte(sp) | cpu.ram.read_byte((sp + 1) & 0xffff) << 8
+cpu.ram.write_byte(sp, r.l)
+cpu.ram.write_byte((sp + 1) & 0xffff, r.h)
+r.h = value >> 8
+r.l = value & 0xff
+"""
+
+_XCHG = """
+r.d, r.e, r.h, r.l = r.h, r.l, r.d, r.e
+"""
+
+_LHLD = """
+address = {0}
+r.l = cpu.ram.read_byte(address)
+r.h = cpu.ram.read_byte((address + 1) & 0xffff)
+"""
+
+_SHLD = """
+address = {0}
+cpu.ram.write_byte(address, r.l)
+cpu.ram.write_byte((address + 1) & 0xffff, r.h)
+"""
+
+# HLT stays on its own address until an interrupt moves the PC past it. The
+# time spent waiting runs to the end of the current run_for slice at once.
+_HLT = """
+r.halted = 1
+if cpu.cycles < cpu.slice_end:
+    cpu.cycles = cpu.slice_end
+"""
+
+# One indexed call into the CPU's IOBus handler tables
+_IN = """
+port = {0}
+r.a = cpu.io.inputs[port](port)
+"""
+
+_OUT = """
+port = {0}
+cpu.io.outputs[port](port, r.a)
+"""
+
+def _alu(family, operand):
+    if family == 'ADD':
+        return _ADD.format(operand, '')
+    if family == 'ADC':
+        return _ADD.format(operand, ' + (r.f & CY)')
+    if family == 'SUB':
+        return _SUB.format(operand, '') + 'r.a = res & 0xff\n'
+    if family == 'SBB':
+        return _SUB.format(operand, ' - (r.f & CY)') + 'r.a = res & 0xff\n'
+    if family == 'CMP':
+        return _SUB.format(operand, '')
+    if family == 'ANA':
+        return _LOGIC.format(operand, '&', ' | ((a | v) << 1 & AC)')
+    if family == 'XRA':
+        return _LOGIC.format(operand, '^', '')
+    if family == 'ORA':
+        return _LOGIC.format(operand, '|', '')
+
+def _lazy_alu(family, operand):
+    if family == 'ADD':
+        return _LAZY_ADD.format(operand, '')
+    if family == 'ADC':
+        return _LAZY_ADD.format(operand, ' + ' + _LAZY_CARRY)
+    if family == 'SUB':
+        return _LAZY_SUB.format(operand, '') + 'r.a = res & 0xff\n'
+    if family == 'SBB':
+        return (_LAZY_SUB.format(operand, ' - ' + _LAZY_CARRY)
+            + 'r.a = res & 0xff\n')
+    if family == 'CMP':
+        return _LAZY_SUB.format(operand, '')
+    if family == 'ANA':
+        return _LAZY_LOGIC.format(operand, '&', '(a | v) << 1 ^ res')
+    if family == 'XRA':
+        return _LAZY_LOGIC.format(operand, '^', 'res')
+    if family == 'ORA':
+        return _LAZY_LOGIC.format(operand, '|', 'res')
+
+_IMMEDIATE_ALU = {
+    'ADI': 'ADD',
+    'ACI': 'ADC',
+    'SUI': 'SUB',
+    'SBI': 'SBB',
+    'ANI': 'ANA',
+    'XRI': 'XRA',
+    'ORI': 'ORA',
+    'CPI': 'CMP'
+}
+
+# T-states. Conditional calls and returns are listed with their not-taken
+# cost and add TAKEN_CYCLES to cpu.cycles when taken.
+_CYCLES = {
+    'NOP': 4, 'MOV': 5, 'MVI': 7, 'LXI': 10, 'STAX': 7, 'LDAX': 7, 'STA': 13,
+    'LDA': 13, 'SHLD': 16, 'LHLD': 16, 'INX': 5, 'DCX': 5, 'INR': 5, 'DCR': 5,
+    'DAD': 10, 'DAA': 4, 'CMA': 4, 'STC': 4, 'CMC': 4, 'RLC': 4, 'RRC': 4,
+    'RAL': 4, 'RAR': 4, 'PUSH': 11, 'POP': 10, 'XTHL': 18, 'XCHG': 4,
+    'SPHL': 5, 'PCHL': 5, 'JMP': 10, 'CALL': 17, 'RET': 10, 'RST': 11,
+    'HLT': 7, 'EI': 4, 'DI': 4, 'IN': 10, 'OUT': 10
+}
+
+TAKEN_CYCLES = 6
+_TAKEN = '\n    cpu.cycles += {0}'.format(TAKEN_CYCLES)
+
+_SIZES = {
+    'MVI': 2, 'ADI': 2, 'ACI': 2, 'SUI': 2, 'SBI': 2, 'ANI': 2, 'XRI': 2,
+    'ORI': 2, 'CPI': 2, 'IN': 2, 'OUT': 2,
+    'LXI': 3, 'SHLD': 3, 'LHLD': 3, 'STA': 3, 'LDA': 3
+}
+
+def _decode(name):
+    family, *operands = name.split('_')
+
+    # NOP_8, JMP_CB, RET_D9, CALL_DD, ... are undocumented aliases
+    if family in ('NOP', 'JMP', 'RET', 'CALL'):
+        operands = []
+
+    return family, operands
+
+def _cycles(family, operands):
+    if family in _CYCLES:
+        if 'M' in operands:
+            return 10 if family in ('MVI', 'INR', 'DCR') else 7
+        return _CYCLES[family]
+    if family in ('ADD', 'ADC', 'SUB', 'SBB', 'ANA', 'XRA', 'ORA', 'CMP'):
+        return 7 if operands[0] == 'M' else 4
+    if family in _IMMEDIATE_ALU:
+        return 7
+    if family[0] == 'J':
+        return 10
+    if family[0] == 'C':
+        return 17 - TAKEN_CYCLES
+    if family[0] == 'R':
+        return 11 - TAKEN_CYCLES
+
+    raise UnhandledInstructionError(family)
+
+# Returns the handler body and whether it sets the PC itself
+def _source(family, operands, conditions=_CONDITIONS):
+    if family == 'NOP':
+        return 'pass', False
+    if family == 'EI':
+        return 'r.inte = 2', False
+    if family == 'DI':
+        return 'r.inte = 0', False
+    if family == 'HLT':
+        return _HLT, True
+    if family == 'IN':
+        return _IN.format(IMMEDIATE), False
+    if family == 'OUT':
+        return _OUT.format(IMMEDIATE), False
+    if family == 'MOV':
+        return _SET[operands[0]].format(_GET[operands[1]]), False
+    if family == 'MVI':
+        return _SET[operands[0]].format(IMMEDIATE), False
+    if family == 'LXI':
+        return _SET_PAIR[operands[0]].format(ADDRESS), False
+    if family == 'STAX':
+        return 'cpu.ram.write_byte({0}, r.a)'.format(
+            _GET_PAIR[operands[0]]), False
+    if family == 'LDAX':
+        return 'r.a = cpu.ram.read_byte({0})'.format(
+            _GET_PAIR[operands[0]]), False
+    if family == 'STA':
+        return 'cpu.ram.write_byte({0}, r.a)'.format(ADDRESS), False
+    if family == 'LDA':
+        return 'r.a = cpu.ram.read_byte({0})'.format(ADDRESS), False
+    if family == 'SHLD':
+        return _SHLD.format(ADDRESS), False
+    if family == 'LHLD':
+        return _LHLD.format(ADDRESS), False
+    if family == 'INX':
+        pair = operands[0]
+        return _SET_PAIR[pair].format(
+            '({0} + 1) & 0xffff'.format(_GET_PAIR[pair])), False
+    if family == 'DCX':
+        pair = operands[0]
+        return _SET_PAIR[pair].format(
+            '({0} - 1) & 0xffff'.format(_GET_PAIR[pair])), False
+    if family == 'INR':
+        register = operands[0]
+        return _INR.format(_GET[register], _SET[register].format('res')), False
+    if family == 'DCR':
+        register = operands[0]
+        return _DCR.format(_GET[register], _SET[register].format('res')), False
+    if family == 'DAD':
+        return _DAD.format(_GET_PAIR['H'], _GET_PAIR[operands[0]],
+            _SET_PAIR['H'].format('res & 0xffff')), False
+    if family in ('ADD', 'ADC', 'SUB', 'SBB', 'ANA', 'XRA', 'ORA', 'CMP'):
+        return _alu(family, _GET[operands[0]]), False
+    if family in _IMMEDIATE_ALU:
+        return _alu(_IMMEDIATE_ALU[family], IMMEDIATE), False
+    if family == 'DAA':
+        return _DAA, False
+    if family == 'CMA':
+        return 'r.a ^= 0xff', False
+    if family == 'STC':
+        return 'r.f |= CY', False
+    if family == 'CMC':
+        return 'r.f ^= CY', False
+    if family == 'RLC':
+        return _RLC, False
+    if family == 'RRC':
+        return _RRC, False
+    if family == 'RAL':
+        return _RAL, False
+    if family == 'RAR':
+        return _RAR, False
+    if family == 'PUSH':
+        if operands[0] == 'PSW':
+            return '_push(cpu, r.a << 8 | r.f)', False
+        return '_push(cpu, {0})'.format(_GET_PAIR[operands[0]]), False
+    if family == 'POP':
+        if operands[0] == 'PSW':
+            return ('value = _pop(cpu)\n'
+                'r.a = value >> 8\n'
+                'r.f = (value & 0xd5) | 0x02'), False
+        return _SET_PAIR[operands[0]].format('_pop(cpu)'), False
+    if family == 'XTHL':
+        return _XTHL, False
+    if family == 'XCHG':
+        return _XCHG, False
+    if family == 'SPHL':
+        return 'r.sp = {0}'.format(_GET_PAIR['H']), False
+    if family == 'PCHL':
+        return 'r.pc = {0}'.format(_GET_PAIR['H']), True
+    if family == 'JMP':
+        return _JUMP.format('True', ADDRESS), True
+    if family == 'CALL':
+        return _CALL.format('True', ADDRESS, ''), True
+    if family == 'RET':
+        return _RETURN.format('True', ''), True
+    if family == 'RST':
+        return _RST.format(int(operands[0]) * 0x08), True
+    if family[0] == 'J' and family[1:] in conditions:
+        return _JUMP.format(conditions[family[1:]], ADDRESS), True
+    if family[0] == 'C' and family[1:] in conditions:
+        return _CALL.format(conditions[family[1:]], ADDRESS, _TAKEN), True
+    if family[0] == 'R' and family[1:] in conditions:
+        return _RETURN.format(conditions[family[1:]], _TAKEN), True
+
+    raise UnhandledInstructionError(family)
+
+def _lazy_source(family, operands):
+    if family in ('ADD', 'ADC', 'SUB', 'SBB', 'ANA', 'XRA', 'ORA', 'CMP'):
+        return _lazy_alu(family, _GET[operands[0]]), False
+    if family in _IMMEDIATE_ALU:
+        return _lazy_alu(_IMMEDIATE_ALU[family], IMMEDIATE), False
+    if family == 'INR':
+        register = operands[0]
+        return _LAZY_INR.format(_GET[register],
+            _SET[register].format('res')), False
+    if family == 'DCR':
+        register = operands[0]
+        return _LAZY_DCR.format(_GET[register],
+            _SET[register].format('res')), False
+    if family == 'POP' and operands[0] == 'PSW':
+        body, jumps = _source(family, operands)
+        return body + '\nr.lazy_aux = None', jumps
+    if (family in ('DAD', 'DAA', 'STC', 'CMC', 'RLC', 'RRC', 'RAL', 'RAR')
+            or family == 'PUSH' and operands[0] == 'PSW'):
+        body, jumps = _source(family, operands)
+        return _MATERIALIZE + body, jumps
+
+    return _source(family, operands, _LAZY_CONDITIONS)
+
+_NAMESPACE = {
+    'S': S,
+    'Z': Z,
+    'AC': AC,
+    'P': P,
+    'CY': CY,
+    'SZP': SZP,
+    '_push': _push,
+    '_pop': _pop
+}
+
+def source(opcode):
+    family, operands = _decode(Opcode(opcode).name)
+    body, jumps = _source(family, operands)
+    size = _SIZES.get(family, 3 if ADDRESS in body else 1)
+
+    return family, body, size, jumps
+
+def build_function(name, body, filename):
+    lines = ''.join('    {0}\n'.format(line) for line in body.splitlines()
+        if line)
+    namespace = dict(_NAMESPACE)
+    exec(compile('def {0}(cpu):\n{1}'.format(name, lines), filename, 'exec'),
+        namespace)
+
+    return namespace[name]
+
+def _compile(opcode, lazy_flags):
+    family, operands = _decode(opcode.name)
+
+    if lazy_flags:
+        body, jumps = _lazy_source(family, operands)
+    else:
+        body, jumps = _source(family, operands)
+
+    if not jumps:
+        body += '\nr.pc = (r.pc + {0}) & 0xffff'.format(_SIZES.get(family, 1))
+
+    if 'pages[' in body:
+        body = 'pages = cpu.ram.pages\n' + body
+
+    name = 'op_{0:02x}_{1}'.format(opcode, opcode.name.lower())
+    handler = build_function(name, 'r = cpu.registers\n' + body,
+        '<instruction {0}>'.format(opcode.name))
+
+    return handler, family
+
+def _build(lazy_flags=False):
+    instructions = [None] * 256
+    mnemonics = [None] * 256
+
+    for opcode in Opcode:
+        instructions[opcode], mnemonics[opcode] = _compile(opcode, lazy_flags)
+
+    return instructions, mnemonics
+
+INSTRUCTIONS, MNEMONICS = _build()
+CYCLES = tuple(_cycles(*_decode(Opcode(opcode).name)) for opcode in range(256))
+LAZY_INSTRUCTIONS, _ = _build(lazy_flags=True)
@@ -0,0 +1,140 @@
+# Python
+from collections import deque, namedtuple
+import logging
+from threading import Event, Lock
+import time
+
+# Local
+from .instructions import CYCLES, source
+
+LatencyStats = namedtuple('LatencyStats', ('taken', 'mean', 'max'))
+
+class InterruptController(object):
+    logger = logging.getLogger('InterruptController')
+
+    # Any thread or coroutine may post an interrupt. The run loops only look
+    # at the plain pending flag at slice boundaries and call service when it
+    # is set, so nothing is locked or checked per instruction. An interrupt
+    # waits while INTE is off and wakes a halted CPU. Latency from post to
+    # acceptance is therefore bounded by one slice.
+    def __init__(self, cpu):
+        self._cpu = cpu
+        self._queue = deque()
+        self._lock = Lock()
+        self._posted = Event()
+        self.pending = False
+
+        # While muted posts are dropped, for replaying recorded interrupts
+        # through accept instead. listener, if set, is called with the cycle
+        # and opcode of every interrupt accepted.
+        self.muted = False
+        self.listener = None
+
+        self._taken = 0
+        self._latency_sum = 0.0
+        self._max_latency = 0.0
+
+    # Posts the opcode the interrupting device puts on the data bus. Only
+    # single-byte opcodes are supported, normally an RST.
+    def post(self, opcode):
+        family, _, size, _ = source(opcode)
+        if size != 1:
+            raise ValueError('{0} is not a single-byte opcode'.format(family))
+
+        if self.muted:
+            return
+
+        with self._lock:
+            self._queue.append((opcode, time.perf_counter()))
+            self.pending = True
+
+        self._posted.set()
+
+    def rst(self, vector):
+        if vector < 0 or vector > 7:
+            raise ValueError('RST vector must be 0-7')
+
+        self.post(0xc7 | vector << 3)
+
+    # Sleeps up to timeout seconds, returning early when something is
+    # posted. Each post cuts one wait short, so an interrupt held off by
+    # INTE does not turn later waits into spinning.
+    def wait(self, timeout):
+        posted = self._posted.wait(timeout)
+        self._posted.clear()
+
+        return posted
+
+    # Accepts the oldest pending interrupt if INTE is set, returning whether
+    # it did. EI sets INTE to 2, enabling interrupts only once the
+    # instruction after it has run, so that instruction is stepped here
+    # first unless it already ran. Acceptance clears INTE, resumes a halted
+    # CPU past its HLT and executes the opcode as if it sat just before the
+    # PC, so an RST pushes the address of the next instruction.
+    def service(self):
+        cpu = self._cpu
+        registers = cpu.registers
+
+        if registers.inte == 2 and self.pending:
+            if not registers.halted:
+                cpu.step()
+            if registers.inte == 2:
+                registers.inte = 1
+
+        if registers.inte != 1:
+            return False
+
+        with self._lock:
+            if not self._queue:
+                return False
+
+            opcode, posted = self._queue.popleft()
+            if not self._queue:
+                self.pending = False
+
+        latency = time.perf_counter() - posted
+        self._taken += 1
+        self._latency_sum += latency
+        self._max_latency = max(self._max_latency, latency)
+        self.accept(opcode)
+
+        InterruptController.logger.debug('Took %02x after %.6fs', opcode,
+            latency)
+        return True
+
+    # Takes opcode as an interrupt right now, whatever INTE and the queue say
+    def accept(self, opcode):
+        cpu = self._cpu
+        registers = cpu.registers
+
+        if self.listener is not None:
+            self.listener(cpu.cycles, opcode)
+
+        registers.inte = 0
+        if registers.halted:
+            registers.halted = 0
+            registers.pc = (registers.pc + 1) & 0xffff
+
+        registers.pc = (registers.pc - 1) & 0xffff
+        cpu.cycles += CYCLES[opcode]
+        cpu._instructions[opcode](cpu)
+
+    # The opcodes still pending, oldest first, for save states
+    def state(self):
+        with self._lock:
+            return bytes(opcode for opcode, _ in self._queue)
+
+    def restore(self, opcodes):
+        now = time.perf_counter()
+
+        with self._lock:
+            self._queue = deque((opcode, now) for opcode in opcodes)
+            self.pending = bool(self._queue)
+
+    # Seconds from post to acceptance over all interrupts taken
+    def latency(self):
+        if not self._taken:
+            return LatencyStats(0, 0.0, 0.0)
+
+        return LatencyStats(self._taken, self._latency_sum / self._taken,
+            self._max_latency)
@@ -0,0 +1,74 @@
+# Python
+from functools import partial
+import logging
+
+PORT_COUNT = 0x100
+
+def _no_input(port):
+    return 0xff
+
+def _no_output(port, value):
+    pass
+
+class Latch(object):
+    # Holds the last value written to a port and reads it back
+    def __init__(self, value=0x00):
+        self.value = value
+
+    def read(self, port):
+        return self.value
+
+    def write(self, port, value):
+        self.value = value
+
+    def state(self):
+        return bytes([self.value])
+
+    def restore(self, data):
+        self.value = data[0]
+
+class IOBus(object):
+    logger = logging.getLogger('IOBus')
+
+    # One preallocated 256-entry handler table per direction, indexed by port.
+    # IN calls inputs[port](port) for the byte to load into A, OUT calls
+    # outputs[port](port, value). Unattached ports read 0xff, like a floating
+    # bus, and drop writes. The tables are only updated in place.
+    def __init__(self):
+        self.inputs = [_no_input] * PORT_COUNT
+        self.outputs = [_no_output] * PORT_COUNT
+        self._reads = [_no_input] * PORT_COUNT
+        self._tap = None
+
+    def attach(self, port, read=None, write=None):
+        if read is not None:
+            self._reads[port] = read
+            self._install(port)
+        if write is not None:
+            self.outputs[port] = write
+
+    def detach(self, port):
+        self._reads[port] = _no_input
+        self._install(port)
+        self.outputs[port] = _no_output
+
+    # Routes every IN through tap(read, port), which returns the byte to
+    # load, with read the port's own handler. For recording and replaying
+    # input. None removes the tap, and untapped ports cost nothing extra.
+    def tap(self, tap):
+        self._tap = tap
+
+        for port in range(PORT_COUNT):
+            self._install(port)
+
+    def _install(self, port):
+        read = self._reads[port]
+        self.inputs[port] = read if self._tap is None else partial(self._tap,
+            read)
+
+    # Attaches and returns a Latch on port in both directions
+    def latch(self, port, value=0x00):
+        latch = Latch(value)
+        self.attach(port, latch.read, latch.write)
+
+        return latch
@@ -1,38 +1,671 @@
+# Python
+from enum import IntEnum, unique
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+PAGE_SIZE = 0x100
+PAGE_COUNT = 0x100
+
+# Write target of every read-only page, so a ROM write is an ordinary store
+# that nobody reads back
+_SINK = memoryview(bytearray(PAGE_SIZE))
+
+# Per-page lists Memory builds on first use, and what every page starts at
+_PAGE_LISTS = {'_bank_pages': None, '_mirror_of': None, '_watch_counts': 0,
+    '_generations': 0}
+
 class InvalidMemoryAddressError(Exception):
     pass
 
+@unique
+class PageKind(IntEnum):
+    RAM = 0
+    ROM = 1
+    MIRROR = 2
+    MMIO = 3
+
+class IOPage(object):
+    # Stands in for a page memoryview in the page tables and forwards every
+    # access to the device handlers with the full address, so only memory-
+    # mapped I/O pays for a call. read(address) returns a byte,
+    # write(address, value) stores one.
+    __slots__ = ('_base', '_read', '_write')
+
+    def __init__(self, base, read, write):
+        self._base = base
+        self._read = read
+        self._write = write
+
+    def __getitem__(self, offset):
+        if isinstance(offset, slice):
+            return bytes(self._read(self._base + index)
+                for index in range(*offset.indices(PAGE_SIZE)))
+
+        return self._read(self._base + offset)
+
+    def __setitem__(self, offset, value):
+        if isinstance(offset, slice):
+            for index, byte in zip(range(*offset.indices(PAGE_SIZE)), value):
+                self._write(self._base + index, byte)
+            return
+
+        self._write(self._base + offset, value)
+
+class Bank(object):
+    # Page-sized views of a bank's storage for the read and the write page
+    # tables. RAM banks own a buffer, ROM banks share a RomImage's pages.
+    def __init__(self, name, pages, writable, buffer=None):
+        self.name = name
+        self.pages = tuple(pages)
+        self.write_pages = self.pages if writable else (_SINK, ) * len(pages)
+        self.kind = PageKind.RAM if writable else PageKind.ROM
+        self.kinds = bytes([self.kind]) * len(self.pages)
+        self.ids = tuple((name, index) for index in range(len(self.pages)))
+        self.buffer = buffer
+
+class BankSwitch(object):
+    # Device write handler mapping banks[value] at address, for OUT ports and
+    # MMIO registers alike: called as handler(port or address, value)
+    def __init__(self, memory, address, banks, size=None):
+        self._memory = memory
+        self._address = address
+        self._banks = list(banks)
+        self._size = size
+
+    def __call__(self, key, value):
+        self._memory.map_bank(self._banks[value % len(self._banks)],
+            self._address, self._size)
+
 class Memory:
-    def __init__(self):
-        self._buffer = bytearray(0xffff)
+    # With shared set, RAM lives in a multiprocessing.shared_memory block
+    # called name, or a generated one, that MemoryObserver can attach to from
+    # other processes. Only this Memory's own RAM is shared, not mapped ROM,
+    # banks or devices. close() releases it.
+    def __init__(self, shared=False, name=None):
+        if shared:
+            self._shared = SharedMemory(name, create=True, size=0x10000)
+            self._buffer = self._shared.buf
+            self._buffer[:] = bytes(0x10000)
+        else:
+            self._shared = None
+            self._buffer = bytearray(0x10000)
+
+        # The address space is two 256-entry page tables, one read and fetched
+        # through and one written through. Entries are 256-byte memoryviews:
+        # slices of this Memory's own RAM by default, views into a shared
+        # image for ROM reads, and the sink for ROM writes. Memory-mapped I/O
+        # pages are IOPages in both tables. Every access is the same two
+        # indexing operations whatever the page holds. pages is only ever
+        # updated in place, so the CPU can keep a reference to it. The tables
+        # and the RAM page views are built on first use, see __getattr__.
+        self._view = memoryview(self._buffer)
+        self._kinds = bytearray(PAGE_COUNT)
+
+        # Named banks that can be paged in and out of the address space, and
+        # _bank_pages, the (bank name, bank page) each page currently shows,
+        # if any
+        self._banks = {}
+
+        # Mirrored pages show whatever their source page shows, and follow it
+        # when the source is remapped. source page -> [mirror pages], and
+        # _mirror_of the other way
+        self._mirrors = {}
+
+        # Pages somebody keeps derived state for, e.g. translated code. Only
+        # writes into these bump the page generation and notify subscribers.
+        # While nothing is watched write_byte is the plain bounds check and
+        # store. A page counts as watched when any page sharing its contents
+        # through a mirror is. _watch_counts and _generations are per page.
+        self._watched = bytearray(PAGE_COUNT)
+        self._watch_count = 0
+        self._subscribers = []
+
+        # Once tracking, the pages written since the last dirty_storage(),
+        # for incremental snapshots. Storage is named by the RAM page views
+        # written through: (None, page) for this Memory's own RAM and
+        # (bank name, bank page) for RAM banks, this Memory's own only once
+        # tracking. Remapping a written page moves its storage into
+        # _dirty_keys first.
+        self._tracking = False
+        self._dirty = bytearray(PAGE_COUNT)
+        self._dirty_keys = set()
+        self._storage = {}
+
+    # Slicing 256 page views is most of what a Memory costs to construct, so
+    # the page tables, like the other per-page lists, are only built when
+    # first looked up. From then on they are plain attributes and this is
+    # not called for them again.
+    def __getattr__(self, name):
+        if name in _PAGE_LISTS:
+            value = self.__dict__[name] = [_PAGE_LISTS[name]] * PAGE_COUNT
+            return value
+
+        if name not in ('pages', '_write_pages', '_ram'):
+            raise AttributeError(name)
+
+        view = self._view
+        self._ram = [view[page << 8:(page + 1) << 8]
+            for page in range(PAGE_COUNT)]
+        self.pages = list(self._ram)
+        self._write_pages = list(self._ram)
+
+        return self.__dict__[name]
+
+    # This Memory's own 64K of RAM, whatever the page tables show over it
+    @property
+    def ram(self):
+        return self._view
+
+    # The shared memory block's name, None when RAM is not shared
+    @property
+    def name(self):
+        return self._shared.name if self._shared is not None else None
+
+    # Releases and unlinks shared RAM. Views handed out by view() must have
+    # been released first.
+    def close(self):
+        if self._shared is None:
+            return
+
+        for page in self.__dict__.get('_ram', ()):
+            page.release()
+        self._view.release()
+        self._buffer = None
+        self._shared.close()
+        self._shared.unlink()
+        self._shared = None
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def watch(self, page):
+        self._watch_counts[page] += 1
+        self._watch_count += 1
+        self._sync_watched(page)
+
+        if self._watch_count == 1:
+            self._select_write_byte()
+
+    def unwatch(self, page):
+        self._watch_counts[page] -= 1
+        self._watch_count -= 1
+        self._sync_watched(page)
+
+        if not self._watch_count:
+            self._select_write_byte()
+
+    # The cheapest write_byte doing what watching and tracking need
+    def _select_write_byte(self):
+        if self._tracking:
+            self.write_byte = self._write_byte_tracked
+        elif self._watch_count:
+            self.write_byte = self._write_byte_watched
+        else:
+            self.__dict__.pop('write_byte', None)
+
+    # Starts recording which pages are written. Until then writes pay
+    # nothing for it.
+    def track_writes(self):
+        self._storage.update((id(view), (None, page))
+            for page, view in enumerate(self._ram))
+        self._tracking = True
+        self._select_write_byte()
+
+    @property
+    def tracking(self):
+        return self._tracking
+
+    # The RAM storage pages, see above, written through the address space
+    # since the last call, and starts over. Writes made straight into bank
+    # buffers or views are not seen.
+    def dirty_storage(self):
+        self._save_dirty(range(PAGE_COUNT))
+        dirty = self._dirty_keys
+        self._dirty_keys = set()
+
+        return sorted(dirty, key=lambda key: (key[0] is not None, key))
+
+    # Moves the dirty bits of pages over to the storage they were written
+    # through, while the page tables still show which that is
+    def _save_dirty(self, pages):
+        dirty = self._dirty
+
+        for page in pages:
+            if dirty[page]:
+                dirty[page] = 0
+                key = self._storage.get(id(self._write_pages[page]))
+                if key is not None:
+                    self._dirty_keys.add(key)
+
+    def storage_page(self, name, index):
+        if name is None:
+            return self._ram[index]
+
+        return self._banks[name].pages[index]
+
+    # Overwrites a storage page and invalidates everything derived from the
+    # pages showing it
+    def restore_storage_page(self, name, index, data):
+        view = self.storage_page(name, index)
+        view[:] = data
+
+        if self._watch_count:
+            for page, shown in enumerate(self.pages):
+                if shown is view and self._watched[page]:
+                    self._written(page << 8, (page + 1) << 8)
+
+    def generation(self, page):
+        return self._generations[page]
+
+    def kind(self, page):
+        return PageKind(self._kinds[page])
+
+    # The page and every page showing the same contents through mirrors
+    def _group(self, page):
+        source = self._mirror_of[page]
+        if source is None:
+            source = page
+
+        return [source] + self._mirrors.get(source, [])
+
+    def _sync_watched(self, page):
+        group = self._group(page)
+        watched = int(any(self._watch_counts[member] for member in group))
+
+        for member in group:
+            self._watched[member] = watched
+
+    # Called with the written range [start, end) when it touches a watched
+    # page. Writes are also reported at the addresses of mirrors of the
+    # written pages.
+    def _written(self, start, end):
+        ranges = [(start, end)]
+
+        if self._mirrors:
+            for page in range(start >> 8, ((end - 1) >> 8) + 1):
+                low = max(start, page << 8) & 0xff
+                high = ((min(end, (page + 1) << 8) - 1) & 0xff) + 1
+
+                for member in self._group(page):
+                    if member != page:
+                        base = member << 8
+                        ranges.append((base + low, base + high))
+
+        for range_start, range_end in ranges:
+            for page in range(range_start >> 8, ((range_end - 1) >> 8) + 1):
+                self._generations[page] += 1
+
+            for callback in self._subscribers:
+                callback(range_start, range_end)
+
+    def _check_page_range(self, address, size):
+        if address & 0xff or size & 0xff:
+            raise ValueError('Must be page aligned: ${0:04x}+{1:x}'.format(
+                address, size))
+        if address < 0x0 or address + size > 0x10000:
+            msg = 'Memory map out of bounds: ${0:06x}'.format(address + size)
+            raise InvalidMemoryAddressError(msg)
+
+    def _detach(self, page):
+        source = self._mirror_of[page]
+        if source is None:
+            return
+
+        self._mirror_of[page] = None
+        self._mirrors[source].remove(page)
+        if not self._mirrors[source]:
+            del self._mirrors[source]
+
+        self._sync_watched(source)
+        self._sync_watched(page)
+
+    # Points page, and every mirror of it, at new read and write pages
+    def _set_page(self, page, read, write, kind, bank_page=None):
+        if self._tracking:
+            self._save_dirty((page, ) + tuple(self._mirrors.get(page, ())))
+
+        self._detach(page)
+        self.pages[page] = read
+        self._write_pages[page] = write
+        self._kinds[page] = kind
+        self._bank_pages[page] = bank_page
+
+        for mirror in self._mirrors.get(page, ()):
+            self.pages[mirror] = read
+            self._write_pages[mirror] = write
+
+    def _remapped(self, first, last):
+        if any(self._watched[first:last]):
+            self._written(first << 8, last << 8)
+
+    # Maps the pages of a RomImage read-only at address, without copying
+    def map_rom(self, image, address=0):
+        self._check_page_range(address, len(image.pages) << 8)
+        first = address >> 8
+
+        for index, page in enumerate(image.pages):
+            self._set_page(first + index, page, _SINK, PageKind.ROM)
+
+        self._remapped(first, first + len(image.pages))
+
+    # Puts this Memory's own RAM back under [address, address + size)
+    def unmap(self, address, size):
+        self._check_page_range(address, size)
+        first = address >> 8
+        last = first + (size >> 8)
+
+        for page in range(first, last):
+            self._set_page(page, self._ram[page], self._ram[page],
+                PageKind.RAM)
+
+        self._remapped(first, last)
+
+    # Makes this Memory's own RAM under [address, address + size) read-only,
+    # e.g. after loading a ROM image into it
+    def protect(self, address, size):
+        self._check_page_range(address, size)
+        first = address >> 8
+
+        for page in range(first, first + (size >> 8)):
+            self._set_page(page, self._ram[page], _SINK, PageKind.ROM)
+
+    # Makes [address, address + size) show [source, source + size), like
+    # address lines a board does not decode
+    def mirror(self, address, size, source):
+        self._check_page_range(address, size)
+        self._check_page_range(source, size)
+        first = address >> 8
+        count = size >> 8
+
+        for index in range(count):
+            page = first + index
+            target = (source >> 8) + index
+            if self._mirror_of[target] is not None:
+                target = self._mirror_of[target]
+
+            if page == target or page in self._mirrors:
+                raise ValueError('Cannot mirror page ${0:02x} onto '
+                    '${1:02x}'.format(page, target))
+
+            if self._tracking:
+                self._save_dirty((page, ))
+
+            self._detach(page)
+            self._mirror_of[page] = target
+            self._mirrors.setdefault(target, []).append(page)
+            self.pages[page] = self.pages[target]
+            self._write_pages[page] = self._write_pages[target]
+            self._kinds[page] = PageKind.MIRROR
+            self._sync_watched(target)
+
+        self._remapped(first, first + count)
+
+    # Routes [address, address + size) to device handlers. read(address)
+    # returns a byte, write(address, value) stores one and defaults to
+    # dropping writes.
+    def map_io(self, address, size, read, write=None):
+        self._check_page_range(address, size)
+        first = address >> 8
+
+        for page in range(first, first + (size >> 8)):
+            io = IOPage(page << 8, read, write)
+            self._set_page(page, io, io if write else _SINK, PageKind.MMIO)
+
+        self._remapped(first, first + (size >> 8))
+
+    # Adds a zero-filled RAM bank of size bytes and returns its buffer, for
+    # loading it
+    def add_bank(self, name, size):
+        self._check_page_range(0, size)
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        self._add_bank(Bank(name, (view[start:start + PAGE_SIZE]
+            for start in range(0, size, PAGE_SIZE)), True, buffer))
+
+        return buffer
+
+    # Adds a read-only bank backed by a RomImage, without copying it
+    def add_rom_bank(self, name, image):
+        self._add_bank(Bank(name, image.pages, False))
+
+    def _add_bank(self, bank):
+        if bank.name in self._banks:
+            raise ValueError('Bank {0!r} already exists'.format(bank.name))
+
+        self._banks[bank.name] = bank
+
+        if bank.buffer is not None:
+            for index, view in enumerate(bank.pages):
+                self._storage[id(view)] = (bank.name, index)
+
+    def bank(self, name):
+        return self._banks[name]
+
+    # The (bank name, bank page) page shows, or None when it is not banked
+    def bank_page(self, page):
+        return self._bank_pages[page]
+
+    # Every bank added, in the order added
+    def banks(self):
+        return list(self._banks.values())
+
+    # The (bank name, bank page) every page shows, None where not banked,
+    # for save states
+    def bank_mapping(self):
+        return list(self._bank_pages)
+
+    # Puts a bank_mapping back: banked pages are remapped to the bank pages
+    # they showed, pages that were not banked get this Memory's own RAM back
+    # if they are banked now
+    def restore_bank_mapping(self, mapping):
+        for page, bank_page in enumerate(mapping):
+            if bank_page == self._bank_pages[page]:
+                continue
+
+            if bank_page is None:
+                self._set_page(page, self._ram[page], self._ram[page],
+                    PageKind.RAM)
+            else:
+                name, index = bank_page
+                bank = self._banks[name]
+                self._set_page(page, bank.pages[index],
+                    bank.write_pages[index], bank.kind, bank.ids[index])
+
+            self._remapped(page, page + 1)
+
+    # Overwrites this Memory's own RAM with data, 64K of it, and invalidates
+    # whatever was derived from it
+    def restore_ram(self, data):
+        self._view[:] = data
+
+        if self._watch_count:
+            self._written(0x0000, 0x10000)
+
+    # Pages size bytes of the named bank, from offset on, in at address. Only
+    # page table entries change, so this costs O(size / PAGE_SIZE) and copies
+    # no bytes. Translated code over the range is invalidated.
+    def map_bank(self, name, address, size=None, offset=0):
+        bank = self._banks[name]
+        if size is None:
+            size = (len(bank.pages) << 8) - offset
+
+        self._check_page_range(address, size)
+        self._check_page_range(offset, size)
+        first = address >> 8
+        last = first + (size >> 8)
+        start = offset >> 8
+        stop = start + (size >> 8)
+
+        if stop > len(bank.pages):
+            raise ValueError('Bank {0!r} is only {1:x} bytes'.format(name,
+                len(bank.pages) << 8))
+
+        if self._mirrors:
+            for page in range(first, last):
+                index = start + page - first
+                self._set_page(page, bank.pages[index],
+                    bank.write_pages[index], bank.kind, bank.ids[index])
+        else:
+            if self._tracking:
+                self._save_dirty(range(first, last))
+
+            self.pages[first:last] = bank.pages[start:stop]
+            self._write_pages[first:last] = bank.write_pages[start:stop]
+            self._kinds[first:last] = bank.kinds[start:stop]
+            self._bank_pages[first:last] = bank.ids[start:stop]
+
+        self._remapped(first, last)
+
+    # A memoryview of [address, address + size) straight over the storage
+    # behind it, for zero-copy readers. The range must be backed by one
+    # buffer: this Memory's own RAM or consecutive pages of one RAM bank.
+    # The view keeps showing that storage if the range is remapped later.
+    def view(self, address, size):
+        end = address + size
+
+        if size <= 0 or address < 0x0 or end > 0x10000:
+            msg = 'Memory view out of bounds: ${0:06x}'.format(end)
+            raise InvalidMemoryAddressError(msg)
+
+        first = address >> 8
+        last = ((end - 1) >> 8) + 1
+
+        if all(self.pages[page] is self._ram[page]
+                for page in range(first, last)):
+            return memoryview(self._buffer)[address:end]
+
+        bank_pages = self._bank_pages[first:last]
+        if all(bank_pages) and len({name for name, _ in bank_pages}) == 1:
+            name, start = bank_pages[0]
+            bank = self._banks[name]
+            contiguous = all(index == start + offset
+                for offset, (_, index) in enumerate(bank_pages))
+
+            if contiguous and bank.buffer is not None:
+                offset = (start << 8) + (address & 0xff)
+                return memoryview(bank.buffer)[offset:offset + size]
+
+        raise ValueError('${0:04x}-${1:04x} is not backed by one RAM '
+            'buffer'.format(address, end - 1))
 
     def read_byte(self, address):
         if address < 0x0 or address > 0xffff:
             msg = 'Memory read out of bounds: ${0:06x}'.format(address)
             raise InvalidMemoryAddressError(msg)
 
-        return self._buffer[address]
+        return self.pages[address >> 8][address & 0xff]
 
     def write_byte(self, address, value):
         if address < 0x0 or address > 0xffff:
             msg = 'Memory write out of bounds: ${0:06x}'.format(address)
             raise InvalidMemoryAddressError(msg)
 
-        self._buffer[address] = value
+        self._write_pages[address >> 8][address & 0xff] = value
 
-    def read_double_byte(self, address):
+    def _write_byte_watched(self, address, value):
+        if address < 0x0 or address > 0xffff:
+            msg = 'Memory write out of bounds: ${0:06x}'.format(address)
+            raise InvalidMemoryAddressError(msg)
+
+        self._write_pages[address >> 8][address & 0xff] = value
+
+        if self._watched[address >> 8]:
+            self._written(address, address + 1)
+
+    def _write_byte_tracked(self, address, value):
         if address < 0x0 or address > 0xffff:
+            msg = 'Memory write out of bounds: ${0:06x}'.format(address)
+            raise InvalidMemoryAddressError(msg)
+
+        page = address >> 8
+        self._write_pages[page][address & 0xff] = value
+        self._dirty[page] = 1
+
+        if self._watched[page]:
+            self._written(address, address + 1)
+
+    def read_double_byte(self, address):
+        if address < 0x0 or address > 0xfffe:
             msg = 'Memory read out of bounds: ${0:06x}'.format(address)
             raise InvalidMemoryAddressError(msg)
 
-        end = address + 2
-        return int.from_bytes(self._buffer[address:end], byteorder='little', 
-            signed=False)
+        return (self.pages[address >> 8][address & 0xff]
+            | self.pages[(address + 1) >> 8][(address + 1) & 0xff] << 8)
 
     def write_double_byte(self, address, value):
         if address < 0x0 or address > 0xffff:
             msg = 'Memory write out of bounds: ${0:06x}'.format(address)
             raise InvalidMemoryAddressError(msg)
 
-        self._buffer[address - 1] = value >> 8
-        self._buffer[address - 2] = value & 0xff
+        high = (address - 1) & 0xffff
+        low = (address - 2) & 0xffff
+        self._write_pages[high >> 8][high & 0xff] = value >> 8
+        self._write_pages[low >> 8][low & 0xff] = value & 0xff
+        self._dirty[high >> 8] = self._dirty[low >> 8] = 1
+
+        if self._watched[high >> 8] or self._watched[low >> 8]:
+            self._written(low, low + 2)
+
+    def read_bytes(self, address, size):
+        end = address + size
+
+        if address < 0x0 or end > 0x10000:
+            msg = 'Memory read out of bounds: ${0:06x}'.format(end)
+            raise InvalidMemoryAddressError(msg)
+
+        return b''.join(page[low:high]
+            for page, low, high in self._chunks(self.pages, address, end))
+
+    def write_bytes(self, address, data):
+        end = address + len(data)
+
+        if address < 0x0 or end > 0x10000:
+            msg = 'Memory write out of bounds: ${0:06x}'.format(address)
+            raise InvalidMemoryAddressError(msg)
+
+        data = memoryview(data).cast('B')
+        offset = 0
+        for page, low, high in self._chunks(self._write_pages, address, end):
+            page[low:high] = data[offset:offset + high - low]
+            offset += high - low
+
+        first = address >> 8
+        last = ((end - 1) >> 8) + 1
+        self._dirty[first:last] = b'\x01' * (last - first)
+
+        if any(self._watched[first:last]):
+            self._written(address, end)
+
+    # (page, start offset, end offset) of the given page table covering
+    # [start, end)
+    @staticmethod
+    def _chunks(table, start, end):
+        while start < end:
+            stop = min(end, (start | 0xff) + 1)
+            yield table[start >> 8], start & 0xff, ((stop - 1) & 0xff) + 1
+            start = stop
+
+class MemoryObserver(object):
+    # Read-only access to the RAM of a shared Memory, from any process,
+    # without copying or messaging
+    def __init__(self, name):
+        self._shared = SharedMemory(name)
+        # Only the creating process may unlink the block
+        resource_tracker.unregister(self._shared._name, 'shared_memory')
+        self.buffer = self._shared.buf
+
+    def read_byte(self, address):
+        return self.buffer[address]
+
+    def read_bytes(self, address, size):
+        return bytes(self.buffer[address:address + size])
+
+    def view(self, address, size):
+        return self.buffer[address:address + size]
 
+    def close(self):
+        self.buffer = None
+        self._shared.close()
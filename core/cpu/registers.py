@@ -3,7 +3,7 @@ import logging
 from enum import IntEnum, unique
 
 # Local
-from .flags import get_bit, zero_bit, sign_bit, carry_bit, parity_bit
+from .flags import AC, CY, SZP
 
 @unique
 class RegID(IntEnum):
@@ -23,209 +23,217 @@ class DRegID(IntEnum):
     SP = 7
     PC = 8
 
-def flags(value):
-    return {
-        'z': zero_bit(value), 
-        's': sign_bit(value), 
-        'cy': carry_bit(value), 
-        'p': parity_bit(value)
-    }
+_NAMES = ('a', 'b', 'c', 'd', 'e', 'h', 'l', 'sp', 'pc')
 
 class Registers(object):
     logger = logging.getLogger('Registers')
 
+    # The whole architectural state lives in plain ints on one slotted object
+    # which the instruction handlers touch directly. f holds the flags in
+    # their PSW layout, unless lazy_aux is set: then the lazy-flags handlers
+    # have deferred them and they are derived from lazy_result/lazy_aux.
+    # inte is the interrupt enable flip-flop, 2 right after an EI until the
+    # instruction after it has run. halted is set while HLT waits for an
+    # interrupt.
+    __slots__ = ('a', 'b', 'c', 'd', 'e', 'h', 'l', 'f', 'sp', 'pc',
+        'lazy_result', 'lazy_aux', 'inte', 'halted')
+
     def __init__(self):
-        self._items = bytearray(7)
+        self.a = 0
+        self.b = 0
+        self.c = 0
+        self.d = 0
+        self.e = 0
+        self.h = 0
+        self.l = 0
+        self.f = 0x02
+        self.sp = 0xffff
+        self.pc = 0
+        self.lazy_result = 0
+        self.lazy_aux = None
+        self.inte = 0
+        self.halted = 0
+
+    def materialize_flags(self):
+        if self.lazy_aux is None:
+            return
+
+        result = self.lazy_result
+        self.f = (SZP[result & 0xff] | ((self.lazy_aux ^ result) & AC)
+            | (result >> 8 & CY))
+        self.lazy_aux = None
 
     def get(self, id):
-        return self._items[id]
+        return getattr(self, _NAMES[id])
 
     def set(self, id, value):
-        self._items[id] = value & 0xff
+        setattr(self, _NAMES[id], value & 0xff)
 
     def increment(self, id, value):
         if value < 0:
             raise ValueError('Must be a positive value')
 
-        answer = self._items[id] + value
-        Registers.logger.info(
-            'increment {0}: {1:x} + {2:x} = {3:x}'.format(
-                id.name, self._items[id], value, answer
-            )
-        )
+        current = self.get(id)
+        answer = current + value
+        Registers.logger.debug('increment %s: %x + %x = %x',
+            id.name, current, value, answer)
 
         self.set(id, answer)
+        self.f = (SZP[answer & 0xff] | ((current ^ value ^ answer) & AC)
+            | (answer >> 8 & CY))
+        self.lazy_aux = None
 
-        return flags(answer)
+        return self.f
 
     def decrement(self, id, value):
         if value < 0:
             raise ValueError('Must be a positive value')
 
-        answer = self._items[id] - value
-        Registers.logger.info(
-            'decrement {0}: {1:x} - {2:x} = {3:x}'.format(
-                id.name, self._items[id], value, answer
-            )
-        )
+        current = self.get(id)
+        answer = current - value
+        Registers.logger.debug('decrement %s: %x - %x = %x',
+            id.name, current, value, answer)
 
         self.set(id, answer)
+        self.f = (SZP[answer & 0xff] | (~(current ^ value ^ answer) & AC)
+            | (answer >> 8 & CY))
+        self.lazy_aux = None
 
-        return flags(answer)
+        return self.f
 
     def and_(self, id, value):
-        answer = self._items[id] & value
+        current = self.get(id)
+        answer = current & value
 
-        Registers.logger.info(
-            'and {0}: {1:x} & {2:x} = {3:x}'.format(
-                id.name, 
-                self._items[id], 
-                value, 
-                answer
-            )
-        )
+        Registers.logger.debug('and %s: %x & %x = %x',
+            id.name, current, value, answer)
 
         self.set(id, answer)
+        self.f = SZP[answer] | ((current | value) << 1 & AC)
+        self.lazy_aux = None
 
-        return flags(answer)
+        return self.f
 
     def or_(self, id, value):
-        answer = self._items[id] | value
+        current = self.get(id)
+        answer = current | value
 
-        Registers.logger.info(
-            'and {0}: {1:x} | {2:x} = {3:x}'.format(
-                id.name, 
-                self._items[id], 
-                value, 
-                answer
-            )
-        )
+        Registers.logger.debug('and %s: %x | %x = %x',
+            id.name, current, value, answer)
 
         self.set(id, answer)
+        self.f = SZP[answer]
+        self.lazy_aux = None
 
-        return flags(answer)
+        return self.f
 
     def not_(self, id):
-        answer = self._items[id] ^ 0xff
+        current = self.get(id)
+        answer = current ^ 0xff
 
-        Registers.logger.info(
-            'not {0}: {1:x} ^ 0xff = {2:x}'.format(
-                id.name, 
-                self._items[id], 
-                answer
-            )
-        )
+        Registers.logger.debug('not %s: %x ^ 0xff = %x',
+            id.name, current, answer)
 
         self.set(id, answer)
 
-        return flags(answer)
+        return self.f
 
     def shift_left_(self, id):
-        answer = (self._items[id] << 0x01) | (self._items[id] >> 0x07)
+        current = self.get(id)
+        answer = (current << 0x01) | (current >> 0x07)
 
-        Registers.logger.info(
-            'shift_left {0}: {1:x} << {2:x} = {3:x}'.format(
-                id.name, 
-                self._items[id], 
-                0x01, 
-                answer
-            )
-        )
+        Registers.logger.debug('shift_left %s: %x << %x = %x',
+            id.name, current, 0x01, answer)
 
         self.set(id, answer)
+        self.materialize_flags()
+        self.f = (self.f & ~CY) | (current >> 0x07)
 
-        return flags(answer)
+        return self.f
 
     def shift_left_carry_(self, id, cy):
-        tmp = self._items[id]
+        tmp = self.get(id)
         answer = (tmp << 0x01) | cy
-        carry = bool(get_bit(tmp, 7))
 
         self.set(id, answer)
+        self.materialize_flags()
+        self.f = (self.f & ~CY) | (tmp >> 0x07)
 
-        return {'cy': carry}
+        return self.f
 
     def shift_right_(self, id):
-        tmp = self._items[id]
+        tmp = self.get(id)
         answer = (tmp >> 0x01) | (tmp << 0x07)
 
-        Registers.logger.info(
-            'shift_right {0}: {1:x} >> {2:x} = {3:x}'.format(
-                id.name, 
-                self._items[id], 
-                0x01, 
-                answer
-            )
-        )
-
-        carry = bool(get_bit(tmp, 0))
+        Registers.logger.debug('shift_right %s: %x >> %x = %x',
+            id.name, self.get(id), 0x01, answer)
 
         self.set(id, answer)
+        self.materialize_flags()
+        self.f = (self.f & ~CY) | (tmp & 0x01)
 
-        return {'cy': carry}
+        return self.f
 
     def shift_right_carry_(self, id, cy):
-        tmp = self._items[id]
+        tmp = self.get(id)
         answer = (tmp >> 0x01) | (cy << 7)
-        carry = bool(get_bit(tmp, 0))
 
         self.set(id, answer)
+        self.materialize_flags()
+        self.f = (self.f & ~CY) | (tmp & 0x01)
 
-        return {'cy': carry}
+        return self.f
 
     def xor_(self, id, value):
-        answer = self._items[id] ^ value
+        current = self.get(id)
+        answer = current ^ value
 
-        Registers.logger.info(
-            'xor {0}: {1:x} ^ {2:x} = {3:x}'.format(
-                id.name, 
-                self._items[id], 
-                value, 
-                answer
-            )
-        )
+        Registers.logger.debug('xor %s: %x ^ %x = %x',
+            id.name, current, value, answer)
 
         self.set(id, answer)
+        self.f = SZP[answer]
+        self.lazy_aux = None
 
-        return flags(answer)
+        return self.f
 
     def get_pair(self, id):
-        end = id + 2
-        return int.from_bytes(self._items[id:end], byteorder='big', 
-            signed=False)
+        if id >= DRegID.SP:
+            return getattr(self, _NAMES[id])
+
+        return getattr(self, _NAMES[id]) << 8 | getattr(self, _NAMES[id + 1])
 
     def set_pair(self, id, value):
-        # Not sure if correct
-        value = value & 0xff
-        self._items[id] = value >> 8
-        self._items[id + 1] = value & 0xff
+        value = value & 0xffff
+
+        if id >= DRegID.SP:
+            setattr(self, _NAMES[id], value)
+        else:
+            setattr(self, _NAMES[id], value >> 8)
+            setattr(self, _NAMES[id + 1], value & 0xff)
 
     def increment_pair(self, id, value):
         if value < 0:
             raise ValueError('Must be a positive value')
 
         answer = self.get_pair(id) + value
-        Registers.logger.info(
-            'increment_pair {0}: {1:x} + {2:x} = {3:x}'.format(
-                id.name, self.get_pair(id), value, answer
-            )
-        )
+        Registers.logger.debug('increment_pair %s: %x + %x = %x',
+            id.name, self.get_pair(id), value, answer)
 
         self.set_pair(id, answer)
+        self.materialize_flags()
+        self.f = (self.f & ~CY) | (answer >> 16 & CY)
 
-        return flags(answer)
+        return self.f
 
     def decrement_pair(self, id, value):
         if value < 0:
             raise ValueError('Must be a positive value')
 
         answer = self.get_pair(id) - value
-        Registers.logger.info(
-            'decrement_pair {0}: {1:x} - {2:x} = {3:x}'.format(
-                id.name, self.get_pair(id), value, answer
-            )
-        )
+        Registers.logger.debug('decrement_pair %s: %x - %x = %x',
+            id.name, self.get_pair(id), value, answer)
 
         self.set_pair(id, answer)
-        
-        return flags(answer)
+
+        return self.f
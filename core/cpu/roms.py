@@ -0,0 +1,104 @@
+# Python
+import logging
+import mmap
+from multiprocessing.shared_memory import SharedMemory
+import os
+from threading import Lock
+
+# Local
+from .memory import PAGE_SIZE
+
+logger = logging.getLogger('Roms')
+
+class RomImage(object):
+    # A ROM file memory-mapped read-only and cut into page-sized memoryviews
+    # that any number of Memory instances can map. A trailing partial page is
+    # the only part copied, zero-padded to a full page.
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, 'rb') as f:
+            self.size = os.fstat(f.fileno()).st_size
+            if self.size:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._map = b''
+
+        view = memoryview(self._map)
+        whole = self.size // PAGE_SIZE * PAGE_SIZE
+        pages = [view[start:start + PAGE_SIZE]
+            for start in range(0, whole, PAGE_SIZE)]
+
+        if whole < self.size:
+            tail = bytes(view[whole:]).ljust(PAGE_SIZE, b'\0')
+            pages.append(memoryview(tail))
+
+        self.pages = tuple(pages)
+
+class SharedRomImage(object):
+    # A ROM image in a multiprocessing shared memory block, for handing one
+    # copy of a ROM to worker processes by name instead of pickling it. load
+    # copies a file into a new block, padded to whole pages, and the
+    # constructor attaches to the block named name from any process. Maps
+    # like a RomImage. close() releases it, and unlinks it in the process
+    # that loaded it. Attach from processes started by multiprocessing.
+    def __init__(self, name, size, filename=None, _shared=None):
+        self.filename = filename
+        self.size = size
+        self._owner = _shared is not None
+
+        # Processes started by multiprocessing share the loading process's
+        # resource tracker, which unlinks the block if the loader dies
+        if _shared is None:
+            _shared = SharedMemory(name)
+
+        self._shared = _shared
+        view = _shared.buf
+        self.pages = tuple(view[start:start + PAGE_SIZE]
+            for start in range(0, size, PAGE_SIZE))
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+
+        padded = max(PAGE_SIZE, -(-len(data) // PAGE_SIZE) * PAGE_SIZE)
+        shared = SharedMemory(create=True, size=padded)
+        shared.buf[:len(data)] = data
+        shared.buf[len(data):padded] = bytes(padded - len(data))
+        logger.info('Shared %s as %s, %d bytes', filename, shared.name,
+            len(data))
+
+        return cls(shared.name, len(data), filename, shared)
+
+    @property
+    def name(self):
+        return self._shared.name
+
+    def close(self):
+        if self._shared is None:
+            return
+
+        for page in self.pages:
+            page.release()
+        self.pages = ()
+        self._shared.close()
+
+        if self._owner:
+            self._shared.unlink()
+        self._shared = None
+
+_IMAGES = {}
+_LOCK = Lock()
+
+# Returns the process-wide RomImage of filename, mapping it on first use
+def open_rom(filename):
+    key = os.path.realpath(filename)
+
+    with _LOCK:
+        image = _IMAGES.get(key)
+        if image is None:
+            image = _IMAGES[key] = RomImage(filename)
+            logger.info('Mapped %s, %d bytes', filename, image.size)
+
+    return image
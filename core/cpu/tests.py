@@ -1,9 +1,17 @@
 # Python
+import os
+from tempfile import NamedTemporaryFile
 from unittest import TestCase
 
 # External
 
 # Local
+from .cpus import CPU
+from .flags import CY, SZP, ConditionFlags
+from .instructions import CYCLES, INSTRUCTIONS
+from .io import IOBus
+from .memory import BankSwitch, Memory, MemoryObserver, PageKind
+from .roms import RomImage, SharedRomImage, open_rom
 from .registers import RegID, DRegID, Registers
 
 class RegistersAndTestCase(TestCase):
@@ -65,13 +73,13 @@ class RegistersShiftLeftTestCase(TestCase):
         self.registers.set(RegID.A, 0x70)
         flags = self.registers.shift_left_(RegID.A)
         self.assertEqual(self.registers.get(RegID.A), 0xe0)
-        self.assertEqual(flags['cy'], False)
+        self.assertEqual(flags & CY, 0)
 
     def test_shift_left_high_bit_1(self):
         self.registers.set(RegID.A, 0xf2)
         flags = self.registers.shift_left_(RegID.A)
         self.assertEqual(self.registers.get(RegID.A), 0xe5)
-        self.assertEqual(flags['cy'], True)
+        self.assertEqual(flags & CY, CY)
 
 class RegisterShiftLeftCarryTestCase(TestCase):
     def setUp(self):
@@ -82,14 +90,14 @@ class RegisterShiftLeftCarryTestCase(TestCase):
         cy = False
         flags = self.registers.shift_left_carry_(RegID.A, cy)
         self.assertEqual(self.registers.get(RegID.A), 0xea)
-        self.assertEqual(flags['cy'], False)
+        self.assertEqual(flags & CY, 0)
 
     def test_shift_left_carry_high_bit_1(self):
         self.registers.set(RegID.A, 0xb5)
         cy = False
         flags = self.registers.shift_left_carry_(RegID.A, cy)
         self.assertEqual(self.registers.get(RegID.A), 0x6a)
-        self.assertEqual(flags['cy'], True)
+        self.assertEqual(flags & CY, CY)
 
 class RegistersShiftRightTestCase(TestCase):
     def setUp(self):
@@ -99,10 +107,692 @@ class RegistersShiftRightTestCase(TestCase):
         self.registers.set(RegID.A, 0xf2)
         flags = self.registers.shift_right_(RegID.A)
         self.assertEqual(self.registers.get(RegID.A), 0x79)
-        self.assertEqual(flags['cy'], False)
+        self.assertEqual(flags & CY, 0)
 
     def test_shift_right_low_bit_1(self):
         self.registers.set(RegID.A, 0xf3)
         flags = self.registers.shift_right_(RegID.A)
         self.assertEqual(self.registers.get(RegID.A), 0xf9)
-        self.assertEqual(flags['cy'], True)
+        self.assertEqual(flags & CY, CY)
+
+class RegistersFlagsTestCase(TestCase):
+    def setUp(self):
+        self.registers = Registers()
+
+    def test_increment_carry(self):
+        self.registers.set(RegID.A, 0xff)
+        flags = self.registers.increment(RegID.A, 0x01)
+        self.assertEqual(self.registers.get(RegID.A), 0x00)
+        self.assertEqual(flags, 0x57)
+
+    def test_decrement_borrow(self):
+        self.registers.set(RegID.A, 0x00)
+        flags = self.registers.decrement(RegID.A, 0x01)
+        self.assertEqual(self.registers.get(RegID.A), 0xff)
+        self.assertEqual(flags, 0x87)
+
+class SZPTableTestCase(TestCase):
+    def test_entries(self):
+        self.assertEqual(SZP[0x00], 0x46)
+        self.assertEqual(SZP[0x01], 0x02)
+        self.assertEqual(SZP[0x03], 0x06)
+        self.assertEqual(SZP[0x80], 0x82)
+        self.assertEqual(SZP[0xff], 0x86)
+
+class InstructionTableTestCase(TestCase):
+    def test_table_covers_every_opcode(self):
+        self.assertEqual(len(INSTRUCTIONS), 256)
+        self.assertTrue(all(callable(i) for i in INSTRUCTIONS))
+
+    def test_mvi_add(self):
+        cpu = CPU()
+        # MVI A, 0x3a; MVI B, 0xc6; ADD B
+        cpu.load(bytearray([0x3e, 0x3a, 0x06, 0xc6, 0x80]))
+
+        for _ in range(3):
+            cpu._execute(cpu.ram.read_byte(cpu.get_program_counter()))
+
+        self.assertEqual(cpu.registers.get(RegID.A), 0x00)
+        self.assertEqual(cpu.get_program_counter(), 5)
+        self.assertTrue(cpu.condition_flags.z)
+        self.assertTrue(cpu.condition_flags.cy)
+        self.assertTrue(cpu.condition_flags.ac)
+
+class RegistersPairTestCase(TestCase):
+    def setUp(self):
+        self.registers = Registers()
+
+    def test_set_pair(self):
+        self.registers.set_pair(DRegID.HL, 0x12345)
+        self.assertEqual(self.registers.get(RegID.H), 0x23)
+        self.assertEqual(self.registers.get(RegID.L), 0x45)
+        self.assertEqual(self.registers.get_pair(DRegID.HL), 0x2345)
+
+    def test_set_stack_pointer(self):
+        self.registers.set_pair(DRegID.SP, 0x2400)
+        self.assertEqual(self.registers.sp, 0x2400)
+
+class ConditionFlagsTestCase(TestCase):
+    def test_view_of_registers(self):
+        registers = Registers()
+        flags = ConditionFlags(registers)
+        flags.cy = True
+        flags.z = True
+        self.assertEqual(registers.f, 0x43)
+
+        registers.f = 0x86
+        self.assertTrue(flags.s)
+        self.assertTrue(flags.p)
+        self.assertFalse(flags.cy)
+
+class LazyFlagsTestCase(TestCase):
+    # MVI B, 0x10; ADD C; ADC D; SUB E; XRA H; ORA L; ANA A; CMP C; ADI 0x03;
+    # SBI 0x01; INR D; DCR B; JNZ 0x0002; PUSH PSW
+    ROM = bytearray([0x06, 0x10, 0x81, 0x8a, 0x93, 0xac, 0xb5, 0xa7, 0xb9,
+        0xc6, 0x03, 0xde, 0x01, 0x14, 0x05, 0xc2, 0x02, 0x00, 0xf5])
+
+    def _run(self, lazy_flags):
+        cpu = CPU(lazy_flags=lazy_flags)
+        cpu.load(self.ROM)
+        cpu.registers.c = 0x5a
+        cpu.registers.e = 0x27
+
+        while cpu.get_program_counter() < len(self.ROM):
+            cpu._execute(self.ROM[cpu.get_program_counter()])
+
+        return cpu
+
+    def test_matches_eager(self):
+        eager = self._run(False)
+        lazy = self._run(True)
+
+        for name in ('a', 'b', 'c', 'd', 'e', 'h', 'l', 'sp', 'pc'):
+            self.assertEqual(getattr(lazy.registers, name),
+                getattr(eager.registers, name))
+
+        sp = eager.registers.sp
+        self.assertEqual(lazy.ram.read_byte(sp), eager.ram.read_byte(sp))
+        self.assertEqual(lazy.condition_flags.z, eager.condition_flags.z)
+        self.assertEqual(lazy.registers.f, eager.registers.f)
+
+    def test_flags_view_materializes(self):
+        cpu = CPU(lazy_flags=True)
+        # MVI A, 0xff; ADI 0x01
+        cpu.load(bytearray([0x3e, 0xff, 0xc6, 0x01]))
+        cpu._execute(0x3e)
+        cpu._execute(0xc6)
+
+        self.assertIsNotNone(cpu.registers.lazy_aux)
+        self.assertTrue(cpu.condition_flags.z)
+        self.assertIsNone(cpu.registers.lazy_aux)
+        self.assertEqual(cpu.registers.f, 0x57)
+
+class BlockCacheTestCase(TestCase):
+    def _run(self, **kwargs):
+        cpu = CPU(**kwargs)
+        cpu.load(LazyFlagsTestCase.ROM)
+        cpu.registers.c = 0x5a
+        cpu.registers.e = 0x27
+
+        while cpu.get_program_counter() < len(LazyFlagsTestCase.ROM):
+            if cpu._blocks is None:
+                cpu._execute(cpu.ram.read_byte(cpu.get_program_counter()))
+            else:
+                cpu._blocks.execute()
+
+        return cpu
+
+    def test_matches_interpreter(self):
+        interpreted = self._run()
+
+        for kwargs in ({'translate': True},
+                {'translate': True, 'lazy_flags': True}):
+            translated = self._run(**kwargs)
+
+            for name in ('a', 'b', 'c', 'd', 'e', 'h', 'l', 'f', 'sp', 'pc'):
+                self.assertEqual(getattr(translated.registers, name),
+                    getattr(interpreted.registers, name))
+
+            sp = interpreted.registers.sp
+            self.assertEqual(translated.ram.read_byte(sp),
+                interpreted.ram.read_byte(sp))
+
+    def test_blocks_end_at_jumps(self):
+        cpu = self._run(translate=True)
+
+        # MVI B; the loop body up to JNZ; PUSH PSW
+        self.assertEqual(len(cpu._blocks), 3)
+        self.assertEqual(cpu._blocks.lookup(0x02)[1], 12)
+
+    def test_barrier_falls_back_to_interpreter(self):
+        cpu = CPU(translate=True)
+        # MVI A, 0x01; DI; INR A
+        cpu.load(bytearray([0x3e, 0x01, 0xf3, 0x3c]))
+
+        self.assertEqual(cpu._blocks.execute(), 1)
+        self.assertEqual(cpu._blocks.execute(), 1)
+        self.assertEqual(cpu.get_program_counter(), 0x03)
+        self.assertEqual(cpu._blocks.execute(), 1)
+        self.assertEqual(cpu.registers.a, 0x02)
+
+    def test_write_evicts_translated_code(self):
+        cpu = CPU(translate=True)
+        # $0000: MVI A, 0x01; JMP $0010
+        # $0010: MVI A, 0x05; STA $0001; JMP $0000
+        cpu.ram.write_bytes(0x00, bytes([0x3e, 0x01, 0xc3, 0x10, 0x00]))
+        cpu.ram.write_bytes(0x10, bytes([0x3e, 0x05, 0x32, 0x01, 0x00, 0xc3,
+            0x00, 0x00]))
+        cpu.load(cpu.ram._buffer)
+
+        cpu._blocks.execute()
+        self.assertEqual(cpu.registers.a, 0x01)
+        cpu._blocks.execute()
+        self.assertEqual(len(cpu._blocks), 1)
+        cpu._blocks.execute()
+        self.assertEqual(cpu.registers.a, 0x05)
+
+    def test_block_patching_itself(self):
+        # LXI H, $0008; MVI M, 0x05; NOP; NOP; MVI A, 0x01; INR A, with the
+        # MVI M patching the operand of the MVI A in the same block
+        code = bytearray([0x21, 0x08, 0x00, 0x36, 0x05, 0x00, 0x00, 0x3e,
+            0x01, 0x3c])
+        cpus = [CPU(), CPU(translate=True), CPU(translate=True,
+            lazy_flags=True)]
+
+        for cpu in cpus:
+            cpu.load(code)
+            cpu.run_for(1000)
+            self.assertEqual(cpu.registers.a, 0x06)
+            self.assertEqual(cpu.cycles, cpus[0].cycles)
+
+        # It leaves after the store, and is translated again
+        cpus[1].set_program_counter(0x0000)
+        self.assertEqual(cpus[1]._blocks.lookup(0x0000)[1], 6)
+        self.assertEqual(cpus[1]._blocks.execute(), 2)
+        self.assertEqual(cpus[1].get_program_counter(), 0x0005)
+
+    def test_load_clears_cache(self):
+        cpu = self._run(translate=True)
+        cpu.load(bytearray([0x00]))
+
+        self.assertEqual(len(cpu._blocks), 0)
+
+class MemoryWatchTestCase(TestCase):
+    def setUp(self):
+        self.memory = Memory()
+        self.writes = []
+        self.memory.subscribe(lambda start, end: self.writes.append(
+            (start, end)))
+
+    def test_unwatched_pages_do_not_notify(self):
+        self.memory.write_byte(0x1234, 0xff)
+        self.memory.write_bytes(0x2000, bytes(0x300))
+
+        self.assertEqual(self.writes, [])
+        self.assertEqual(self.memory.generation(0x12), 0)
+
+    def test_watched_page_writes(self):
+        self.memory.watch(0x12)
+        self.memory.write_byte(0x1234, 0xff)
+        self.memory.write_bytes(0x11f0, bytes(0x20))
+        self.memory.write_byte(0x1334, 0xff)
+
+        self.assertEqual(self.writes, [(0x1234, 0x1235), (0x11f0, 0x1210)])
+        self.assertEqual(self.memory.generation(0x11), 1)
+        self.assertEqual(self.memory.generation(0x12), 2)
+
+        self.memory.unwatch(0x12)
+        self.memory.write_byte(0x1234, 0x00)
+        self.assertEqual(len(self.writes), 2)
+
+class TraceTestCase(TestCase):
+    # MVI A, 0x01; INR A
+    ROM = bytearray([0x3e, 0x01, 0x3c])
+
+    def test_untraced_run_does_not_log(self):
+        for kwargs in ({}, {'translate': True}):
+            cpu = CPU(**kwargs)
+            cpu.load(self.ROM)
+
+            with self.assertNoLogs(level='INFO'):
+                cpu.run()
+            self.assertEqual(cpu.registers.a, 0x02)
+
+    def test_traced_run_logs_every_instruction(self):
+        cpu = CPU(trace=True)
+        cpu.load(self.ROM)
+
+        with self.assertLogs(level='INFO') as logs:
+            cpu.run()
+
+        self.assertEqual(len(logs.records), 4)
+        self.assertEqual(logs.records[2].getMessage(), 'INR')
+        self.assertIn('a=2,', logs.records[3].getMessage())
+
+class CyclesTestCase(TestCase):
+    # $0000: INR A; CZ $0008; JMP $0000
+    # $0008: INR B; RET
+    ROM = bytearray([0x3c, 0xcc, 0x08, 0x00, 0xc3, 0x00, 0x00, 0x00, 0x04,
+        0xc9])
+
+    def test_table(self):
+        self.assertEqual(CYCLES[0x7e], 7)
+        self.assertEqual(CYCLES[0x36], 10)
+        self.assertEqual(CYCLES[0xcc], 11)
+        self.assertEqual(CYCLES[0xc8], 5)
+        self.assertEqual(CYCLES[0xcd], 17)
+
+    def test_step_counts_taken_branches(self):
+        cpu = CPU()
+        cpu.load(self.ROM)
+
+        self.assertEqual(cpu.step(2), 16)
+        cpu.registers.a = 0xff
+        self.assertEqual(cpu.step(5), 10 + 5 + 17 + 5 + 10)
+        self.assertEqual(cpu.registers.b, 0x01)
+        self.assertEqual(cpu.cycles, 63)
+
+    def test_step_stops_at_end_of_code(self):
+        cpu = CPU()
+        # MVI A, 0x01; INR A
+        cpu.load(bytearray([0x3e, 0x01, 0x3c]))
+
+        self.assertEqual(cpu.step(10), 12)
+
+    def test_run_for(self):
+        interpreted = CPU()
+        translated = CPU(translate=True)
+
+        for cpu in (interpreted, translated):
+            cpu.load(self.ROM)
+            cycles = cpu.run_for(100000)
+            self.assertGreaterEqual(cycles, 100000)
+            self.assertLess(cycles, 100000 + 17)
+
+        self.assertEqual(translated.cycles, interpreted.cycles)
+        for name in ('a', 'b', 'sp', 'pc'):
+            self.assertEqual(getattr(translated.registers, name),
+                getattr(interpreted.registers, name))
+
+class RomMappingTestCase(TestCase):
+    # MVI A, 0x2a; STA $0000; LDA $0000; INR A, padded past one page
+    ROM = bytes([0x3e, 0x2a, 0x32, 0x00, 0x00, 0x3a, 0x00, 0x00, 0x3c]
+        + [0x00] * 0x100)
+
+    def setUp(self):
+        with NamedTemporaryFile('wb', suffix='.rom', delete=False) as f:
+            f.write(self.ROM)
+        self.filename = f.name
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_image_is_shared(self):
+        image = open_rom(self.filename)
+
+        self.assertIs(open_rom(self.filename), image)
+        self.assertEqual(len(image.pages), 2)
+        self.assertEqual(bytes(image.pages[1][:9]), bytes(9))
+
+    def test_run_from_mapped_rom(self):
+        image = RomImage(self.filename)
+        cpus = [CPU(), CPU(translate=True)]
+
+        for cpu in cpus:
+            cpu.map_rom(image, 0x0000)
+            cpu.run_for(50)
+            self.assertEqual(cpu.registers.a, 0x3f)
+
+        # Writes to ROM are dropped, and nothing was copied per CPU
+        self.assertEqual(cpus[0].ram.read_byte(0x0000), 0x3e)
+        self.assertEqual(cpus[0].ram._buffer[0x0000], 0x00)
+        self.assertEqual(cpus[0].end, len(self.ROM))
+
+    def test_shared_image(self):
+        image = SharedRomImage.load(self.filename)
+        attached = SharedRomImage(image.name, image.size)
+        cpu = CPU()
+        cpu.map_rom(attached)
+        cpu.run_for(50)
+
+        self.assertEqual(cpu.registers.a, 0x3f)
+        self.assertEqual(len(attached.pages), 2)
+        self.assertEqual(bytes(attached.pages[1][:9]), bytes(9))
+
+        cpu = None
+        attached.close()
+        image.close()
+
+    def test_load_address(self):
+        cpu = CPU()
+        cpu.map_rom(RomImage(self.filename), 0x1000)
+
+        self.assertEqual(cpu.ram.read_bytes(0x1000, 3), self.ROM[:3])
+        self.assertEqual(cpu.ram.read_byte(0x0000), 0x00)
+        with self.assertRaises(ValueError):
+            cpu.map_rom(RomImage(self.filename), 0x1001)
+
+    def test_mapping_notifies_watchers(self):
+        memory = Memory()
+        writes = []
+        memory.subscribe(lambda start, end: writes.append((start, end)))
+        memory.watch(0x01)
+        memory.map_rom(RomImage(self.filename), 0x0000)
+        memory.unmap(0x0000, 0x200)
+
+        self.assertEqual(writes, [(0x0000, 0x0200), (0x0000, 0x0200)])
+        self.assertEqual(memory.read_byte(0x0000), 0x00)
+
+class PageTableTestCase(TestCase):
+    def setUp(self):
+        self.memory = Memory()
+
+    def test_protect(self):
+        self.memory.write_byte(0x0010, 0x12)
+        self.memory.protect(0x0000, 0x100)
+        self.memory.write_byte(0x0010, 0x34)
+        self.memory.write_bytes(0x00ff, bytes([0x56, 0x78]))
+
+        self.assertEqual(self.memory.read_byte(0x0010), 0x12)
+        self.assertEqual(self.memory.read_bytes(0x00ff, 2), bytes([0, 0x78]))
+        self.assertEqual(self.memory.kind(0x00), PageKind.ROM)
+        self.assertEqual(self.memory.kind(0x01), PageKind.RAM)
+
+    def test_mirror(self):
+        self.memory.mirror(0x4000, 0x200, 0x2000)
+        self.memory.write_byte(0x4001, 0xaa)
+        self.memory.write_byte(0x2102, 0xbb)
+
+        self.assertEqual(self.memory.read_byte(0x2001), 0xaa)
+        self.assertEqual(self.memory.read_byte(0x4102), 0xbb)
+        self.assertEqual(self.memory.kind(0x40), PageKind.MIRROR)
+
+        # Mirrors follow their source when it is remapped
+        self.memory.protect(0x2000, 0x100)
+        self.memory.write_byte(0x4001, 0xcc)
+        self.assertEqual(self.memory.read_byte(0x2001), 0xaa)
+
+        self.memory.unmap(0x4000, 0x200)
+        self.memory.write_byte(0x4102, 0xdd)
+        self.assertEqual(self.memory.read_byte(0x2102), 0xbb)
+
+    def test_mirror_of_itself(self):
+        with self.assertRaises(ValueError):
+            self.memory.mirror(0x2000, 0x100, 0x2000)
+
+    def test_mmio(self):
+        reads = []
+        writes = []
+
+        def read(address):
+            reads.append(address)
+            return address & 0xff
+
+        self.memory.map_io(0x6000, 0x100, read,
+            lambda address, value: writes.append((address, value)))
+        self.memory.write_byte(0x6003, 0x42)
+        self.memory.write_bytes(0x5fff, bytes([0x01, 0x02]))
+
+        self.assertEqual(self.memory.read_byte(0x6005), 0x05)
+        self.assertEqual(self.memory.read_bytes(0x6010, 2), bytes([0x10,
+            0x11]))
+        self.assertEqual(reads, [0x6005, 0x6010, 0x6011])
+        self.assertEqual(writes, [(0x6003, 0x42), (0x6000, 0x02)])
+        self.assertEqual(self.memory.read_byte(0x5fff), 0x01)
+
+    def test_mmio_fetch(self):
+        cpu = CPU()
+        # MVI A, 0x2a, served by a device
+        cpu.ram.map_io(0x0000, 0x100, lambda address: (0x3e, 0x2a)[address])
+        cpu.end = 2
+        cpu.run_for(7)
+
+        self.assertEqual(cpu.registers.a, 0x2a)
+
+    def test_write_through_mirror_evicts_translated_code(self):
+        cpu = CPU(translate=True)
+        # $1000: MVI A, 0x01; $1002: JMP $2000
+        # $2000: MVI A, 0x05; STA $3001; JMP $1000, with $3000 mirroring $1000
+        cpu.ram.write_bytes(0x1000, bytes([0x3e, 0x01, 0xc3, 0x00, 0x20]))
+        cpu.ram.write_bytes(0x2000, bytes([0x3e, 0x05, 0x32, 0x01, 0x30, 0xc3,
+            0x00, 0x10]))
+        cpu.ram.mirror(0x3000, 0x100, 0x1000)
+        cpu.end = 0x3000
+        cpu.set_program_counter(0x1000)
+
+        cpu._blocks.execute()
+        self.assertEqual(cpu.registers.a, 0x01)
+        cpu._blocks.execute()
+        cpu._blocks.execute()
+        self.assertEqual(cpu.registers.a, 0x05)
+
+class BankTestCase(TestCase):
+    def setUp(self):
+        self.memory = Memory()
+        self.first = self.memory.add_bank('first', 0x4000)
+        self.second = self.memory.add_bank('second', 0x4000)
+        self.first[0x0010] = 0x11
+        self.second[0x0010] = 0x22
+
+    def test_switch_without_copying(self):
+        self.memory.map_bank('first', 0x8000)
+        self.assertEqual(self.memory.read_byte(0x8010), 0x11)
+        self.memory.write_byte(0x8011, 0x33)
+
+        self.memory.map_bank('second', 0x8000)
+        self.assertEqual(self.memory.read_byte(0x8010), 0x22)
+        self.assertEqual(self.first[0x0011], 0x33)
+        self.assertEqual(self.memory._buffer[0x8011], 0x00)
+        self.assertEqual(self.memory.bank_page(0x80), ('second', 0))
+
+        self.memory.unmap(0x8000, 0x4000)
+        self.assertEqual(self.memory.read_byte(0x8010), 0x00)
+        self.assertIsNone(self.memory.bank_page(0x80))
+
+    def test_partial_and_mirrored(self):
+        self.memory.mirror(0xc000, 0x100, 0x8000)
+        self.memory.map_bank('second', 0x8000, 0x100, offset=0x0000)
+
+        self.assertEqual(self.memory.read_byte(0xc010), 0x22)
+        self.assertEqual(self.memory.kind(0x81), PageKind.RAM)
+        with self.assertRaises(ValueError):
+            self.memory.map_bank('first', 0x0000, 0x200, offset=0x3f00)
+
+    def test_mmio_switch_evicts_translated_code(self):
+        cpu = CPU(translate=True)
+        memory = cpu.ram
+        # Bank 'a' holds MVI A, 0x01 and bank 'b' MVI A, 0x02 at $4000.
+        # $0000: CALL $4000; MVI A, 0x01; STA $6000; CALL $4000
+        memory.add_bank('a', 0x100)[0:3] = bytes([0x3e, 0x01, 0xc9])
+        memory.add_bank('b', 0x100)[0:3] = bytes([0x3e, 0x02, 0xc9])
+        memory.map_bank('a', 0x4000)
+        memory.map_io(0x6000, 0x100, lambda address: 0xff,
+            BankSwitch(memory, 0x4000, ['a', 'b']))
+        cpu.load(bytes([0xcd, 0x00, 0x40, 0x3e, 0x01, 0x32, 0x00, 0x60,
+            0xcd, 0x00, 0x40]))
+        cpu.set_stack_pointer(0xf000)
+        cpu.end = 0x8000
+
+        cpu._blocks.execute()
+        cpu._blocks.execute()
+        self.assertEqual(cpu.registers.a, 0x01)
+        cpu._blocks.execute()
+        cpu._blocks.execute()
+        self.assertEqual(cpu.registers.a, 0x02)
+        self.assertEqual(memory.bank_page(0x40), ('b', 0))
+
+    def test_dirty_storage(self):
+        self.memory.write_byte(0x1234, 0x01)
+        self.assertEqual(self.memory.dirty_storage(), [])
+
+        self.memory.track_writes()
+        self.memory.mirror(0xc000, 0x100, 0x8000)
+        self.memory.map_bank('first', 0x8000, 0x100, offset=0x0100)
+        self.memory.write_byte(0x1234, 0x01)
+        self.memory.write_byte(0xc000, 0x02)
+        self.memory.write_double_byte(0x2001, 0x0303)
+        self.memory.write_bytes(0x30ff, bytes(2))
+
+        self.assertEqual(self.memory.dirty_storage(), [(None, 0x12),
+            (None, 0x1f), (None, 0x20), (None, 0x30), (None, 0x31),
+            ('first', 1)])
+        self.assertEqual(self.memory.dirty_storage(), [])
+
+class IOBusTestCase(TestCase):
+    # IN 0x10; OUT 0x20; INR A; OUT 0x21
+    ROM = bytearray([0xdb, 0x10, 0xd3, 0x20, 0x3c, 0xd3, 0x21])
+
+    def test_defaults(self):
+        bus = IOBus()
+
+        self.assertEqual(len(bus.inputs), 256)
+        self.assertEqual(bus.inputs[0x42](0x42), 0xff)
+        self.assertIsNone(bus.outputs[0x42](0x42, 0x00))
+
+    def test_in_out(self):
+        for kwargs in ({}, {'lazy_flags': True}, {'translate': True}):
+            cpu = CPU(**kwargs)
+            writes = []
+            cpu.io.attach(0x10, read=lambda port: port + 1)
+            cpu.io.attach(0x20, write=lambda port, value: writes.append(
+                (port, value)))
+            latch = cpu.io.latch(0x21)
+            cpu.load(self.ROM)
+            cpu.run_for(100)
+
+            self.assertEqual(writes, [(0x20, 0x11)])
+            self.assertEqual(latch.value, 0x12)
+            self.assertEqual(cpu.io.inputs[0x21](0x21), 0x12)
+            self.assertEqual(cpu.cycles, 10 + 10 + 5 + 10)
+
+            cpu.io.detach(0x21)
+            self.assertEqual(cpu.io.inputs[0x21](0x21), 0xff)
+
+    def test_out_switches_bank(self):
+        cpu = CPU()
+        cpu.ram.add_bank('a', 0x100)[0] = 0x0a
+        cpu.ram.add_bank('b', 0x100)[0] = 0x0b
+        cpu.io.attach(0x20, write=BankSwitch(cpu.ram, 0x8000, ['a', 'b']))
+        # MVI A, 0x01; OUT 0x20; LDA $8000
+        cpu.load(bytearray([0x3e, 0x01, 0xd3, 0x20, 0x3a, 0x00, 0x80]))
+        cpu.run_for(100)
+
+        self.assertEqual(cpu.registers.a, 0x0b)
+
+class InterruptTestCase(TestCase):
+    def _cpu(self, code):
+        cpu = CPU()
+        cpu.load(code)
+        cpu.set_stack_pointer(0xf000)
+
+        return cpu
+
+    def test_held_off_while_disabled(self):
+        # DI; NOP; EI; NOP
+        cpu = self._cpu(bytearray([0xf3, 0x00, 0xfb, 0x00]))
+        cpu.interrupts.rst(2)
+        cpu.step(2)
+
+        self.assertTrue(cpu.interrupts.pending)
+        self.assertFalse(cpu.interrupts.service())
+
+        # The NOP after EI is stepped before the interrupt is taken
+        cpu.step()
+        self.assertTrue(cpu.interrupts.service())
+        self.assertFalse(cpu.interrupts.pending)
+        self.assertEqual(cpu.get_program_counter(), 0x10)
+        self.assertEqual(cpu.ram.read_double_byte(0xeffe), 0x04)
+        self.assertEqual(cpu.registers.inte, 0)
+        self.assertEqual(cpu.cycles, 4 + 4 + 4 + 4 + 11)
+        self.assertEqual(cpu.interrupts.latency().taken, 1)
+
+    def test_enabled_after_next_instruction(self):
+        # $0008: INR B; EI; RET, returning to $0005
+        cpu = self._cpu(bytearray(8) + bytearray([0x04, 0xfb, 0xc9]))
+        cpu.ram.write_double_byte(0xf000, 0x0005)
+        cpu.set_stack_pointer(0xeffe)
+        cpu.set_program_counter(0x08)
+
+        cpu.step()
+        cpu.interrupts.rst(1)
+        self.assertEqual(cpu.step(), 4)
+        self.assertEqual(cpu.registers.inte, 2)
+
+        # RET runs first, so it is taken back in the main program rather
+        # than on top of the handler
+        self.assertTrue(cpu.interrupts.service())
+        self.assertEqual(cpu.ram.read_double_byte(0xeffe), 0x05)
+        self.assertEqual(cpu.cycles, 5 + 4 + 10 + 11)
+
+    def test_enabled_after_halt(self):
+        # EI; HLT
+        cpu = self._cpu(bytearray([0xfb, 0x76]))
+        cpu.step(2)
+        cpu.interrupts.rst(1)
+
+        self.assertTrue(cpu.interrupts.service())
+        self.assertEqual(cpu.ram.read_double_byte(0xeffe), 0x02)
+
+    def test_halt_waits_for_interrupt(self):
+        # EI; HLT; MVI A, 0x01
+        cpu = self._cpu(bytearray([0xfb, 0x76, 0x3e, 0x01]))
+
+        self.assertEqual(cpu.run_for(1000), 1000)
+        self.assertEqual(cpu.get_program_counter(), 0x01)
+        self.assertEqual(cpu.registers.halted, 1)
+
+        cpu.interrupts.post(0x00)
+        cpu.interrupts.service()
+        self.assertEqual(cpu.registers.halted, 0)
+        self.assertEqual(cpu.get_program_counter(), 0x02)
+        cpu.step()
+        self.assertEqual(cpu.registers.a, 0x01)
+
+    def test_step_does_not_idle_on_halt(self):
+        # NOP; HLT
+        cpu = self._cpu(bytearray([0x00, 0x76]))
+        # A run_for slice ending early at the end of the code, before HLT
+        cpu.end = 1
+        self.assertEqual(cpu.run_for(1000), 4)
+        cpu.end = 2
+
+        self.assertEqual(cpu.step(), 7)
+        self.assertEqual(cpu.cycles, 4 + 7)
+        self.assertEqual(cpu.registers.halted, 1)
+
+    def test_single_byte_opcodes_only(self):
+        cpu = CPU()
+
+        with self.assertRaises(ValueError):
+            cpu.interrupts.post(0xcd)
+        with self.assertRaises(ValueError):
+            cpu.interrupts.rst(8)
+
+class SharedMemoryTestCase(TestCase):
+    def test_observer_sees_writes(self):
+        cpu = CPU(shared_ram=True)
+        observer = MemoryObserver(cpu.ram.name)
+
+        try:
+            # MVI A, 0x5a; STA $2400
+            cpu.load(bytearray([0x3e, 0x5a, 0x32, 0x00, 0x24]))
+            cpu.run_for(20)
+            view = observer.view(0x2400, 2)
+
+            self.assertEqual(observer.read_byte(0x2400), 0x5a)
+            self.assertEqual(observer.read_bytes(0x0000, 2), bytes([0x3e,
+                0x5a]))
+            cpu.ram.write_byte(0x2401, 0x77)
+            self.assertEqual(view[1], 0x77)
+            view.release()
+        finally:
+            observer.close()
+            cpu.ram.close()
+
+        self.assertIsNone(cpu.ram.name)
+
+    def test_private_by_default(self):
+        memory = Memory()
+
+        self.assertIsNone(memory.name)
+        memory.close()
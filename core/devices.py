@@ -0,0 +1,145 @@
+# Python
+import sys
+
+# Devices for the CPU's IOBus. Each exposes read(port) and/or
+# write(port, value) handlers and an attach method wiring them to ports.
+# Devices with state also have state() returning it as bytes and
+# restore(data) for save states.
+
+class ShiftRegister(object):
+    # The external 16-bit shift register of Midway 8080 boards such as
+    # Space Invaders. Writes to the data port shift a byte in from the top,
+    # the result port reads 8 bits starting offset bits below the top.
+    def __init__(self):
+        self.value = 0x0000
+        self.offset = 0
+
+    def write_offset(self, port, value):
+        self.offset = value & 0x07
+
+    def write_data(self, port, value):
+        self.value = (value << 8) | (self.value >> 8)
+
+    def read(self, port):
+        return (self.value >> (8 - self.offset)) & 0xff
+
+    def state(self):
+        return bytes([self.value & 0xff, self.value >> 8, self.offset])
+
+    def restore(self, data):
+        self.value = data[0] | data[1] << 8
+        self.offset = data[2]
+
+    def attach(self, bus, offset_port=2, data_port=4, result_port=3):
+        bus.attach(offset_port, write=self.write_offset)
+        bus.attach(data_port, write=self.write_data)
+        bus.attach(result_port, read=self.read)
+
+class InputLatch(object):
+    # Button and switch bits set by the host and read by IN. bits holds the
+    # value with nothing pressed.
+    def __init__(self, bits=0x00):
+        self.value = bits
+
+    def press(self, mask):
+        self.value |= mask
+
+    def release(self, mask):
+        self.value &= ~mask & 0xff
+
+    def read(self, port):
+        return self.value
+
+    def state(self):
+        return bytes([self.value])
+
+    def restore(self, data):
+        self.value = data[0]
+
+    def attach(self, bus, port):
+        bus.attach(port, read=self.read)
+
+class Timer(object):
+    # Free-running counter read off the CPU's T-state count, advancing once
+    # every divisor T-states. Writing sets the count from then on.
+    def __init__(self, cpu, divisor=256):
+        self._cpu = cpu
+        self.divisor = divisor
+        self._base = 0
+
+    def read(self, port):
+        return (self._cpu.cycles // self.divisor - self._base) & 0xff
+
+    def write(self, port, value):
+        self._base = (self._cpu.cycles // self.divisor - value) & 0xff
+
+    def state(self):
+        return bytes([self._base])
+
+    def restore(self, data):
+        self._base = data[0]
+
+    def attach(self, bus, port):
+        bus.attach(port, self.read, self.write)
+
+class Console(object):
+    # Character output on the data port and a status port that always
+    # reports ready. Input, when given, is a file read a character at a time.
+    def __init__(self, output=None, input=None):
+        self.output = output or sys.stdout
+        self.input = input
+
+    def write(self, port, value):
+        self.output.write(chr(value))
+
+    def read(self, port):
+        if self.input is None:
+            return 0x00
+
+        data = self.input.read(1)
+        return ord(data) & 0xff if data else 0x00
+
+    def status(self, port):
+        return 0xff
+
+    def attach(self, bus, data_port=1, status_port=0):
+        bus.attach(data_port, self.read, self.write)
+        bus.attach(status_port, read=self.status)
+
+class QueueInput(object):
+    # Input port fed by a coroutine: run() awaits values from an
+    # asyncio.Queue and latches each one for IN to read. Run it as a task on
+    # the loop running Intel8080System.run_async.
+    def __init__(self, queue, value=0x00):
+        self.queue = queue
+        self.value = value
+
+    def read(self, port):
+        return self.value
+
+    def state(self):
+        return bytes([self.value])
+
+    def restore(self, data):
+        self.value = data[0]
+
+    async def run(self):
+        while True:
+            self.value = await self.queue.get() & 0xff
+            self.queue.task_done()
+
+    def attach(self, bus, port):
+        bus.attach(port, read=self.read)
+
+class QueueOutput(object):
+    # Output port handing every value written to an asyncio.Queue, for a
+    # coroutine to consume. Writing never blocks the CPU, so the queue
+    # should be unbounded.
+    def __init__(self, queue):
+        self.queue = queue
+
+    def write(self, port, value):
+        self.queue.put_nowait(value)
+
+    def attach(self, bus, port):
+        bus.attach(port, write=self.write)
@@ -0,0 +1,112 @@
+# Python
+from collections import namedtuple
+import logging
+import math
+import time
+
+PacingStats = namedtuple('PacingStats',
+    ('slices', 'mean_jitter', 'max_jitter', 'stdev_jitter', 'resyncs'))
+
+class Pacer(object):
+    logger = logging.getLogger('Pacer')
+
+    # Runs the emulated clock against wall-clock time in slices of
+    # clock_hz / frame_rate T-states. Every slice has an absolute deadline,
+    # origin + cycles / clock_hz, so oversleeping one slice shortens the next
+    # sleep instead of accumulating drift. Falling more than max_lag seconds
+    # behind moves the origin up rather than running a burst of catch-up
+    # slices. Waiting is done with sleep, never by spinning. A sleep that
+    # returns early, e.g. one cut short by an interrupt, counts as negative
+    # jitter and the next slice's deadline makes up for it.
+    #
+    # Without a clock_hz the pacer is in turbo mode: it counts cycles but
+    # never sleeps.
+    def __init__(self, clock_hz=None, frame_rate=60, max_lag=0.25,
+            clock=time.perf_counter, sleep=time.sleep):
+        if clock_hz is not None and clock_hz <= 0:
+            raise ValueError('Must be a positive value')
+        if frame_rate <= 0:
+            raise ValueError('Must be a positive value')
+
+        self.clock_hz = clock_hz
+        self.frame_rate = frame_rate
+        self.max_lag = max_lag
+        self._clock = clock
+        self._sleep = sleep
+
+        # Turbo slices are sized as if running at 2 MHz, the 8080's own clock
+        self.slice_cycles = max(1, (clock_hz or 2000000) // frame_rate)
+
+        self.reset()
+
+    @property
+    def turbo(self):
+        return self.clock_hz is None
+
+    def reset(self):
+        self.cycles = 0
+        self._origin = self._clock()
+        self._deadline = self._origin
+        self._slices = 0
+        self._jitter_sum = 0.0
+        self._jitter_squares = 0.0
+        self._max_jitter = 0.0
+        self._resyncs = 0
+
+    # Called after each slice with the T-states it actually ran. Sleeps until
+    # the wall-clock time they are due at and records how late it woke.
+    def pace(self, cycles):
+        delay = self.advance(cycles)
+
+        if delay > 0:
+            self._sleep(delay)
+
+        self.woke()
+
+    # The two halves of pace, for callers that wait some other way: advance
+    # returns the seconds until the slice is due, woke records the lateness
+    # once waited
+    def advance(self, cycles):
+        self.cycles += cycles
+
+        if self.clock_hz is None:
+            return 0.0
+
+        self._deadline = self._origin + self.cycles / self.clock_hz
+        return self._deadline - self._clock()
+
+    def woke(self):
+        if self.clock_hz is None:
+            return
+
+        jitter = self._clock() - self._deadline
+
+        if jitter > self.max_lag:
+            Pacer.logger.debug('Resynced %.3fs behind', jitter)
+            self._origin += jitter
+            self._resyncs += 1
+
+        self._slices += 1
+        self._jitter_sum += jitter
+        self._jitter_squares += jitter * jitter
+        self._max_jitter = max(self._max_jitter, jitter)
+
+    # Carries on from now after time spent waiting outside the pacer, e.g.
+    # halted until an interrupt, rather than counting it as lag
+    def resume(self):
+        if self.clock_hz is None:
+            return
+
+        self._origin = self._clock() - self.cycles / self.clock_hz
+        self._deadline = self._clock()
+
+    # Seconds between the deadlines and the wake-ups, over all paced slices
+    def stats(self):
+        if not self._slices:
+            return PacingStats(0, 0.0, 0.0, 0.0, self._resyncs)
+
+        mean = self._jitter_sum / self._slices
+        variance = max(0.0, self._jitter_squares / self._slices - mean * mean)
+
+        return PacingStats(self._slices, mean, self._max_jitter,
+            math.sqrt(variance), self._resyncs)
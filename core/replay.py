@@ -0,0 +1,214 @@
+# Python
+from collections import deque
+import logging
+import struct
+
+# Local
+from .snapshot import digest
+
+# Input logs: a header with the cycle and state digest recording started
+# from, then records appended as the system runs. A record is a kind byte
+# and the T-states since the previous record, then the kind's payload:
+#   INPUT      port, value         an IN and the byte it read
+#   INTERRUPT  opcode              an interrupt accepted
+#   HASH       8-byte digest       the state digest, periodically
+#   END        8-byte digest       the state digest when recording stopped
+#   CLOCK      64-bit cycle        the absolute cycle, when the gap since
+#                                  the previous record overflows 32 bits
+# Records are in the order things happened, so a reader can stream them.
+# Interrupts and hashes are at instruction boundaries, IN timestamps are
+# the CPU's cycle count as IN ran.
+
+MAGIC = b'I80R'
+VERSION = 1
+
+INPUT = 0
+INTERRUPT = 1
+HASH = 2
+END = 3
+CLOCK = 4
+
+_HEADER = struct.Struct('<4sHQ8s')
+_RECORD = struct.Struct('<BI')
+_INPUT = struct.Struct('<BIBB')
+_INTERRUPT = struct.Struct('<BIB')
+_DIGEST = struct.Struct('<BI8s')
+_CLOCK = struct.Struct('<BQ')
+
+_PAYLOAD_SIZES = {INPUT: 2, INTERRUPT: 1, HASH: 8, END: 8}
+
+class ReplayError(Exception):
+    pass
+
+class Recorder(object):
+    logger = logging.getLogger('Recorder')
+
+    # Appends every IN value and accepted interrupt of system to the log at
+    # path, and a state digest every hash_interval T-states, until close.
+    # Start recording before running the system, from the state a replaying
+    # system starts in. Uses the IOBus tap and the interrupt listener, so it
+    # cannot run alongside a Rewind.
+    def __init__(self, system, path, hash_interval=2000000):
+        self._system = system
+        self._cpu = system._CPU
+        self._file = open(path, 'wb')
+        self._last = self._cpu.cycles
+        self.records = 0
+
+        self._file.write(_HEADER.pack(MAGIC, VERSION, self._last,
+            digest(system)))
+
+        system.io.tap(self._input)
+        system.interrupts.listener = self._interrupt
+        self._event = system.scheduler.every(hash_interval, self._hash)
+
+    # The T-states since the last record, writing a CLOCK record first if
+    # that does not fit the record
+    def _delta(self, cycle):
+        delta = cycle - self._last
+        self._last = cycle
+        self.records += 1
+
+        if delta > 0xffffffff:
+            self._file.write(_CLOCK.pack(CLOCK, cycle))
+            return 0
+
+        return delta
+
+    def _input(self, read, port):
+        value = read(port)
+        self._file.write(_INPUT.pack(INPUT, self._delta(self._cpu.cycles),
+            port, value))
+
+        return value
+
+    def _interrupt(self, cycle, opcode):
+        self._file.write(_INTERRUPT.pack(INTERRUPT, self._delta(cycle),
+            opcode))
+
+    # Flushed with every hash, so a crashed run leaves a log up to its last
+    # hash
+    def _hash(self, cycle):
+        self._file.write(_DIGEST.pack(HASH, self._delta(self._cpu.cycles),
+            digest(self._system)))
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+
+        system = self._system
+        system.scheduler.cancel(self._event)
+        system.io.tap(None)
+        system.interrupts.listener = None
+
+        self._file.write(_DIGEST.pack(END, self._delta(self._cpu.cycles),
+            digest(system)))
+        self._file.close()
+
+        Recorder.logger.info('Recorded %d events up to cycle %d',
+            self.records, self._last)
+
+# (kind, cycle, payload) for every record of the log at path
+def read_log(path):
+    with open(path, 'rb') as log:
+        header = log.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ReplayError('Truncated log')
+
+        magic, version, cycle, start = _HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ReplayError('Not an input log')
+        if version != VERSION:
+            raise ReplayError('Unsupported log version {0}'.format(version))
+
+        yield None, cycle, start
+
+        while True:
+            record = log.read(_RECORD.size)
+            if not record:
+                return
+            if len(record) < _RECORD.size:
+                raise ReplayError('Truncated log')
+
+            kind = record[0]
+            if kind == CLOCK:
+                rest = log.read(_CLOCK.size - _RECORD.size)
+                if len(rest) < _CLOCK.size - _RECORD.size:
+                    raise ReplayError('Truncated log')
+
+                _, cycle = _CLOCK.unpack(record + rest)
+                continue
+
+            if kind not in _PAYLOAD_SIZES:
+                raise ReplayError('Unknown record kind {0}'.format(kind))
+
+            payload = log.read(_PAYLOAD_SIZES[kind])
+            if len(payload) < _PAYLOAD_SIZES[kind]:
+                raise ReplayError('Truncated log')
+
+            _, delta = _RECORD.unpack(record)
+            cycle += delta
+            yield kind, cycle, payload
+
+# Feeds the log at path back into system, a freshly built one running the
+# same ROM, with no devices needed. Runs unthrottled, checking every hash
+# in the log, and returns the number checked. Raises ReplayError where the
+# replay diverges from the recording.
+def replay(system, path):
+    cpu = system._CPU
+    interrupts = system.interrupts
+    inputs = deque()
+    checked = 0
+
+    records = read_log(path)
+    _, start, state = next(records)
+
+    if cpu.cycles != start or digest(system) != state:
+        raise ReplayError('The log starts from another state')
+
+    def replay_input(read, port):
+        if not inputs:
+            raise ReplayError('IN {0:02x} at cycle {1} after the logged '
+                'input ran out'.format(port, cpu.cycles))
+
+        logged, cycle, value = inputs.popleft()
+        if logged != port:
+            raise ReplayError('IN {0:02x} at cycle {1}, logged IN {2:02x} '
+                'at cycle {3}'.format(port, cpu.cycles, logged, cycle))
+
+        return value
+
+    def run_to(cycle):
+        if cycle > cpu.cycles:
+            system.run_for(cycle - cpu.cycles)
+
+        if cpu.cycles != cycle:
+            raise ReplayError('Reached cycle {0} instead of {1}'.format(
+                cpu.cycles, cycle))
+
+    system.io.tap(replay_input)
+    interrupts.muted = True
+
+    try:
+        for kind, cycle, payload in records:
+            if kind == INPUT:
+                inputs.append((payload[0], cycle, payload[1]))
+            elif kind == INTERRUPT:
+                run_to(cycle)
+                interrupts.accept(payload[0])
+            else:
+                run_to(cycle)
+
+                if digest(system) != payload:
+                    raise ReplayError('State differs at cycle {0}'.format(
+                        cycle))
+                checked += 1
+
+                if kind == END:
+                    break
+    finally:
+        system.io.tap(None)
+        interrupts.muted = False
+
+    return checked
@@ -0,0 +1,163 @@
+# Python
+from bisect import bisect_right
+import logging
+
+# Local
+from .snapshot import Checkpoints
+
+class Rewind(object):
+    logger = logging.getLogger('Rewind')
+
+    # Lets a system seek back to any cycle it has run since, within budget
+    # bytes of checkpoints. A checkpoint is taken every interval T-states,
+    # by default every paced slice, and every IN value and accepted
+    # interrupt is logged. Seeking restores the checkpoint before the target
+    # and runs up to it again, feeding IN the logged values and taking the
+    # logged interrupts at the cycles they were taken, so the run repeats
+    # exactly. Past the budget the oldest keyframe and its deltas go.
+    #
+    # Seek only while the system is not running. OUT still reaches devices
+    # while running up to the target, and interrupts pending at the target
+    # are dropped.
+    def __init__(self, system, interval=None, budget=8 << 20,
+            keyframe_interval=60):
+        self._system = system
+        self._cpu = system._CPU
+        self.budget = budget
+        self._checkpoints = Checkpoints(system, keyframe_interval)
+        # Per checkpoint, the absolute positions in the logs it was taken at
+        self._marks = []
+        # (port, value) and (cycle, opcode) entries, the first of each being
+        # entry number _input_base and _interrupt_base
+        self._inputs = []
+        self._interrupts = []
+        self._input_base = 0
+        self._interrupt_base = 0
+        self._replaying = False
+
+        system.io.tap(self._record_input)
+        system.interrupts.listener = self._record_interrupt
+        # Scheduled first so that every checkpoint includes the event
+        self._event = system.scheduler.every(
+            interval or system.pacer.slice_cycles, self._checkpoint)
+        self._checkpoint(self._cpu.cycles)
+
+    # Bytes held by checkpoints
+    @property
+    def size(self):
+        return self._checkpoints.size
+
+    # The earliest cycle that can be sought to
+    @property
+    def start(self):
+        return self._checkpoints.cycles(0)
+
+    def close(self):
+        self._system.scheduler.cancel(self._event)
+        self._system.io.tap(None)
+        self._system.interrupts.listener = None
+
+    def _record_input(self, read, port):
+        value = read(port)
+        self._inputs.append((port, value))
+
+        return value
+
+    def _record_interrupt(self, cycle, opcode):
+        if not self._replaying:
+            self._interrupts.append((cycle, opcode))
+
+    def _checkpoint(self, cycle):
+        if self._replaying:
+            return
+
+        checkpoints = self._checkpoints
+        checkpoints.take()
+        self._marks.append((self._input_base + len(self._inputs),
+            self._interrupt_base + len(self._interrupts)))
+
+        while checkpoints.size > self.budget:
+            dropped = checkpoints.drop_oldest()
+            if not dropped:
+                break
+
+            del self._marks[:dropped]
+            self._trim()
+
+    # Forgets log entries from before the first checkpoint
+    def _trim(self):
+        inputs, interrupts = self._marks[0]
+        del self._inputs[:inputs - self._input_base]
+        del self._interrupts[:interrupts - self._interrupt_base]
+        self._input_base = inputs
+        self._interrupt_base = interrupts
+
+    # Puts the system back to the first instruction boundary at or after
+    # cycle and returns the cycle it got to. Everything recorded after it is
+    # forgotten and recording carries on from there.
+    def seek(self, cycle):
+        cpu = self._cpu
+        system = self._system
+        checkpoints = self._checkpoints
+
+        if cycle > cpu.cycles:
+            raise ValueError('Cannot seek ahead to {0}, at {1}'.format(cycle,
+                cpu.cycles))
+        if cycle < self.start:
+            raise ValueError('Cycle {0} is before the earliest checkpoint at '
+                '{1}'.format(cycle, self.start))
+
+        index = bisect_right([checkpoints.cycles(i)
+            for i in range(len(checkpoints))], cycle) - 1
+        checkpoints.restore(index)
+        del self._marks[index + 1:]
+
+        inputs, interrupts = self._marks[index]
+        replayed = iter(self._inputs[inputs - self._input_base:])
+        taken = self._interrupts[interrupts - self._interrupt_base:]
+
+        def replay_input(read, port):
+            for logged, value in replayed:
+                if logged == port:
+                    return value
+
+                Rewind.logger.warning('Replay read port %02x, logged %02x',
+                    port, logged)
+                break
+
+            return read(port)
+
+        self._replaying = True
+        system.io.tap(replay_input)
+        system.interrupts.muted = True
+        system.interrupts.restore(b'')
+        accepted = 0
+
+        try:
+            # Events due with the checkpoint's own, which fired after it
+            system.scheduler.fire(cpu.cycles)
+
+            for at, opcode in taken:
+                if at >= cycle:
+                    break
+
+                if at > cpu.cycles:
+                    system.run_for(at - cpu.cycles)
+                system.interrupts.accept(opcode)
+                accepted += 1
+
+            if cycle > cpu.cycles:
+                system.run_for(cycle - cpu.cycles)
+        finally:
+            self._replaying = False
+            system.interrupts.muted = False
+            system.io.tap(self._record_input)
+
+        consumed = len(self._inputs) - (inputs - self._input_base) - sum(
+            1 for _ in replayed)
+        del self._inputs[inputs - self._input_base + consumed:]
+        del self._interrupts[interrupts - self._interrupt_base + accepted:]
+
+        Rewind.logger.debug('Sought to %d from the checkpoint at %d',
+            cpu.cycles, checkpoints.cycles(index))
+        return cpu.cycles
@@ -0,0 +1,101 @@
+# Python
+import heapq
+import itertools
+import logging
+
+class Event(object):
+    __slots__ = ('cycle', 'callback', 'period', 'cancelled')
+
+    def __init__(self, cycle, callback, period):
+        self.cycle = cycle
+        self.callback = callback
+        self.period = period
+        self.cancelled = False
+
+class Scheduler(object):
+    logger = logging.getLogger('Scheduler')
+
+    # Device callbacks keyed by the CPU T-state count they are due at, kept
+    # on a heap. The system runs the CPU up to deadline, calls fire, and
+    # carries on, so the CPU itself never checks for events. A callback is
+    # called with the cycle it was due at, at the first instruction boundary
+    # at or after it.
+    def __init__(self, cpu):
+        self._cpu = cpu
+        self._heap = []
+        self._order = itertools.count()
+        self._periodic = []
+
+    def __len__(self):
+        return sum(1 for _, _, event in self._heap if not event.cancelled)
+
+    def at(self, cycle, callback):
+        return self._push(Event(cycle, callback, None))
+
+    def after(self, cycles, callback):
+        return self.at(self._cpu.cycles + cycles, callback)
+
+    # Calls callback every period T-states, the first time period from now.
+    # Later calls are due at exact multiples, however late one fired.
+    def every(self, period, callback):
+        if period <= 0:
+            raise ValueError('Must be a positive value')
+
+        event = Event(self._cpu.cycles + period, callback, period)
+        self._periodic.append(event)
+
+        return self._push(event)
+
+    def cancel(self, event):
+        event.cancelled = True
+
+        if event in self._periodic:
+            self._periodic.remove(event)
+
+    # The next cycle of every periodic event, in the order they were added.
+    # One-shot events belong to whoever scheduled them and are not included.
+    def state(self):
+        return [event.cycle for event in self._periodic]
+
+    # Moves the periodic events back to the cycles of a state(). One-shot
+    # events stay as they are.
+    def restore(self, cycles):
+        if len(cycles) != len(self._periodic):
+            raise ValueError('Saved {0} periodic events, have {1}'.format(
+                len(cycles), len(self._periodic)))
+
+        for event, cycle in zip(self._periodic, cycles):
+            event.cycle = cycle
+
+        self._heap = [(event.cycle, next(self._order), event)
+            for _, _, event in self._heap if not event.cancelled]
+        heapq.heapify(self._heap)
+
+    def _push(self, event):
+        heapq.heappush(self._heap, (event.cycle, next(self._order), event))
+        return event
+
+    # The cycle the next event is due at, None when there is none
+    @property
+    def deadline(self):
+        heap = self._heap
+
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+
+        return heap[0][0] if heap else None
+
+    # Calls every event due at or before now, in order
+    def fire(self, now):
+        heap = self._heap
+
+        while heap and heap[0][0] <= now:
+            cycle, _, event = heapq.heappop(heap)
+            if event.cancelled:
+                continue
+
+            if event.period is not None:
+                event.cycle = cycle + event.period
+                self._push(event)
+
+            event.callback(cycle)
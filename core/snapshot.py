@@ -0,0 +1,337 @@
+# Python
+import hashlib
+import struct
+
+# Save states: a header followed by tagged sections, each a 4-byte tag, a
+# 32-bit length and that many bytes. Readers skip sections they do not know,
+# so later versions can add sections without breaking older states. All
+# integers are little-endian.
+#
+# The sections are
+#   'CPU '  a b c d e h l f, sp pc, cycles, inte halted
+#   'INT '  pending interrupt opcodes, oldest first
+#   'RAM '  the 64K of RAM behind the address space
+#   'MAP '  the bank names, then which bank page every page shows
+#   'BANK'  one per RAM bank: its name and contents
+#   'SCHD'  the next cycle of every periodic scheduler event
+#   'DEV '  one per device: its name and state()
+#
+# Deltas have a 'DLTA' section instead of 'RAM ' and 'BANK', and a 'PAGE'
+# section for every RAM page written since the snapshot before them: the
+# bank name, empty for RAM, the page's index and its 256 bytes. A delta is
+# only restored correctly over the state it was taken after.
+#
+# Only state is saved, not configuration. ROM, MMIO, mirrors, banks,
+# devices and periodic events are set up by whoever built the system, and
+# restoring needs a system set up the same way.
+
+MAGIC = b'I80S'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sH')
+_SECTION = struct.Struct('<4sI')
+_CPU = struct.Struct('<8BHHQBB')
+_NAME = struct.Struct('<B')
+_INDEX = struct.Struct('<B')
+_UNMAPPED = 0xffff
+
+class SnapshotError(Exception):
+    pass
+
+def _section(tag, payload):
+    return _SECTION.pack(tag, len(payload)) + payload
+
+def _name(name):
+    encoded = name.encode()
+    return _NAME.pack(len(encoded)) + encoded
+
+def _split_name(payload):
+    size = payload[0]
+    return bytes(payload[1:1 + size]).decode(), payload[1 + size:]
+
+# The system's state as bytes, see above. Given the storage pages written
+# since the last snapshot, from Memory.dirty_storage, saves a delta.
+def save(system, dirty=None):
+    cpu = system._CPU
+    r = cpu.registers
+    memory = cpu.ram
+    r.materialize_flags()
+
+    parts = [
+        _HEADER.pack(MAGIC, VERSION),
+        _section(b'CPU ', _CPU.pack(r.a, r.b, r.c, r.d, r.e, r.h, r.l, r.f,
+            r.sp, r.pc, cpu.cycles, r.inte, r.halted)),
+        _section(b'INT ', cpu.interrupts.state()),
+    ]
+
+    if dirty is None:
+        parts.append(_SECTION.pack(b'RAM ', 0x10000))
+        parts.append(memory.ram)
+    else:
+        parts.append(_section(b'DLTA', b''))
+
+        for name, index in dirty:
+            prefix = _name(name or '') + _INDEX.pack(index)
+            parts.append(_SECTION.pack(b'PAGE', len(prefix) + 0x100))
+            parts.append(prefix)
+            parts.append(memory.storage_page(name, index))
+
+    banks = memory.banks()
+    numbers = {bank.name: number for number, bank in enumerate(banks)}
+    mapping = [_UNMAPPED if bank_page is None
+        else numbers[bank_page[0]] << 8 | bank_page[1]
+        for bank_page in memory.bank_mapping()]
+    parts.append(_section(b'MAP ', _NAME.pack(len(banks))
+        + b''.join(_name(bank.name) for bank in banks)
+        + struct.pack('<256H', *mapping)))
+
+    for bank in banks if dirty is None else ():
+        if bank.buffer is not None:
+            name = _name(bank.name)
+            parts.append(_SECTION.pack(b'BANK', len(name) + len(bank.buffer)))
+            parts.append(name)
+            parts.append(bank.buffer)
+
+    cycles = system.scheduler.state()
+    parts.append(_section(b'SCHD', struct.pack('<{0}Q'.format(len(cycles)),
+        *cycles)))
+
+    for name, device in system.devices.items():
+        parts.append(_section(b'DEV ', _name(name) + device.state()))
+
+    return b''.join(parts)
+
+# An 8-byte hash of the machine's state: registers, cycles, RAM, RAM banks
+# and what is mapped where. Devices and the scheduler are left out, so a
+# system replaying a log without its devices hashes the same.
+def digest(system):
+    cpu = system._CPU
+    r = cpu.registers
+    memory = cpu.ram
+    r.materialize_flags()
+
+    state = hashlib.blake2b(_CPU.pack(r.a, r.b, r.c, r.d, r.e, r.h, r.l,
+        r.f, r.sp, r.pc, cpu.cycles, r.inte, r.halted), digest_size=8)
+    state.update(memory.ram)
+
+    for bank in memory.banks():
+        if bank.buffer is not None:
+            state.update(bank.buffer)
+
+    state.update(repr(memory.bank_mapping()).encode())
+    return state.digest()
+
+def _sections(data):
+    data = memoryview(data)
+
+    if len(data) < _HEADER.size:
+        raise SnapshotError('Truncated snapshot')
+
+    magic, version = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotError('Not a snapshot')
+    if version != VERSION:
+        raise SnapshotError('Unsupported snapshot version {0}'.format(
+            version))
+
+    offset = _HEADER.size
+    while offset < len(data):
+        if offset + _SECTION.size > len(data):
+            raise SnapshotError('Truncated snapshot')
+
+        tag, size = _SECTION.unpack_from(data, offset)
+        offset += _SECTION.size
+
+        if offset + size > len(data):
+            raise SnapshotError('Truncated {0!r} section'.format(tag))
+
+        yield tag, data[offset:offset + size]
+        offset += size
+
+# Puts a save() back into a system set up like the one saved. Translated
+# code is invalidated. Raises SnapshotError, before changing anything, if
+# data is not a snapshot this version can read or does not fit the system.
+def restore(system, data):
+    cpu = system._CPU
+    memory = cpu.ram
+    sections = {}
+    banks = {}
+    pages = []
+    devices = {}
+
+    for tag, payload in _sections(data):
+        if tag == b'BANK':
+            name, contents = _split_name(payload)
+            banks[name] = contents
+        elif tag == b'PAGE':
+            name, payload = _split_name(payload)
+            pages.append((name or None, payload[0], payload[1:]))
+        elif tag == b'DEV ':
+            name, state = _split_name(payload)
+            devices[name] = state
+        else:
+            sections[tag] = payload
+
+    delta = b'DLTA' in sections
+    required = (b'CPU ', b'INT ', b'MAP ', b'SCHD') + (() if delta
+        else (b'RAM ', ))
+
+    for tag in required:
+        if tag not in sections:
+            raise SnapshotError('Missing {0!r} section'.format(tag))
+
+    if len(sections[b'CPU ']) != _CPU.size:
+        raise SnapshotError('Bad CPU section')
+    if not delta and len(sections[b'RAM ']) != 0x10000:
+        raise SnapshotError('Bad RAM section')
+
+    for name, index, contents in pages:
+        try:
+            memory.storage_page(name, index)
+        except (KeyError, IndexError):
+            raise SnapshotError('No page {0} of {1!r}'.format(index, name))
+
+        if len(contents) != 0x100 or (name is not None
+                and memory.bank(name).buffer is None):
+            raise SnapshotError('Bad page {0} of {1!r}'.format(index, name))
+
+    payload = sections[b'MAP ']
+    count, payload = payload[0], payload[1:]
+    names = []
+    for _ in range(count):
+        name, payload = _split_name(payload)
+        names.append(name)
+
+    if len(payload) != 512:
+        raise SnapshotError('Bad MAP section')
+
+    mapping = []
+    for entry in struct.unpack('<256H', payload):
+        if entry == _UNMAPPED:
+            mapping.append(None)
+        elif entry >> 8 >= len(names):
+            raise SnapshotError('Bad MAP section')
+        else:
+            mapping.append((names[entry >> 8], entry & 0xff))
+
+    for name in names:
+        try:
+            memory.bank(name)
+        except KeyError:
+            raise SnapshotError('No bank {0!r}'.format(name))
+
+    for name, contents in banks.items():
+        try:
+            buffer = memory.bank(name).buffer
+        except KeyError:
+            raise SnapshotError('No bank {0!r}'.format(name))
+
+        if buffer is None or len(buffer) != len(contents):
+            raise SnapshotError('Bank {0!r} does not match'.format(name))
+
+    cycles = struct.unpack('<{0}Q'.format(len(sections[b'SCHD']) // 8),
+        sections[b'SCHD'])
+    if len(cycles) != len(system.scheduler.state()):
+        raise SnapshotError('Saved {0} periodic events, have {1}'.format(
+            len(cycles), len(system.scheduler.state())))
+
+    for name in devices:
+        if name not in system.devices:
+            raise SnapshotError('No device {0!r}'.format(name))
+
+    # Everything checks out
+    r = cpu.registers
+    (r.a, r.b, r.c, r.d, r.e, r.h, r.l, r.f, r.sp, r.pc, cpu.cycles, r.inte,
+        r.halted) = _CPU.unpack(sections[b'CPU '])
+    r.lazy_aux = None
+
+    cpu.interrupts.restore(bytes(sections[b'INT ']))
+    system.scheduler.restore(cycles)
+
+    for name, contents in banks.items():
+        memory.bank(name).buffer[:] = contents
+
+    memory.restore_bank_mapping(mapping)
+
+    for name, index, contents in pages:
+        memory.restore_storage_page(name, index, contents)
+
+    # Last, as it invalidates everything derived from memory, banks included
+    if not delta:
+        memory.restore_ram(sections[b'RAM '])
+
+    for name, state in devices.items():
+        system.devices[name].restore(state)
+
+class Checkpoints(object):
+    # Snapshots of a system taken as it runs: a full keyframe every
+    # keyframe_interval checkpoints and deltas of the pages written in
+    # between, so checkpointing every frame costs a few hundred bytes a
+    # frame rather than 64K. Memory starts tracking writes from here on.
+    def __init__(self, system, keyframe_interval=60):
+        if keyframe_interval <= 0:
+            raise ValueError('Must be a positive value')
+
+        self._system = system
+        self._memory = system._CPU.ram
+        self.keyframe_interval = keyframe_interval
+        # (cycles, keyframe, data), oldest first
+        self._checkpoints = []
+        self._since_keyframe = 0
+        self._size = 0
+
+        self._memory.track_writes()
+
+    def __len__(self):
+        return len(self._checkpoints)
+
+    # Bytes held by all checkpoints
+    @property
+    def size(self):
+        return self._size
+
+    def cycles(self, index):
+        return self._checkpoints[index][0]
+
+    def take(self):
+        dirty = self._memory.dirty_storage()
+        keyframe = (not self._checkpoints
+            or self._since_keyframe >= self.keyframe_interval)
+
+        data = save(self._system, None if keyframe else dirty)
+        self._checkpoints.append((self._system._CPU.cycles, keyframe, data))
+        self._since_keyframe = 1 if keyframe else self._since_keyframe + 1
+        self._size += len(data)
+
+    # Forgets the oldest keyframe and the deltas after it, unless it is the
+    # only one, returning how many checkpoints went
+    def drop_oldest(self):
+        checkpoints = self._checkpoints
+        count = 1
+        while count < len(checkpoints) and not checkpoints[count][1]:
+            count += 1
+
+        if count == len(checkpoints):
+            return 0
+
+        self._size -= sum(len(data) for _, _, data in checkpoints[:count])
+        del checkpoints[:count]
+
+        return count
+
+    # Puts the system back to checkpoint index, from the keyframe before it
+    # and the deltas since, and forgets the checkpoints after it
+    def restore(self, index):
+        index %= len(self._checkpoints)
+        first = index
+        while not self._checkpoints[first][1]:
+            first -= 1
+
+        for _, _, data in self._checkpoints[first:index + 1]:
+            restore(self._system, data)
+
+        self._memory.dirty_storage()
+        self._size -= sum(len(data)
+            for _, _, data in self._checkpoints[index + 1:])
+        del self._checkpoints[index + 1:]
+        self._since_keyframe = index + 1 - first
@@ -1,36 +1,231 @@
 # Python
+import asyncio
 import logging
+from threading import Thread
 
 # Local
 from .cpu.cpus import CPU
+from .cpu.roms import open_rom
+from .pacing import Pacer
+from .replay import Recorder, replay
+from .scheduler import Scheduler
+from .snapshot import restore as restore_state, save as save_state
 
 class Intel8080System(object):
     logger = logging.getLogger('Intel8080System')
 
-    def __init__(self, filename):
-        self._CPU = CPU()
+    # The ROM is mapped read-only at load_address, shared with every other
+    # system in the process running it, and runs from there. clock_hz paces
+    # the CPU to that many T-states per second, in slices of clock_hz /
+    # frame_rate. Without it the CPU runs unthrottled. With shared_ram RAM
+    # lives in shared memory that other processes can observe, see
+    # core.cpu.memory.MemoryObserver.
+    def __init__(self, filename, translate=False, trace=False, clock_hz=None,
+            frame_rate=60, load_address=0, shared_ram=False):
+        self._CPU = CPU(translate=translate, trace=trace,
+            shared_ram=shared_ram)
+        self._trace = trace
+        self.scheduler = Scheduler(self._CPU)
+        # Devices with state, by name, saved with the rest of the system
+        self.devices = {}
+        self.pacer = Pacer(clock_hz, frame_rate,
+            sleep=self._CPU.interrupts.wait)
+        self._thread = None
+
+        if shared_ram:
+            Intel8080System.logger.info('RAM shared as %s',
+                self._CPU.ram.name)
 
         if not filename:
             return
 
         try:
-            with open(filename, 'rb') as f:
-                self._CPU.load(f.read())
+            self._CPU.map_rom(open_rom(filename), load_address)
+            self._CPU.set_program_counter(load_address)
         except FileNotFoundError as e:
             Intel8080System.logger.error(e)
             exit()
 
+    # Waits for a booted system to stop, then releases its shared RAM. Views
+    # of it, e.g. a framebuffer's, must have been released first.
+    def close(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        elif self._CPU.is_alive():
+            self._CPU.join()
+
+        self._CPU.ram.close()
+
+    # The CPU's port I/O bus, for attaching devices
+    @property
+    def io(self):
+        return self._CPU.io
+
+    @property
+    def interrupts(self):
+        return self._CPU.interrupts
+
+    # A Framebuffer over video RAM, see core.video. Needs NumPy.
+    def framebuffer(self, **kwargs):
+        from .video import Framebuffer
+
+        return Framebuffer(self._CPU.ram, **kwargs)
+
+    # The system's state as bytes, see core.snapshot. Only call these while
+    # the system is not running.
+    def snapshot(self):
+        return save_state(self)
+
+    def restore(self, data):
+        restore_state(self, data)
+
+    # Starts logging input and interrupts to path, see core.replay. Close
+    # the returned Recorder when done.
+    def record(self, path, hash_interval=2000000):
+        return Recorder(self, path, hash_interval)
+
+    # Replays a log recorded from a system running the same ROM, as fast as
+    # the CPU goes, and returns the number of state hashes it matched
+    def replay(self, path):
+        checked = replay(self, path)
+        Intel8080System.logger.info('Replayed %s to cycle %d, %d hashes '
+            'matched', path, self._CPU.cycles, checked)
+
+        return checked
+
+    # Tracing runs the CPU's own thread, which steps every instruction and
+    # takes no interrupts
     def boot(self):
-        self._CPU.start()
+        if self._trace:
+            self._CPU.start()
+        else:
+            self._thread = Thread(target=self.run, name='Intel8080System')
+            self._thread.start()
+
         Intel8080System.logger.info('Booted system')
 
+    # Runs at least cycles T-states, stopping the CPU at every scheduled
+    # event's deadline to fire it and taking pending interrupts at each of
+    # those stops. Returns the T-states run, fewer only when the PC left the
+    # loaded code.
+    def run_for(self, cycles):
+        cpu = self._CPU
+        interrupts = cpu.interrupts
+        scheduler = self.scheduler
+        start = cpu.cycles
+        target = start + cycles
+
+        while True:
+            scheduler.fire(cpu.cycles)
+
+            if interrupts.pending:
+                interrupts.service()
+
+            remaining = target - cpu.cycles
+            if remaining <= 0:
+                break
+
+            deadline = scheduler.deadline
+            if deadline is not None and deadline < target:
+                remaining = deadline - cpu.cycles
+
+            if cpu.run_for(remaining) < remaining:
+                break
+
+        return cpu.cycles - start
+
+    # Whether a halted CPU can only be woken by a post from outside: INTE is
+    # on, nothing is pending and no scheduled event could post one
+    def _idle(self):
+        interrupts = self._CPU.interrupts
+
+        return (self._CPU.registers.inte and not interrupts.pending
+            and self.scheduler.deadline is None)
+
+    # Runs the CPU slice by slice through the pacer until the PC leaves the
+    # loaded code or halts with interrupts disabled. The pacer sleeps in
+    # InterruptController.wait, so posting an interrupt cuts the sleep short.
+    # Halted with nothing to wake it but a post, it waits for one instead of
+    # idling through slices.
+    def run(self):
+        registers = self._CPU.registers
+        pacer = self.pacer
+        budget = pacer.slice_cycles
+        pacer.reset()
+
+        while True:
+            cycles = self.run_for(budget)
+            pacer.pace(cycles)
+
+            if cycles < budget:
+                break
+
+            if registers.halted:
+                if not registers.inte:
+                    break
+
+                if self._idle():
+                    self.interrupts.wait(None)
+                    pacer.resume()
+
+        self._log_pacing()
+
+    # Like run, but awaits between slices instead of blocking, so one event
+    # loop can host many systems alongside its other tasks. Device
+    # coroutines run as tasks on the same loop in those gaps. slice_cycles
+    # trades latency for throughput and defaults to the pacer's slices.
+    # Unthrottled it still yields to the loop after every slice. Halted, the
+    # wait for a post is done in the loop's executor, a slice's time at once.
+    async def run_async(self, slice_cycles=None):
+        registers = self._CPU.registers
+        pacer = self.pacer
+        budget = slice_cycles or pacer.slice_cycles
+        timeout = budget / (pacer.clock_hz or 2000000)
+        loop = asyncio.get_running_loop()
+        pacer.reset()
+
+        while True:
+            cycles = self.run_for(budget)
+            await asyncio.sleep(max(0.0, pacer.advance(cycles)))
+            pacer.woke()
+
+            if cycles < budget:
+                break
+
+            if registers.halted:
+                if not registers.inte:
+                    break
+
+                if self._idle():
+                    while not await loop.run_in_executor(None,
+                            self.interrupts.wait, timeout):
+                        pass
+                    pacer.resume()
+
+        self._log_pacing()
+
+    def _log_pacing(self):
+        pacer = self.pacer
+        stats = pacer.stats()
+        Intel8080System.logger.info('Ran %d cycles in %d paced slices, '
+            'jitter mean %.6fs max %.6fs stdev %.6fs, %d resyncs',
+            pacer.cycles, stats.slices, stats.mean_jitter, stats.max_jitter,
+            stats.stdev_jitter, stats.resyncs)
+
+        latency = self._CPU.interrupts.latency()
+        if latency.taken:
+            Intel8080System.logger.info('Took %d interrupts, latency mean '
+                '%.6fs max %.6fs', latency.taken, latency.mean, latency.max)
+
     def _get_test_suite(self):
         from unittest import TestSuite, defaultTestLoader
         import core.cpu.tests as tests1
+        import core.tests as tests2
 
         suite = TestSuite()
 
-        for t in (tests1, ):
+        for t in (tests1, tests2):
             suite.addTests(defaultTestLoader.loadTestsFromModule(t))
 
         return suite
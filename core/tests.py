@@ -0,0 +1,868 @@
+# Python
+import asyncio
+from io import StringIO
+from multiprocessing.shared_memory import SharedMemory
+import json
+import os
+from threading import Thread
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+import time
+from unittest import TestCase
+
+# External
+
+# Local
+from . import batch
+from .bench import runner
+from .bench.workloads import WORKLOADS, call_recursion, memcpy_loop
+from .cpu.cpus import CPU
+from .devices import (Console, InputLatch, QueueInput, QueueOutput,
+    ShiftRegister, Timer)
+from .pacing import Pacer
+from .replay import ReplayError, read_log
+from .rewind import Rewind
+from .scheduler import Scheduler
+from .snapshot import Checkpoints, SnapshotError, digest
+from .video import (FrameHandoff, Framebuffer, SharedFrameHandoff,
+    SharedFrameReader)
+from .systems import Intel8080System
+
+class FakeClock(object):
+    # Wall clock whose sleeps overshoot by oversleep seconds
+    def __init__(self, oversleep=0.0):
+        self.now = 100.0
+        self.oversleep = oversleep
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds + self.oversleep
+
+class PacerTestCase(TestCase):
+    def test_slices(self):
+        self.assertEqual(Pacer(2000000, 60).slice_cycles, 33333)
+        self.assertEqual(Pacer(None, 50).slice_cycles, 40000)
+
+    def test_turbo_never_sleeps(self):
+        fake = FakeClock()
+        pacer = Pacer(None, clock=fake.clock, sleep=fake.sleep)
+
+        for _ in range(10):
+            pacer.pace(pacer.slice_cycles)
+
+        self.assertTrue(pacer.turbo)
+        self.assertEqual(fake.sleeps, [])
+        self.assertEqual(pacer.stats().slices, 0)
+
+    def test_oversleep_does_not_drift(self):
+        fake = FakeClock(oversleep=0.002)
+        pacer = Pacer(1000000, 100, clock=fake.clock, sleep=fake.sleep)
+
+        for _ in range(100):
+            pacer.pace(10000)
+
+        # Each sleep is shortened by the previous overshoot, so the end is
+        # one overshoot past one second, not a hundred
+        self.assertAlmostEqual(fake.now, 101.002)
+        self.assertAlmostEqual(fake.sleeps[1], 0.008)
+
+        stats = pacer.stats()
+        self.assertEqual(stats.slices, 100)
+        self.assertAlmostEqual(stats.mean_jitter, 0.002)
+        self.assertAlmostEqual(stats.max_jitter, 0.002)
+        self.assertAlmostEqual(stats.stdev_jitter, 0.0, places=6)
+
+    def test_resync_when_far_behind(self):
+        fake = FakeClock()
+        pacer = Pacer(1000000, 100, clock=fake.clock, sleep=fake.sleep)
+
+        pacer.pace(10000)
+        fake.now += 1.0
+        pacer.pace(10000)
+        pacer.pace(10000)
+
+        self.assertEqual(pacer.stats().resyncs, 1)
+        self.assertAlmostEqual(fake.sleeps[-1], 0.01)
+
+class SystemPacingTestCase(TestCase):
+    # $0000: INR A; JNZ $0000; INR B; JNZ $0000
+    ROM = bytearray([0x3c, 0xc2, 0x00, 0x00, 0x04, 0xc2, 0x00, 0x00])
+
+    def test_run_paced_to_end(self):
+        fake = FakeClock()
+        system = Intel8080System(None)
+        system.pacer = Pacer(2000000, 60, clock=fake.clock, sleep=fake.sleep)
+        system._CPU.load(self.ROM)
+        system.run()
+
+        cycles = system._CPU.cycles
+        self.assertEqual(system._CPU.registers.b, 0x00)
+        self.assertEqual(system.pacer.cycles, cycles)
+        self.assertEqual(system.pacer.stats().slices,
+            cycles // system.pacer.slice_cycles + 1)
+        self.assertAlmostEqual(fake.now, 100.0 + cycles / 2000000)
+
+class WorkloadTestCase(TestCase):
+    def test_workloads_finish_on_every_engine(self):
+        for name, workload in WORKLOADS.items():
+            code = workload()
+            reference = None
+
+            for kwargs in runner.MODES.values():
+                cpu = CPU(**kwargs)
+                cpu.load(code)
+                cpu.run_for(1 << 62)
+
+                self.assertEqual(cpu.get_program_counter(), len(code), name)
+                state = (cpu.cycles, cpu.registers.a, cpu.registers.b,
+                    cpu.registers.c, cpu.registers.sp)
+                if reference is None:
+                    reference = state
+                self.assertEqual(state, reference, name)
+
+    def test_memcpy_copies(self):
+        cpu = CPU()
+        cpu.ram.write_bytes(0x4000, bytes(range(256)))
+        cpu.load(memcpy_loop(2))
+        cpu.run_for(1 << 62)
+
+        self.assertEqual(cpu.ram._buffer[0x8000:0x8100], bytes(range(256)))
+
+    def test_recursion_returns(self):
+        cpu = CPU()
+        cpu.load(call_recursion(3, 4))
+        cpu.run_for(1 << 62)
+
+        self.assertEqual(cpu.registers.sp, 0xf000)
+
+class BenchmarkCompareTestCase(TestCase):
+    def _run(self, rates):
+        return {'results': {'alu/interpreted': {
+            'seconds': [1.0] * len(rates),
+            'ips': sum(rates) / len(rates),
+            'ips_stdev': runner._mean_stdev(rates)[1]
+        }}}
+
+    def test_regression(self):
+        baseline = self._run([100.0, 101.0, 99.0, 100.0])
+        current = self._run([90.0, 91.0, 89.0, 90.0])
+        (name, change, t, regressed), = runner.compare(baseline, current)
+
+        self.assertAlmostEqual(change, -0.1)
+        self.assertLess(t, -runner.T_CRITICAL)
+        self.assertTrue(regressed)
+
+    def test_noise_is_not_a_regression(self):
+        baseline = self._run([100.0, 120.0, 80.0, 100.0])
+        current = self._run([95.0, 115.0, 75.0, 95.0])
+
+        self.assertFalse(runner.compare(baseline, current)[0][3])
+
+class DeviceTestCase(TestCase):
+    def test_shift_register(self):
+        cpu = CPU()
+        ShiftRegister().attach(cpu.io)
+        # MVI A, 0xab; OUT 4; MVI A, 0xcd; OUT 4; MVI A, 3; OUT 2; IN 3
+        cpu.load(bytearray([0x3e, 0xab, 0xd3, 0x04, 0x3e, 0xcd, 0xd3, 0x04,
+            0x3e, 0x03, 0xd3, 0x02, 0xdb, 0x03]))
+        cpu.run_for(1000)
+
+        self.assertEqual(cpu.registers.a, (0xcdab >> 5) & 0xff)
+
+    def test_input_latch(self):
+        latch = InputLatch(0x08)
+        latch.press(0x01)
+        latch.press(0x20)
+        latch.release(0x01)
+
+        self.assertEqual(latch.read(1), 0x28)
+
+    def test_timer(self):
+        cpu = CPU()
+        timer = Timer(cpu, divisor=4)
+        cpu.cycles = 400
+
+        self.assertEqual(timer.read(0), 100)
+        timer.write(0, 0x10)
+        cpu.cycles += 8
+        self.assertEqual(timer.read(0), 0x12)
+
+    def test_console(self):
+        cpu = CPU()
+        output = StringIO()
+        Console(output, StringIO('x')).attach(cpu.io)
+        # IN 1; OUT 1; MVI A, 0x21; OUT 1; IN 0
+        cpu.load(bytearray([0xdb, 0x01, 0xd3, 0x01, 0x3e, 0x21, 0xd3, 0x01,
+            0xdb, 0x00]))
+        cpu.run_for(1000)
+
+        self.assertEqual(output.getvalue(), 'x!')
+        self.assertEqual(cpu.registers.a, 0xff)
+
+class AsyncRunTestCase(TestCase):
+    # $0000: IN 1; CPI 0; JZ $0000; OUT 2
+    ROM = bytearray([0xdb, 0x01, 0xfe, 0x00, 0xca, 0x00, 0x00, 0xd3, 0x02])
+
+    def _system(self, inputs, outputs):
+        system = Intel8080System(None)
+        system._CPU.load(self.ROM)
+        device = QueueInput(inputs)
+        device.attach(system.io, 1)
+        QueueOutput(outputs).attach(system.io, 2)
+
+        return system, device
+
+    def test_sessions_share_a_loop(self):
+        async def main():
+            inputs = [asyncio.Queue(), asyncio.Queue()]
+            outputs = asyncio.Queue()
+            systems = [self._system(queue, outputs) for queue in inputs]
+            devices = [asyncio.create_task(device.run())
+                for _, device in systems]
+            runs = [asyncio.create_task(system.run_async(slice_cycles=500))
+                for system, _ in systems]
+
+            # Both sessions are spinning on IN until fed
+            await asyncio.sleep(0.01)
+            self.assertFalse(any(run.done() for run in runs))
+            await inputs[1].put(0x42)
+            await asyncio.wait_for(runs[1], 1)
+            self.assertFalse(runs[0].done())
+            await inputs[0].put(0x17)
+            await asyncio.wait_for(runs[0], 1)
+
+            for task in devices:
+                task.cancel()
+
+            return [outputs.get_nowait() for _ in range(2)]
+
+        self.assertEqual(asyncio.run(main()), [0x42, 0x17])
+
+    def test_halted_waits_for_post(self):
+        system = Intel8080System(None)
+        system._CPU.load(SystemInterruptTestCase.ROM)
+
+        async def main():
+            run = asyncio.create_task(system.run_async())
+
+            for _ in range(3):
+                await asyncio.sleep(0.005)
+                system.interrupts.rst(1)
+
+            await asyncio.wait_for(run, 1)
+
+        asyncio.run(main())
+        self.assertEqual(system._CPU.registers.b, 3)
+        self.assertLess(system.pacer.cycles, 10 * system.pacer.slice_cycles)
+
+    def test_paced(self):
+        # 200 MHz in 1 ms slices, so the run takes about 10 ms
+        system = Intel8080System(None, clock_hz=200000000, frame_rate=1000)
+        system._CPU.load(SystemPacingTestCase.ROM)
+        asyncio.run(system.run_async())
+
+        cycles = system._CPU.cycles
+        self.assertEqual(system.pacer.cycles, cycles)
+        self.assertEqual(system.pacer.stats().slices, cycles // 200000 + 1)
+
+class SystemInterruptTestCase(TestCase):
+    # $0000: JMP $0040
+    # $0008: INR B; EI; RET
+    # $0040: LXI SP, $f000; EI; HLT; MOV A, B; CPI 3; JNZ $0044
+    ROM = (bytearray([0xc3, 0x40, 0x00]).ljust(0x08, b'\0')
+        + bytearray([0x04, 0xfb, 0xc9]).ljust(0x38, b'\0')
+        + bytearray([0x31, 0x00, 0xf0, 0xfb, 0x76, 0x78, 0xfe, 0x03, 0xc2,
+            0x44, 0x00]))
+
+    def test_posted_from_another_thread(self):
+        # 1 ms slices
+        system = Intel8080System(None, clock_hz=2000000, frame_rate=1000)
+        system._CPU.load(self.ROM)
+        thread = Thread(target=system.run, daemon=True)
+        thread.start()
+
+        for _ in range(3):
+            time.sleep(0.005)
+            system.interrupts.rst(1)
+
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(system._CPU.registers.b, 3)
+
+        latency = system.interrupts.latency()
+        self.assertEqual(latency.taken, 3)
+        self.assertLess(latency.max, 0.1)
+
+    def test_halted_waits_for_post(self):
+        system = Intel8080System(None)
+        system._CPU.load(self.ROM)
+        thread = Thread(target=system.run, daemon=True)
+        thread.start()
+
+        for _ in range(3):
+            time.sleep(0.005)
+            system.interrupts.rst(1)
+
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(system._CPU.registers.b, 3)
+        # A few slices idled, not the thousands spinning for 15 ms would
+        self.assertLess(system.pacer.cycles, 10 * system.pacer.slice_cycles)
+
+    def test_halted_with_interrupts_disabled_ends_run(self):
+        system = Intel8080System(None)
+        # DI; HLT
+        system._CPU.load(bytearray([0xf3, 0x76]))
+        thread = Thread(target=system.run, daemon=True)
+        thread.start()
+
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(system._CPU.registers.halted, 1)
+
+    def test_cpu_run_ends_at_halt(self):
+        cpu = CPU()
+        # MVI A, 0x01; HLT
+        cpu.load(bytearray([0x3e, 0x01, 0x76]))
+        cpu.run_to_end()
+
+        self.assertEqual(cpu.registers.a, 0x01)
+        self.assertEqual(cpu.registers.halted, 1)
+
+class SchedulerTestCase(TestCase):
+    def setUp(self):
+        self.cpu = CPU()
+        self.scheduler = Scheduler(self.cpu)
+        self.fired = []
+
+    def _callback(self, name):
+        return lambda cycle: self.fired.append((name, cycle))
+
+    def test_order_and_cancel(self):
+        self.scheduler.at(300, self._callback('c'))
+        self.scheduler.at(100, self._callback('a'))
+        cancelled = self.scheduler.at(150, self._callback('x'))
+        self.scheduler.at(100, self._callback('b'))
+        self.scheduler.cancel(cancelled)
+
+        self.assertEqual(len(self.scheduler), 3)
+        self.assertEqual(self.scheduler.deadline, 100)
+        self.scheduler.fire(200)
+        self.assertEqual(self.fired, [('a', 100), ('b', 100)])
+        self.assertEqual(self.scheduler.deadline, 300)
+
+    def test_every_keeps_to_multiples(self):
+        self.cpu.cycles = 10
+        self.scheduler.every(100, self._callback('tick'))
+        self.scheduler.fire(125)
+        self.scheduler.fire(360)
+
+        self.assertEqual([cycle for _, cycle in self.fired], [110, 210, 310])
+        self.assertEqual(self.scheduler.deadline, 410)
+
+class SystemSchedulerTestCase(TestCase):
+    # $0000: EI; HLT; JMP $0001
+    # $0010: INR B; EI; RET
+    ROM = (bytearray([0xfb, 0x76, 0xc3, 0x01, 0x00]).ljust(0x10, b'\0')
+        + bytearray([0x04, 0xfb, 0xc9]))
+
+    def test_vblank_interrupts(self):
+        system = Intel8080System(None)
+        system._CPU.load(self.ROM)
+        system._CPU.set_stack_pointer(0xf000)
+        fired = []
+
+        def vblank(cycle):
+            fired.append(system._CPU.cycles)
+            system.interrupts.rst(2)
+
+        system.scheduler.every(33333, vblank)
+
+        # The last RST is taken at 99999, overrunning by 10, and its
+        # handler runs in the next slice
+        self.assertEqual(system.run_for(100000), 100010)
+        self.assertEqual(fired, [33333, 66666, 99999])
+        self.assertEqual(system._CPU.registers.b, 2)
+        self.assertEqual(system._CPU.get_program_counter(), 0x10)
+
+    def test_stops_at_end_of_code(self):
+        system = Intel8080System(None)
+        # MVI A, 0x01; INR A
+        system._CPU.load(bytearray([0x3e, 0x01, 0x3c]))
+        system.scheduler.at(5, lambda cycle: None)
+
+        self.assertEqual(system.run_for(1000), 12)
+
+class SystemLoadAddressTestCase(TestCase):
+    def test_runs_from_load_address(self):
+        with TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'rom')
+            with open(filename, 'wb') as f:
+                # MVI A, 0x01; INR A
+                f.write(bytes([0x3e, 0x01, 0x3c]))
+
+            system = Intel8080System(filename, load_address=0x1000)
+
+        self.assertEqual(system._CPU.get_program_counter(), 0x1000)
+        self.assertEqual(system.run_for(1000), 7 + 5)
+        self.assertEqual(system._CPU.registers.a, 0x02)
+
+class SystemCloseTestCase(TestCase):
+    def test_unlinks_shared_ram(self):
+        system = Intel8080System(None, shared_ram=True)
+        # MVI A, 0x01; HLT
+        system._CPU.load(bytearray([0x3e, 0x01, 0x76]))
+        name = system._CPU.ram.name
+        system.boot()
+        system.close()
+
+        self.assertEqual(system._CPU.registers.a, 0x01)
+        with self.assertRaises(FileNotFoundError):
+            SharedMemory(name)
+
+class FramebufferTestCase(TestCase):
+    def test_pixels(self):
+        system = Intel8080System(None)
+        framebuffer = system.framebuffer()
+        ram = system._CPU.ram
+        # Line 0 is the left column, bit 0 of its first byte the bottom pixel
+        ram.write_byte(0x2400, 0x01)
+        ram.write_byte(0x2400 + 31, 0x80)
+        ram.write_byte(0x3fff, 0x80)
+        pixels = framebuffer.pixels()
+
+        self.assertEqual(pixels.shape, (256, 224))
+        self.assertEqual(pixels[255, 0], 1)
+        self.assertEqual(pixels[0, 0], 1)
+        self.assertEqual(pixels[0, 223], 1)
+        self.assertEqual(pixels.sum(), 3)
+
+    def test_view_over_bank(self):
+        cpu = CPU()
+        cpu.ram.add_bank('video', 0x2000)[0x0100] = 0xff
+        cpu.ram.map_bank('video', 0x4000)
+        framebuffer = Framebuffer(cpu.ram, 0x4000, 32, 32, rotate=0)
+
+        self.assertEqual(framebuffer.pixels()[8].sum(), 8)
+        cpu.ram.write_byte(0x4000, 0x03)
+        self.assertEqual(framebuffer.pixels()[0, :3].tolist(), [1, 1, 0])
+
+    def test_view_needs_one_buffer(self):
+        memory = CPU().ram
+        memory.add_bank('a', 0x100)
+        memory.map_bank('a', 0x2400)
+
+        with self.assertRaises(ValueError):
+            memory.view(0x2300, 0x200)
+
+class FrameHandoffTestCase(TestCase):
+    def setUp(self):
+        self.system = Intel8080System(None)
+        self.ram = self.system._CPU.ram
+        self.framebuffer = self.system.framebuffer()
+
+    def test_slow_consumer_drops_frames(self):
+        for buffers in (2, 3):
+            handoff = FrameHandoff(self.framebuffer, buffers)
+            self.assertIsNone(handoff.acquire(0))
+
+            self.ram.write_byte(0x2400, 0x01)
+            handoff.publish()
+            number, frame = handoff.acquire()
+            self.assertEqual((number, frame[0, 0]), (1, 0x01))
+
+            # The consumer holds frame 1 while three more are published
+            for value in (0x02, 0x03, 0x04):
+                self.ram.write_byte(0x2400, value)
+                handoff.publish()
+
+            self.assertEqual(frame[0, 0], 0x01)
+            number, frame = handoff.acquire()
+            self.assertEqual((number, frame[0, 0]), (4, 0x04))
+            self.assertEqual(handoff.dropped, 2)
+
+    def test_consumer_thread(self):
+        handoff = FrameHandoff(self.framebuffer)
+        frames = []
+
+        def render():
+            while True:
+                taken = handoff.acquire(1)
+                if taken is None or taken[1][0, 0] == 0xff:
+                    break
+                frames.append(taken[0])
+
+        thread = Thread(target=render)
+        thread.start()
+        self.system.scheduler.every(1000, handoff.publish)
+        self.system._CPU.load(bytearray([0x00]) * 20000)
+        self.system.run_for(80000)
+        self.ram.write_byte(0x2400, 0xff)
+        handoff.publish()
+        thread.join(5)
+
+        self.assertEqual(handoff.published, 81)
+        self.assertEqual(len(frames) + handoff.dropped, 80)
+        self.assertEqual(frames, sorted(frames))
+
+    def test_shared_memory(self):
+        handoff = SharedFrameHandoff(self.framebuffer)
+        reader = SharedFrameReader(handoff.name, handoff.shape)
+
+        try:
+            self.assertEqual(reader.read(), 0)
+
+            for value in (0x11, 0x22, 0x33, 0x44):
+                self.ram.write_byte(0x2401, value)
+                handoff.publish()
+
+            self.assertEqual(reader.read(), 4)
+            self.assertEqual(reader.frame[0, 1], 0x44)
+        finally:
+            reader.close()
+            handoff.close()
+
+    def test_shared_memory_writer_died_publishing(self):
+        handoff = SharedFrameHandoff(self.framebuffer)
+        reader = SharedFrameReader(handoff.name, handoff.shape)
+
+        try:
+            handoff.publish()
+            # The sequence word of the latest slot left odd mid-publish
+            header = reader._header
+            header[1 + int(header[0]) * 2] += 1
+
+            with self.assertRaises(TimeoutError):
+                reader.read(timeout=0.01)
+        finally:
+            reader.close()
+            handoff.close()
+
+class SnapshotTestCase(TestCase):
+    # $0000: LXI SP, $f000; MVI A, $00
+    # $0005: INR A; STA $2000; OUT 4; JMP $0005
+    ROM = bytearray([0x31, 0x00, 0xf0, 0x3e, 0x00, 0x3c, 0x32, 0x00, 0x20,
+        0xd3, 0x04, 0xc3, 0x05, 0x00])
+
+    def _system(self, translate=False):
+        system = Intel8080System(None, translate=translate)
+        system._CPU.load(self.ROM)
+        shift = ShiftRegister()
+        shift.attach(system.io)
+        system.devices['shift'] = shift
+        system.scheduler.every(700, lambda cycle: None)
+        system._CPU.ram.add_bank('bank', 0x100)[0] = 0x5a
+        system._CPU.ram.map_bank('bank', 0x8000)
+
+        return system
+
+    def _state(self, system):
+        cpu = system._CPU
+        r = cpu.registers
+        r.materialize_flags()
+
+        return ((r.a, r.b, r.c, r.d, r.e, r.h, r.l, r.f, r.sp, r.pc),
+            cpu.cycles, bytes(cpu.ram.ram), cpu.ram.read_byte(0x8000),
+            system.devices['shift'].state(), system.scheduler.state())
+
+    def test_round_trip(self):
+        for translate in (False, True):
+            system = self._system(translate)
+            system.run_for(1000)
+            data = system.snapshot()
+            system.run_for(1000)
+            expected = self._state(system)
+
+            system.run_for(5000)
+            system._CPU.ram.write_byte(0x8000, 0x00)
+            system._CPU.ram.map_bank('bank', 0x9000)
+            system.restore(data)
+            system.run_for(1000)
+
+            self.assertEqual(self._state(system), expected)
+            self.assertEqual(system._CPU.ram.bank_page(0x80), ('bank', 0))
+            self.assertIsNone(system._CPU.ram.bank_page(0x90))
+
+    def test_translated_code_invalidated(self):
+        system = self._system(translate=True)
+        system.run_for(1000)
+        data = system.snapshot()
+
+        # INR A becomes INR B
+        system._CPU.ram.write_byte(0x0005, 0x04)
+        system.run_for(1000)
+        self.assertNotEqual(system._CPU.registers.b, 0)
+
+        system.restore(data)
+        system.run_for(1000)
+        self.assertEqual(system._CPU.registers.b, 0)
+
+    def test_rejects_bad_data(self):
+        system = self._system()
+        data = system.snapshot()
+
+        for bad in (b'', b'XXXX' + data[4:], data[:4] + b'\x63\x00' + data[6:],
+                data[:-1]):
+            with self.assertRaises(SnapshotError):
+                system.restore(bad)
+
+        with self.assertRaises(SnapshotError):
+            self._system().restore(Intel8080System(None).snapshot())
+
+    def test_under_a_millisecond(self):
+        system = self._system()
+        system.run_for(1000)
+        start = time.perf_counter()
+
+        for _ in range(100):
+            system.restore(system.snapshot())
+
+        self.assertLess((time.perf_counter() - start) / 100, 0.001)
+
+    def test_checkpoints(self):
+        system = self._system(translate=True)
+        checkpoints = Checkpoints(system, keyframe_interval=4)
+        states = []
+
+        for _ in range(10):
+            system.run_for(1000)
+            checkpoints.take()
+            states.append(self._state(system))
+
+        # Keyframes hold all of RAM, deltas only the page written
+        self.assertLess(checkpoints.size, 3 * 0x10400 + 7 * 0x400)
+
+        for index in (9, 6, 4, 0):
+            system.run_for(3000)
+            checkpoints.restore(index)
+            self.assertEqual(self._state(system), states[index])
+            self.assertEqual(len(checkpoints), index + 1)
+
+        system.run_for(1000)
+        checkpoints.take()
+        checkpoints.restore(-1)
+        system.run_for(1000)
+        checkpoints.restore(0)
+        self.assertEqual(self._state(system), states[0])
+
+    def test_checkpoints_across_bank_switch(self):
+        system = Intel8080System(None)
+        memory = system._CPU.ram
+        memory.add_bank('x', 0x100)
+        memory.add_bank('y', 0x100)
+        memory.map_bank('x', 0x4000)
+        checkpoints = Checkpoints(system)
+        checkpoints.take()
+
+        # The write to x is in the delta though x is switched out by then
+        memory.write_byte(0x4000, 0xaa)
+        memory.map_bank('y', 0x4000)
+        checkpoints.take()
+        memory.map_bank('x', 0x4000)
+        memory.write_byte(0x4000, 0x00)
+        memory.map_bank('y', 0x4000)
+        checkpoints.take()
+
+        checkpoints.restore(1)
+        self.assertEqual(memory.bank('x').buffer[0], 0xaa)
+        self.assertEqual(memory.bank_page(0x40), ('y', 0))
+
+    def test_checkpoints_across_mirror(self):
+        system = Intel8080System(None)
+        memory = system._CPU.ram
+        checkpoints = Checkpoints(system)
+        checkpoints.take()
+
+        # The write to $2000 is in the delta though $2000 mirrors $3000 now
+        memory.write_byte(0x2000, 0xaa)
+        memory.mirror(0x2000, 0x100, 0x3000)
+        checkpoints.take()
+        memory.ram[0x2000] = 0x00
+
+        checkpoints.restore(1)
+        self.assertEqual(memory.ram[0x2000], 0xaa)
+        self.assertEqual(memory.read_byte(0x2000), 0x00)
+
+class RewindTestCase(TestCase):
+    # $0000: JMP $0040
+    # $0008: INR B; EI; RET
+    # $0040: LXI SP, $f000; EI
+    # $0044: IN 1; ADD E; MOV E, A; STA $2000; JMP $0044
+    ROM = (bytearray([0xc3, 0x40, 0x00]).ljust(0x08, b'\0')
+        + bytearray([0x04, 0xfb, 0xc9]).ljust(0x38, b'\0')
+        + bytearray([0x31, 0x00, 0xf0, 0xfb, 0xdb, 0x01, 0x83, 0x5f, 0x32,
+            0x00, 0x20, 0xc3, 0x44, 0x00]))
+
+    def setUp(self):
+        self.system = Intel8080System(None, translate=True)
+        self.system._CPU.load(self.ROM)
+        self.buttons = InputLatch()
+        self.buttons.attach(self.system.io, 1)
+
+    def _state(self):
+        cpu = self.system._CPU
+        r = cpu.registers
+        r.materialize_flags()
+
+        return (cpu.cycles, (r.a, r.b, r.e, r.f, r.sp, r.pc),
+            bytes(cpu.ram.ram))
+
+    # Runs with the buttons and interrupts changing between slices,
+    # returning the state after each
+    def _run(self, slices, first=0):
+        states = []
+
+        for value in range(first, first + slices):
+            self.buttons.value = value
+            if value % 3 == 0:
+                self.system.interrupts.rst(1)
+
+            self.system.run_for(1000)
+            states.append(self._state())
+
+        return states
+
+    def test_seek_replays_inputs_and_interrupts(self):
+        rewind = Rewind(self.system, interval=2500, keyframe_interval=4)
+        states = self._run(20)
+        self.assertEqual(states[-1][1][1], 7)
+
+        for index in (17, 12, 3):
+            self.assertEqual(rewind.seek(states[index][0]), states[index][0])
+            self.assertEqual(self._state(), states[index])
+
+        # Recording carries on from there with live input
+        self.buttons.value = 0
+        states[4:] = self._run(6, 100)
+        rewind.seek(states[8][0])
+        self.assertEqual(self._state(), states[8])
+
+        with self.assertRaises(ValueError):
+            rewind.seek(self.system._CPU.cycles + 1)
+
+    def test_budget(self):
+        rewind = Rewind(self.system, interval=1000, budget=0x30000,
+            keyframe_interval=4)
+        states = self._run(50)
+
+        self.assertLessEqual(rewind.size, 0x30000)
+        self.assertGreater(rewind.start, 0)
+        with self.assertRaises(ValueError):
+            rewind.seek(0)
+
+        index = next(index for index, state in enumerate(states)
+            if state[0] >= rewind.start)
+        rewind.seek(states[index][0])
+        self.assertEqual(self._state(), states[index])
+
+class ReplayTestCase(TestCase):
+    ROM = RewindTestCase.ROM
+
+    def setUp(self):
+        with NamedTemporaryFile(suffix='.log', delete=False) as f:
+            self.path = f.name
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def _system(self, translate=False, rom=ROM):
+        system = Intel8080System(None, translate=translate)
+        system._CPU.load(rom)
+
+        return system
+
+    def _record(self, translate=True):
+        system = self._system(translate)
+        buttons = InputLatch()
+        buttons.attach(system.io, 1)
+        recorder = system.record(self.path, hash_interval=1500)
+
+        for value in range(20):
+            buttons.value = value
+            if value % 3 == 0:
+                system.interrupts.rst(1)
+            system.run_for(1000)
+
+        recorder.close()
+        return system
+
+    def test_replays_without_devices(self):
+        recorded = self._record()
+        kinds = [kind for kind, _, _ in read_log(self.path)]
+
+        for translate in (False, True):
+            system = self._system(translate)
+            self.assertEqual(system.replay(self.path), 13 + 1)
+            self.assertEqual(system._CPU.cycles, recorded._CPU.cycles)
+            self.assertEqual(system._CPU.registers.b, 7)
+            self.assertEqual(bytes(system._CPU.ram.ram),
+                bytes(recorded._CPU.ram.ram))
+
+        self.assertEqual(kinds.count(1), 7)
+        self.assertGreater(kinds.count(0), 100)
+        # 7-byte inputs, 6-byte interrupts and 13-byte hashes
+        self.assertEqual(os.path.getsize(self.path), 22
+            + 7 * kinds.count(0) + 6 * kinds.count(1) + 13 * 14)
+
+    def test_detects_divergence(self):
+        self._record()
+
+        # ADD E becomes ADD D
+        rom = bytearray(self.ROM)
+        rom[0x46] = 0x82
+        with self.assertRaisesRegex(ReplayError, 'another state'):
+            self._system(rom=rom).replay(self.path)
+
+        # The first record, an IN, reads 0x55 instead
+        with open(self.path, 'r+b') as log:
+            log.seek(22 + 6)
+            log.write(bytes([0x55]))
+
+        with self.assertRaisesRegex(ReplayError, 'State differs'):
+            self._system().replay(self.path)
+
+class BatchTestCase(TestCase):
+    # MVI B, 0x03; DCR B; JNZ $0002
+    ENDS = bytes([0x06, 0x03, 0x05, 0xc2, 0x02, 0x00])
+    # DI; HLT
+    HALTS = bytes([0xf3, 0x76])
+
+    def test_manifest(self):
+        with TemporaryDirectory() as directory:
+            for name, rom in (('ends.rom', self.ENDS),
+                    ('halts.rom', self.HALTS)):
+                with open(os.path.join(directory, name), 'wb') as f:
+                    f.write(rom)
+
+            manifest = os.path.join(directory, 'manifest.json')
+            with open(manifest, 'w') as f:
+                json.dump([
+                    {'rom': 'ends.rom', 'cycles': 1000},
+                    {'rom': 'ends.rom', 'cycles': 1000, 'translate': True},
+                    {'rom': 'ends.rom', 'cycles': 20, 'name': 'short'},
+                    {'rom': 'halts.rom', 'cycles': 1000},
+                    {'rom': 'missing.rom', 'cycles': 1000},
+                    {'rom': 'ends.rom', 'cycles': 1000, 'load_address': 1},
+                ], f)
+
+            # The missing ROM fails its own job, the rest still run
+            output = StringIO()
+            self.assertEqual(batch.run(manifest, output, workers=2), 2)
+
+            system = Intel8080System(os.path.join(directory, 'ends.rom'))
+            system.run_for(1000)
+
+        results = sorted((json.loads(line)
+            for line in output.getvalue().splitlines()),
+            key=lambda result: result['job'])
+
+        self.assertEqual([result['exit'] for result in results],
+            ['ended', 'ended', 'limit', 'halted', 'error', 'error'])
+        self.assertIn('FileNotFoundError', results[4]['error'])
+        self.assertEqual(results[2]['name'], 'short')
+        self.assertEqual(results[0]['cycles'], 7 + 3 * (5 + 10))
+        self.assertEqual(results[0]['hash'], results[1]['hash'])
+        self.assertEqual(results[0]['hash'], digest(system).hex())
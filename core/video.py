@@ -0,0 +1,175 @@
+# Python
+from multiprocessing.shared_memory import SharedMemory
+from threading import Condition
+import time
+
+# External
+import numpy as np
+
+class Framebuffer(object):
+    # A 1-bpp framebuffer in emulated RAM as a zero-copy NumPy view. Video
+    # RAM is lines of line_bytes bytes, the first pixel of each byte in its
+    # lowest bit. The defaults are Space Invaders: 224 lines of 256 pixels at
+    # $2400, scanned bottom to top, so the display is the image turned a
+    # quarter counter-clockwise.
+    def __init__(self, memory, address=0x2400, lines=224, line_bytes=32,
+            rotate=1):
+        self.raw = np.frombuffer(memory.view(address, lines * line_bytes),
+            dtype=np.uint8).reshape(lines, line_bytes)
+        self.rotate = rotate
+
+    # The displayed image as a 2-D array of 0/1 pixels, rows top to bottom
+    def pixels(self, raw=None):
+        bits = np.unpackbits(self.raw if raw is None else raw, axis=1,
+            bitorder='little')
+
+        return np.rot90(bits, self.rotate)
+
+class FrameHandoff(object):
+    # Hands frames from the emulation thread to a renderer thread through a
+    # fixed set of buffers, two or more, allocated up front. publish copies
+    # video RAM into a buffer the consumer is not holding. If the consumer
+    # has not taken the previous frame by then, that frame is overwritten
+    # and counted as dropped, so emulation never waits for the renderer.
+    # publish takes the cycle argument of Scheduler callbacks, so it can be
+    # scheduled every frame directly.
+    def __init__(self, framebuffer, buffers=3):
+        if buffers < 2:
+            raise ValueError('Need at least two buffers')
+
+        self._framebuffer = framebuffer
+        self._buffers = [np.empty_like(framebuffer.raw)
+            for _ in range(buffers)]
+        self._condition = Condition()
+        self._ready = None
+        self._front = None
+        self._frame = 0
+        self.published = 0
+        self.dropped = 0
+
+    def _free(self):
+        for index in range(len(self._buffers)):
+            if index != self._front and index != self._ready:
+                return index
+
+    def publish(self, cycle=None):
+        with self._condition:
+            index = self._free()
+            if index is None:
+                index = self._ready
+                self._ready = None
+                self.dropped += 1
+
+        np.copyto(self._buffers[index], self._framebuffer.raw)
+
+        with self._condition:
+            if self._ready is not None:
+                self.dropped += 1
+            self._ready = index
+            self.published += 1
+            self._frame = self.published
+            self._condition.notify()
+
+    # Waits up to timeout seconds for a frame newer than the last one taken
+    # and returns (frame number, raw video RAM copy), or None on timeout.
+    # The array stays untouched until the next acquire.
+    def acquire(self, timeout=None):
+        with self._condition:
+            if not self._condition.wait_for(
+                    lambda: self._ready is not None, timeout):
+                return None
+
+            self._front = self._ready
+            self._ready = None
+
+            return self._frame, self._buffers[self._front]
+
+class SharedFrameHandoff(object):
+    # Frames for consumers in other processes. The buffers live in a
+    # multiprocessing.shared_memory block behind a header of 64-bit words:
+    # the latest slot and, per slot, a sequence number that is odd while
+    # the slot is being written and the frame number it holds. publish
+    # never waits. A SharedFrameReader that gets lapped mid-copy sees the
+    # sequence change and retries.
+    def __init__(self, framebuffer, buffers=3, name=None):
+        if buffers < 2:
+            raise ValueError('Need at least two buffers')
+
+        self._framebuffer = framebuffer
+        self.shape = framebuffer.raw.shape
+        self.buffers = buffers
+        self.memory = SharedMemory(name, create=True,
+            size=_shared_size(self.shape, buffers))
+        self._header, self._slots = _shared_arrays(self.memory, self.shape,
+            buffers)
+        self._header[:] = 0
+        self.published = 0
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def publish(self, cycle=None):
+        header = self._header
+        slot = (int(header[0]) + 1) % self.buffers
+        sequence = 1 + slot * 2
+
+        header[sequence] += 1
+        np.copyto(self._slots[slot], self._framebuffer.raw)
+        self.published += 1
+        header[sequence + 1] = self.published
+        header[sequence] += 1
+        header[0] = slot
+
+    def close(self):
+        del self._header, self._slots
+        self.memory.close()
+        self.memory.unlink()
+
+class SharedFrameReader(object):
+    # Reads the latest frame of a SharedFrameHandoff by its shared memory
+    # name, into a buffer of its own
+    def __init__(self, name, shape, buffers=3):
+        self.memory = SharedMemory(name)
+        self._header, self._slots = _shared_arrays(self.memory, shape,
+            buffers)
+        self.frame = np.empty(shape, dtype=np.uint8)
+
+    # Copies the latest frame into self.frame and returns its number, 0 when
+    # nothing was published yet. Raises TimeoutError when no frame could be
+    # read whole for timeout seconds, e.g. the writer died publishing one.
+    def read(self, timeout=1.0):
+        header = self._header
+        deadline = time.perf_counter() + timeout
+
+        while True:
+            if time.perf_counter() > deadline:
+                raise TimeoutError('No complete frame for {0}s'.format(
+                    timeout))
+
+            slot = int(header[0])
+            sequence = 1 + slot * 2
+            before = int(header[sequence])
+            if before & 1:
+                continue
+
+            np.copyto(self.frame, self._slots[slot])
+            number = int(header[sequence + 1])
+
+            if int(header[sequence]) == before:
+                return number
+
+    def close(self):
+        del self._header, self._slots
+        self.memory.close()
+
+def _shared_size(shape, buffers):
+    return 8 * (1 + 2 * buffers) + buffers * shape[0] * shape[1]
+
+def _shared_arrays(memory, shape, buffers):
+    words = 1 + 2 * buffers
+    header = np.ndarray((words, ), dtype=np.uint64, buffer=memory.buf)
+    slots = np.ndarray((buffers, ) + tuple(shape), dtype=np.uint8,
+        buffer=memory.buf, offset=8 * words)
+
+    return header, slots
@@ -10,6 +10,36 @@ def main():
     arg_parser.add_argument('--filename', help='ROM file')
     arg_parser.add_argument('--test', nargs='?', default=True, 
         help='Run test suite')
+    arg_parser.add_argument('--load-address', type=lambda s: int(s, 0),
+        default=0, help='Page-aligned address the ROM is mapped and run at')
+    arg_parser.add_argument('--translate', action='store_true',
+        help='Run translated basic blocks instead of single instructions')
+    arg_parser.add_argument('--trace', action='store_true',
+        help='Log every instruction and the registers after it')
+    arg_parser.add_argument('--clock', type=int,
+        help='Pace the CPU to this many T-states per second, e.g. 2000000')
+    arg_parser.add_argument('--frame-rate', type=int, default=60,
+        help='Paced slices per second')
+    arg_parser.add_argument('--turbo', action='store_true',
+        help='Run unthrottled even if --clock is given')
+    arg_parser.add_argument('--shared-ram', action='store_true',
+        help='Keep RAM in shared memory for observers in other processes')
+    arg_parser.add_argument('--record', metavar='LOG',
+        help='Log input and interrupts to LOG for --replay')
+    arg_parser.add_argument('--replay', metavar='LOG',
+        help='Replay a --record log unthrottled and check its state hashes')
+    arg_parser.add_argument('--batch', metavar='MANIFEST',
+        help='Run the jobs of a JSON manifest across all cores')
+    arg_parser.add_argument('--batch-output',
+        help='JSON lines file for the batch results, default stdout')
+    arg_parser.add_argument('--batch-workers', type=int,
+        help='Worker processes, default one per core')
+    arg_parser.add_argument('--bench', action='store_true',
+        help='Run the benchmark suite and compare it with the last run')
+    arg_parser.add_argument('--bench-history', default='bench-history.json',
+        help='JSON file the benchmark results are appended to')
+    arg_parser.add_argument('--bench-repeat', type=int, default=5,
+        help='Timed runs per benchmark')
     args = arg_parser.parse_args()
 
     filename = args.filename
@@ -17,9 +47,37 @@ def main():
     logging.basicConfig(level=logging.INFO, filename='logs/py-i8080.py.log', 
         filemode='w')
 
-    if filename:
-        system = Intel8080System(filename)
-        system.boot()
+    if args.batch:
+        from core import batch
+
+        if not batch.main(args.batch, args.batch_output, args.batch_workers):
+            exit(1)
+    elif args.bench:
+        from core.bench import runner
+
+        if not runner.main(args.bench_history, args.bench_repeat):
+            exit(1)
+    elif filename and args.replay:
+        system = Intel8080System(filename, translate=args.translate,
+            load_address=args.load_address)
+        system.replay(args.replay)
+    elif filename:
+        clock_hz = None if args.turbo else args.clock
+        system = Intel8080System(filename, translate=args.translate,
+            trace=args.trace, clock_hz=clock_hz, frame_rate=args.frame_rate,
+            load_address=args.load_address, shared_ram=args.shared_ram)
+
+        try:
+            if args.record:
+                recorder = system.record(args.record)
+                try:
+                    system.run()
+                finally:
+                    recorder.close()
+            else:
+                system.boot()
+        finally:
+            system.close()
     elif args.test:
         system = Intel8080System(None)
         system.run_tests()